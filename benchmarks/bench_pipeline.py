@@ -0,0 +1,99 @@
+"""End-to-end throughput benchmarks against the offline replay server"""
+
+# standard library
+import argparse
+import datetime
+import json
+import time
+import tracemalloc
+from unittest.mock import patch
+
+# this package
+from health.health import Health
+from health.throttle import TokenBucket
+from health.weight_gurus import WeightGurus
+from benchmarks.replay_server import ReplayServer, SyntheticAccount
+
+USER_INFO = {
+    "garmin": {"username": "user", "password": "password"},
+    "weight-gurus": {"username": "user", "password": "password"},
+}
+
+
+def scenarios(account, hr_days):
+    start = account.start_date.isoformat()
+    hr_start = (account.end_date - datetime.timedelta(hr_days - 1)).isoformat()
+    end = account.end_date.isoformat()
+    return {
+        "body_comp": lambda health: health.get_body_comp_data(start),
+        "activities": lambda health: health.get_activities("cycling", start, end),
+        "heart_rate": lambda health: health.get_heart_rate_data(hr_start, end),
+        "resting_hr": lambda health: health.get_resting_heart_rates(hr_start, end),
+        "sleep": lambda health: health.get_sleep_data(hr_start, end),
+    }
+
+
+def run_scenario(server, scenario, rate):
+    """Run scenario on a fresh Health and return its measurements."""
+
+    def replay_garmin(email, password, rate_limiter=None):
+        return server.garmin(
+            email, password, rate_limiter=rate_limiter or TokenBucket(rate=rate)
+        )
+
+    with patch("health.health.Garmin", side_effect=replay_garmin), patch.object(
+        WeightGurus, "api_url", server.weight_gurus_url
+    ):
+        health = Health(USER_INFO, garmin_session_file=None)
+        server.reset_counters()
+        tracemalloc.start()
+        started = time.perf_counter()
+        scenario(health)
+        wall = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "requests": server.requests,
+        "throttled": server.throttled,
+        "wall_s": round(wall, 3),
+        "requests_per_s": round(server.requests / wall, 1),
+        "response_mb": round(server.bytes_sent / 2**20, 2),
+        "peak_mb": round(peak / 2**20, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--hr-days", type=int, default=60)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0)
+    parser.add_argument("--rate", type=float, default=50.0, help="client requests/s")
+    parser.add_argument("--only", action="append", help="scenario to run")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    account = SyntheticAccount(years=args.years)
+    results = {}
+    with ReplayServer(
+        account, args.latency, args.throttle_rate, args.retry_after
+    ) as server:
+        for name, scenario in scenarios(account, args.hr_days).items():
+            if args.only and name not in args.only:
+                continue
+            results[name] = run_scenario(server, scenario, args.rate)
+
+    columns = ("requests", "throttled", "wall_s", "requests_per_s", "peak_mb")
+    print(f"{'scenario':<12}" + "".join(f"{column:>16}" for column in columns))
+    for name, result in results.items():
+        print(f"{name:<12}" + "".join(f"{result[column]:>16}" for column in columns))
+
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(results, output, indent=4)
+
+
+if __name__ == "__main__":
+    main()
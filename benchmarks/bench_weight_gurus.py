@@ -0,0 +1,94 @@
+"""Compare Weight Gurus delete reconciliation against the original implementation"""
+
+# standard library
+import copy
+import datetime
+import random
+import sys
+import timeit
+
+# this package
+from health.weight_gurus import WeightGurus
+
+
+def make_operations(days, delete_ratio=0.05, seed=0):
+    """Return a synthetic history with about one weigh-in a day and some deletes."""
+    rng = random.Random(seed)
+    start = datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc)
+    operations = []
+    for day in range(days):
+        timestamp = start + datetime.timedelta(days=day, hours=rng.randint(5, 9))
+        operation = {
+            "operationType": "create",
+            "weight": rng.randint(1700, 1900),
+            "serverTimestamp": timestamp.isoformat().replace("+00:00", "Z"),
+            "entryTimestamp": timestamp.isoformat().replace("+00:00", "Z"),
+        }
+        operations.append(operation)
+        if rng.random() < delete_ratio:
+            deleted = dict(operation, operationType="delete")
+            deleted_at = timestamp + datetime.timedelta(minutes=rng.randint(1, 600))
+            deleted["serverTimestamp"] = deleted_at.isoformat().replace("+00:00", "Z")
+            operations.append(deleted)
+    operations.sort(key=lambda operation: operation["serverTimestamp"])
+    return operations
+
+
+def legacy_remove_deleted_operations(operations):
+    """The pop-while-iterating reconciliation this module replaced."""
+
+    def is_earlier(current_operation, deleted_operation):
+        current_date = datetime.datetime.fromisoformat(
+            current_operation["serverTimestamp"].replace("Z", "+00:00")
+        )
+        deleted_date = datetime.datetime.fromisoformat(
+            deleted_operation["serverTimestamp"].replace("Z", "+00:00")
+        )
+        return current_date < deleted_date
+
+    def remove_operation_deleted(operations, deleted_operation):
+        for index, current_operation in enumerate(operations):
+            if (
+                is_earlier(current_operation, deleted_operation)
+                and current_operation["weight"] == deleted_operation["weight"]
+            ):
+                operations.pop(index)
+        return operations
+
+    for index, operation in enumerate(operations):
+        if operation["operationType"] == "delete":
+            deleted_operation = operations.pop(index)
+            operations = remove_operation_deleted(operations, deleted_operation)
+    return operations
+
+
+def main(sizes=(365, 365 * 5, 365 * 20)):
+    print(f"{'entries':>8} {'legacy ms':>10} {'current ms':>11} {'speedup':>8}")
+    for days in sizes:
+        operations = make_operations(days)
+        repeat = 3
+        legacy = min(
+            timeit.repeat(
+                lambda: legacy_remove_deleted_operations(copy.copy(operations)),
+                number=1,
+                repeat=repeat,
+            )
+        )
+        current = min(
+            timeit.repeat(
+                lambda: WeightGurus._remove_deleted_operations(operations),
+                number=1,
+                repeat=repeat,
+            )
+        )
+        print(
+            f"{len(operations):>8} {legacy * 1000:>10.1f} "
+            f"{current * 1000:>11.1f} {legacy / current:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    if sys.argv[1:]:
+        main(tuple(int(size) for size in sys.argv[1:]))
+    else:
+        main()
@@ -0,0 +1,455 @@
+"""Local stand-in for the Garmin Connect and Weight Gurus endpoints
+
+Serves a deterministic synthetic account over plain HTTP so the clients can
+be exercised end to end without network access. Latency and 429 responses
+can be injected to mimic the real services.
+"""
+
+# standard library
+import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+# this package
+from health.garmin import Garmin
+
+ACTIVITY_TYPES = ("cycling", "running")
+DISPLAY_NAME = "replay-user"
+
+
+class SyntheticAccount:
+    """Deterministic multi-year history for one user."""
+
+    def __init__(self, years=3, end_date=None, seed=0):
+        self.end_date = end_date or datetime.date.today()
+        self.start_date = self.end_date - datetime.timedelta(days=365 * years)
+        self.seed = seed
+        self.days = [
+            self.start_date + datetime.timedelta(days)
+            for days in range((self.end_date - self.start_date).days + 1)
+        ]
+        self.weights = self._make_weights()
+        self.activities = self._make_activities()
+        self.operations = self._make_operations()
+
+    def _rng(self, *key):
+        # string seeds are hashed with sha512, so data is stable across runs
+        return random.Random(":".join(map(str, (self.seed,) + key)))
+
+    def _make_weights(self):
+        rng = self._rng("weight")
+        weight = 180.0
+        weights = {}
+        for day in self.days:
+            weight = min(220.0, max(150.0, weight + rng.uniform(-0.6, 0.6)))
+            weights[day] = round(weight, 1)
+        return weights
+
+    def _make_activities(self):
+        activities = []
+        activity_id = 1000
+        for activity_type in ACTIVITY_TYPES:
+            rng = self._rng("activities", activity_type)
+            for day in self.days:
+                if rng.random() < 0.4:
+                    activity_id += 1
+                    start_time = f"{day.isoformat()} 07:{rng.randint(0, 59):02d}:00"
+                    activities.append(
+                        {
+                            "activityId": activity_id,
+                            "activityName": f"Morning {activity_type.title()}",
+                            "startTimeLocal": start_time,
+                            "activityType": {"typeKey": activity_type},
+                            "distance": round(rng.uniform(3000, 60000), 1),
+                            "duration": round(rng.uniform(900, 10800), 1),
+                            "averageHR": rng.randint(110, 165),
+                            "calories": rng.randint(150, 2000),
+                        }
+                    )
+        # the activity list is newest first, like Garmin Connect's
+        activities.sort(key=lambda activity: activity["startTimeLocal"], reverse=True)
+        return activities
+
+    def _make_operations(self):
+        rng = self._rng("operations")
+        operations = []
+        for day in self.days:
+            timestamp = datetime.datetime.combine(
+                day, datetime.time(6, rng.randint(0, 59)), datetime.timezone.utc
+            )
+            operation = {
+                "operationType": "create",
+                "weight": int(self.weights[day] * 10),
+                "bodyFat": rng.randint(150, 250),
+                "muscleMass": rng.randint(380, 450),
+                "water": rng.randint(500, 600),
+                "bmi": rng.randint(220, 280),
+                "entryTimestamp": _wg_timestamp(timestamp),
+                "serverTimestamp": _wg_timestamp(timestamp),
+            }
+            operations.append(operation)
+            if rng.random() < 0.02:
+                deleted_at = timestamp + datetime.timedelta(minutes=5)
+                operations.append(
+                    dict(
+                        operation,
+                        operationType="delete",
+                        serverTimestamp=_wg_timestamp(deleted_at),
+                    )
+                )
+        return operations
+
+    def body_composition(self, startdate, enddate):
+        start = datetime.date.fromisoformat(startdate)
+        end = datetime.date.fromisoformat(enddate)
+        return {
+            "dateWeightList": [
+                {
+                    "calendarDate": day.isoformat(),
+                    "weight": round(weight / 2.2046 * 1000),
+                }
+                for day, weight in self.weights.items()
+                if start <= day <= end
+            ]
+        }
+
+    def activity_list(self, params):
+        start_date = params.get("startDate", "0000")
+        end_date = params.get("endDate", "9999") + " 99"
+        activity_type = params.get("activityType")
+        matching = [
+            activity
+            for activity in self.activities
+            if start_date <= activity["startTimeLocal"] <= end_date
+            and (
+                activity_type is None
+                or activity["activityType"]["typeKey"] == activity_type
+            )
+        ]
+        start = int(params.get("start", 0))
+        return matching[start : start + int(params.get("limit", 20))]
+
+    def heart_rates(self, cdate):
+        day = datetime.date.fromisoformat(cdate)
+        midnight = datetime.datetime.combine(
+            day, datetime.time(), datetime.timezone.utc
+        )
+        start_millis = int(midnight.timestamp() * 1000)
+        rng = self._rng("heart-rate", cdate)
+        resting = rng.randint(45, 60)  # also the first draw in resting_heart_rate
+        values = [
+            [start_millis + minute * 60000, resting + rng.randint(0, 60)]
+            for minute in range(0, 24 * 60, 2)
+        ]
+        return {
+            "userProfilePK": 1,
+            "calendarDate": cdate,
+            "restingHeartRate": resting,
+            "maxHeartRate": max(value[1] for value in values),
+            "minHeartRate": min(value[1] for value in values),
+            "heartRateValues": values,
+        }
+
+    def resting_heart_rate(self, cdate):
+        return self._rng("heart-rate", cdate).randint(45, 60)
+
+    def resting_heart_rates(self, startdate, enddate):
+        start = datetime.date.fromisoformat(startdate)
+        end = datetime.date.fromisoformat(enddate)
+        values = []
+        for days in range((end - start).days + 1):
+            cdate = (start + datetime.timedelta(days)).isoformat()
+            # like Garmin, the range endpoint now and then lacks a day that
+            # dailyHeartRate has
+            if self._rng("resting-gap", cdate).random() >= 0.05:
+                values.append(
+                    {
+                        "calendarDate": cdate,
+                        "value": float(self.resting_heart_rate(cdate)),
+                    }
+                )
+        return {
+            "userProfileId": 1,
+            "statisticsStartDate": startdate,
+            "statisticsEndDate": enddate,
+            "allMetrics": {"metricsMap": {"WELLNESS_RESTING_HEART_RATE": values}},
+        }
+
+    def sleep_data(self, cdate):
+        rng = self._rng("sleep", cdate)
+        if rng.random() < 0.05:
+            # Garmin answers nights without a recording with an empty summary
+            return {"dailySleepDTO": {"calendarDate": cdate}}
+        day = datetime.date.fromisoformat(cdate)
+        start = datetime.datetime.combine(
+            day - datetime.timedelta(1), datetime.time(22, rng.randint(0, 59))
+        )
+        end = start + datetime.timedelta(minutes=rng.randint(360, 540))
+        levels = []
+        seconds = {level: 0 for level in range(4)}
+        stage_start = start
+        while stage_start < end:
+            stage_end = min(
+                end, stage_start + datetime.timedelta(minutes=rng.randint(5, 40))
+            )
+            level = rng.choice((0, 1, 1, 2, 3))
+            seconds[level] += int((stage_end - stage_start).total_seconds())
+            levels.append(
+                {
+                    "startGMT": _garmin_timestamp(stage_start),
+                    "endGMT": _garmin_timestamp(stage_end),
+                    "activityLevel": float(level),
+                }
+            )
+            stage_start = stage_end
+        start_millis = int(
+            start.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000
+        )
+        return {
+            "dailySleepDTO": {
+                "calendarDate": cdate,
+                "sleepStartTimestampGMT": start_millis,
+                "sleepEndTimestampGMT": int(
+                    end.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000
+                ),
+                "sleepTimeSeconds": seconds[0] + seconds[1] + seconds[2],
+                "deepSleepSeconds": seconds[0],
+                "lightSleepSeconds": seconds[1],
+                "remSleepSeconds": seconds[2],
+                "awakeSleepSeconds": seconds[3],
+            },
+            "sleepLevels": levels,
+            # per-minute detail the client does not keep
+            "sleepMovement": [
+                {
+                    "startGMT": _garmin_timestamp(
+                        start + datetime.timedelta(minutes=minute)
+                    ),
+                    "activityLevel": round(rng.uniform(0, 3), 3),
+                }
+                for minute in range(int((end - start).total_seconds() // 60))
+            ],
+        }
+
+    def weight_gurus_operations(self, start):
+        return {
+            "operations": [
+                operation
+                for operation in self.operations
+                if operation["serverTimestamp"] >= start
+            ]
+        }
+
+
+class ReplayServer:
+    """Threaded HTTP server replaying a SyntheticAccount."""
+
+    def __init__(self, account=None, latency=0.0, throttle_rate=0.0, retry_after=0):
+        self.account = account or SyntheticAccount()
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        self.throttled = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(0)
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _handler_for(self))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def address(self):
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    @property
+    def weight_gurus_url(self):
+        return f"http://{self.address}/wg/v3"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.throttled = 0
+            self.bytes_sent = 0
+
+    def garmin(self, email="user", password="password", **kwargs) -> Garmin:
+        """Return a Garmin client whose requests go to this server."""
+        garmin = Garmin(email, password, **kwargs)
+        for client, path in (
+            (garmin.sso_rest_client, "sso"),
+            (garmin.modern_rest_client, "modern"),
+        ):
+            client.scheme = "http"
+            client.baseurl = f"{self.address}/{path}"
+        return garmin
+
+    def _should_throttle(self):
+        with self._lock:
+            self.requests += 1
+            throttle = self._rng.random() < self.throttle_rate
+            if throttle:
+                self.throttled += 1
+            return throttle
+
+    def _count_bytes(self, size):
+        with self._lock:
+            self.bytes_sent += size
+
+
+def _handler_for(server: ReplayServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):  # pylint: disable=arguments-differ
+            pass
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            self._dispatch("GET")
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            length = int(self.headers.get("Content-Length", 0))
+            self.rfile.read(length)
+            self._dispatch("POST")
+
+        def _dispatch(self, method):
+            if server.latency:
+                time.sleep(server.latency)
+            if server._should_throttle():  # pylint: disable=protected-access
+                self._send(
+                    429, b"Too many requests", {"Retry-After": server.retry_after}
+                )
+                return
+
+            url = urlsplit(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            route = ROUTES.get((method, _route_key(url.path)))
+            if route is None:
+                self._send(404, b"Not found")
+                return
+            body, content_type = route(server.account, url.path, params)
+            self._send(200, body, {"Content-Type": content_type})
+
+        def _send(self, status, body, headers=None):
+            if isinstance(body, str):
+                body = body.encode()
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, str(value))
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            server._count_bytes(len(body))  # pylint: disable=protected-access
+
+    return Handler
+
+
+def _route_key(path):
+    # the display name is the last path segment of per-user Garmin endpoints
+    for prefix in PER_USER_PREFIXES:
+        if path.startswith(prefix):
+            return prefix
+    return path
+
+
+def _json(payload):
+    return json.dumps(payload), "application/json"
+
+
+def _sso_signin_page(account, path, params):
+    return '<input type="hidden" name="_csrf" value="replaycsrf01">', "text/html"
+
+
+def _sso_signin_post(account, path, params):
+    return 'var response_url = "/modern?ticket=ST-0000-replay";', "text/html"
+
+
+def _modern_home(account, path, params):
+    page = "\n".join(
+        [
+            "<script>",
+            'window.VIEWER_USERPREFERENCES = {"displayName": "%s", '
+            '"measurementSystem": "statute_us"};' % DISPLAY_NAME,
+            'window.VIEWER_SOCIAL_PROFILE = {"fullName": "Replay User"};',
+            "</script>",
+        ]
+    )
+    return page, "text/html"
+
+
+def _heart_rates(account, path, params):
+    return _json(account.heart_rates(params["date"]))
+
+
+def _resting_heart_rates(account, path, params):
+    return _json(account.resting_heart_rates(params["fromDate"], params["untilDate"]))
+
+
+def _sleep_data(account, path, params):
+    return _json(account.sleep_data(params["date"]))
+
+
+def _body_composition(account, path, params):
+    return _json(account.body_composition(params["startDate"], params["endDate"]))
+
+
+def _activities(account, path, params):
+    return _json(account.activity_list(params))
+
+
+def _weight_gurus_login(account, path, params):
+    expires = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+    return _json({"accessToken": "replay-token", "expiresAt": _wg_timestamp(expires)})
+
+
+def _weight_gurus_operations(account, path, params):
+    return _json(account.weight_gurus_operations(params.get("start", "")))
+
+
+def _garmin_timestamp(timestamp):
+    return timestamp.strftime("%Y-%m-%dT%H:%M:%S.0")
+
+
+def _wg_timestamp(timestamp):
+    return timestamp.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+PER_USER_PREFIXES = (
+    "/modern/proxy/wellness-service/wellness/dailyHeartRate/",
+    "/modern/proxy/userstats-service/wellness/daily/",
+    "/modern/proxy/wellness-service/wellness/dailySleepData/",
+)
+
+ROUTES = {
+    ("GET", "/sso/signin"): _sso_signin_page,
+    ("POST", "/sso/signin"): _sso_signin_post,
+    ("GET", "/modern/"): _modern_home,
+    ("GET", PER_USER_PREFIXES[0]): _heart_rates,
+    ("GET", PER_USER_PREFIXES[1]): _resting_heart_rates,
+    ("GET", PER_USER_PREFIXES[2]): _sleep_data,
+    ("GET", "/modern/proxy/weight-service/weight/dateRange"): _body_composition,
+    (
+        "GET",
+        "/modern/proxy/activitylist-service/activities/search/activities",
+    ): _activities,
+    ("POST", "/wg/v3/account/login"): _weight_gurus_login,
+    ("GET", "/wg/v3/operation/"): _weight_gurus_operations,
+}
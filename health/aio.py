@@ -0,0 +1,559 @@
+"""asyncio clients for Garmin Connect and Weight Gurus
+
+One ConnectionPool is shared by every client on the event loop. It keeps
+HTTP/1.1 keep-alive connections per host and caps how many requests each host
+has in flight, so hundreds of coroutines across many accounts can be gathered
+at once. Rate limits are the same TokenBucket and RateLimiterChain objects the
+threaded clients use; a request awaits its reserved slot instead of sleeping.
+
+Logging in is left to the threaded clients, which run it in a worker thread:
+the Garmin SSO pages need cloudscraper, and Weight Gurus tokens are cached for
+both kinds of client.
+"""
+
+# standard library
+import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
+import gzip
+from http.client import parse_headers
+import io
+import json
+import logging
+import ssl
+import time
+import weakref
+from typing import Any, AsyncIterator, Dict, List, Optional
+from urllib.parse import urlencode, urlsplit
+from urllib.request import Request
+
+# this package
+from health.data_models import BodyCompData, HeartRateDay, SleepNight
+from health.exceptions import (
+    GarminConnectAuthenticationError,
+    GarminConnectConnectionError,
+    GarminConnectTooManyRequestsError,
+    HealthError,
+    WeightGurusConnectionError,
+)
+from health.garmin import RESTING_HEART_RATE_METRIC_ID, ApiClient, Garmin
+from health.metrics import METRICS, redact
+from health.throttle import RetryPolicy
+from health.weight_gurus import (
+    REQUEST_TIMEOUT,
+    WeightGurus,
+    cache_login_reply,
+    cached_token,
+    forget_token,
+)
+
+# requests in flight to one host from one pool
+LIMIT_PER_HOST = 10
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# failures of the connection itself, as opposed to error responses
+TRANSPORT_ERRORS = (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError)
+
+LOGGER = logging.getLogger("main")
+
+# per event loop, one lock per account so concurrent calls log in only once
+_LOGIN_LOCKS = weakref.WeakKeyDictionary()
+
+
+class Response:
+    """A fully read HTTP response."""
+
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.headers.get_content_charset() or "utf-8")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+    def info(self):
+        """Return the headers, as http.cookiejar expects of a response."""
+        return self.headers
+
+
+class _StaleConnection(Exception):
+    """An idle keep-alive connection was closed by the server."""
+
+
+class ConnectionPool:
+    """Keep-alive HTTP/1.1 connections shared by the clients on one event loop.
+
+    At most limit_per_host requests per host are in flight; the rest wait for
+    a slot. timeout is (connect, read) seconds, as for the threaded clients.
+    """
+
+    def __init__(
+        self, limit_per_host=LIMIT_PER_HOST, timeout=REQUEST_TIMEOUT, ssl_context=None
+    ):
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self._idle = defaultdict(list)
+        self._slots = {}
+
+    async def request(self, method, url, headers=None, body=None) -> Response:
+        """Send one request and return the whole response."""
+        parts = urlsplit(url)
+        host = (parts.scheme, parts.hostname, parts.port or DEFAULT_PORTS[parts.scheme])
+        async with self._slot(host):
+            idle = self._idle[host]
+            while idle:
+                connection = idle.pop()
+                try:
+                    return await self._exchange(
+                        host, connection, method, parts, headers, body
+                    )
+                except _StaleConnection:
+                    continue
+            connection = await self._connect(host)
+            try:
+                return await self._exchange(
+                    host, connection, method, parts, headers, body
+                )
+            except _StaleConnection as err:
+                raise ConnectionResetError(f"{url} closed the connection") from err
+
+    @asynccontextmanager
+    async def _slot(self, host):
+        if host not in self._slots:
+            self._slots[host] = asyncio.Semaphore(self.limit_per_host)
+        async with self._slots[host]:
+            yield
+
+    async def _connect(self, host):
+        scheme, hostname, port = host
+        context = None
+        if scheme == "https":
+            context = self.ssl_context or ssl.create_default_context()
+        return await asyncio.wait_for(
+            asyncio.open_connection(hostname, port, ssl=context), self.timeout[0]
+        )
+
+    async def _exchange(self, host, connection, method, parts, headers, body):
+        reader, writer = connection
+        try:
+            response, reusable = await asyncio.wait_for(
+                self._send(reader, writer, method, parts, headers, body),
+                self.timeout[1],
+            )
+        except BaseException:
+            writer.close()
+            raise
+        if reusable:
+            self._idle[host].append(connection)
+        else:
+            writer.close()
+        return response
+
+    @staticmethod
+    async def _send(reader, writer, method, parts, headers, body):
+        target = parts.path or "/"
+        if parts.query:
+            target += f"?{parts.query}"
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {parts.netloc}"]
+        lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        if body is not None:
+            lines.append(f"Content-Length: {len(body)}")
+        lines.append("Accept-Encoding: gzip")
+        head = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+        try:
+            writer.write(head + (body or b""))
+            await writer.drain()
+            status_line = await reader.readline()
+        except ConnectionError as err:
+            raise _StaleConnection from err
+        if not status_line:
+            raise _StaleConnection
+        version, status, _ = (status_line.decode("latin-1").split(None, 2) + [""])[:3]
+        status_code = int(status)
+
+        header_lines = []
+        while True:
+            line = await reader.readline()
+            header_lines.append(line)
+            if line in (b"\r\n", b"\n", b""):
+                break
+        response_headers = parse_headers(io.BytesIO(b"".join(header_lines)))
+
+        reusable = (
+            version == "HTTP/1.1"
+            and response_headers.get("Connection", "").lower() != "close"
+        )
+        if method == "HEAD" or status_code in (204, 304) or status_code < 200:
+            content = b""
+        elif response_headers.get("Transfer-Encoding", "").lower() == "chunked":
+            content = await _read_chunked(reader)
+        elif response_headers.get("Content-Length") is not None:
+            content = await reader.readexactly(int(response_headers["Content-Length"]))
+        else:
+            content = await reader.read()
+            reusable = False
+        if response_headers.get("Content-Encoding", "").lower() == "gzip":
+            content = gzip.decompress(content)
+        return (
+            Response(parts.geturl(), status_code, response_headers, content),
+            reusable,
+        )
+
+    async def close(self):
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+async def _read_chunked(reader) -> bytes:
+    chunks = []
+    while True:
+        size = int((await reader.readline()).split(b";")[0], 16)
+        if size == 0:
+            break
+        chunks.append(await reader.readexactly(size))
+        await reader.readexactly(2)
+    # skip trailers up to the blank line
+    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+        pass
+    return b"".join(chunks)
+
+
+def _login_lock(token_key) -> asyncio.Lock:
+    locks = _LOGIN_LOCKS.setdefault(asyncio.get_running_loop(), {})
+    if token_key not in locks:
+        locks[token_key] = asyncio.Lock()
+    return locks[token_key]
+
+
+async def acquire(rate_limiter) -> float:
+    """Await a slot from a TokenBucket or RateLimiterChain; return seconds waited."""
+    delay = rate_limiter.reserve()
+    if delay:
+        await asyncio.sleep(delay)
+    return delay
+
+
+class AsyncApiClient:
+    """A single API endpoint, like ApiClient but awaited on a ConnectionPool.
+
+    Transport failures that outlast the retry policy raise error. Responses are
+    returned whatever their status; callers decide what an error status means.
+    """
+
+    def __init__(
+        self,
+        pool,
+        baseurl,
+        headers=None,
+        rate_limiter=None,
+        retry_policy=None,
+        scheme="https",
+        cookies=None,
+        error=HealthError,
+    ):
+        self.pool = pool
+        self.baseurl = baseurl
+        self.scheme = scheme
+        self.headers = ApiClient.default_headers.copy() if headers is None else headers
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy(max_retries=0)
+        self.cookies = cookies
+        self.error = error
+
+    def url(self, addurl=None):
+        """Return the url for the API endpoint."""
+        path = f"{self.scheme}://{self.baseurl}"
+        if addurl is not None:
+            path += f"/{addurl}"
+        return path
+
+    async def get(
+        self, addurl, aditional_headers=None, params=None, endpoint=None
+    ) -> Response:
+        return await self._request("GET", addurl, aditional_headers, endpoint, params)
+
+    async def post(
+        self, addurl, aditional_headers=None, params=None, data=None, endpoint=None
+    ) -> Response:
+        LOGGER.debug("Data: %s", redact(data))
+        return await self._request(
+            "POST", addurl, aditional_headers, endpoint, params, data
+        )
+
+    async def _request(
+        self, method, addurl, aditional_headers, endpoint=None, params=None, data=None
+    ) -> Response:
+        """Send a request, throttled and retried as ApiClient._request does."""
+        total_headers = self.headers.copy()
+        if aditional_headers:
+            total_headers.update(aditional_headers)
+        url = self.url(addurl)
+        if params:
+            url += f"?{urlencode(params)}"
+        body = None
+        if data is not None:
+            body = urlencode(data).encode()
+            total_headers.setdefault(
+                "Content-Type", "application/x-www-form-urlencoded"
+            )
+        endpoint = f"{method} {self.baseurl}/{addurl if endpoint is None else endpoint}"
+
+        LOGGER.debug("URL: %s", url)
+        attempt = 0
+        latency = 0.0
+        throttle_wait = 0.0
+        response = None
+        try:
+            while True:
+                if self.rate_limiter:
+                    throttle_wait += await acquire(self.rate_limiter)
+                started = time.perf_counter()
+                try:
+                    response = await self._send(method, url, total_headers, body)
+                except TRANSPORT_ERRORS as err:
+                    latency += time.perf_counter() - started
+                    if not self.retry_policy.should_retry(attempt):
+                        raise self.error(f"{url}: {err!r}") from err
+                    throttle_wait += await self._wait_before_retry(attempt, url, err)
+                    attempt += 1
+                    continue
+                latency += time.perf_counter() - started
+
+                if response.status_code == 429 and self.rate_limiter:
+                    self.rate_limiter.throttled()
+                if self.retry_policy.should_retry(attempt, response.status_code):
+                    throttle_wait += await self._wait_before_retry(
+                        attempt, url, response.status_code, response
+                    )
+                    attempt += 1
+                    continue
+                break
+        finally:
+            METRICS.record(
+                endpoint,
+                latency,
+                len(response.content) if response is not None else 0,
+                response.status_code if response is not None else 0,
+                retries=attempt,
+                throttle_wait=throttle_wait,
+            )
+
+        if self.rate_limiter and response.status_code < 400:
+            self.rate_limiter.succeeded()
+        return response
+
+    async def _send(self, method, url, headers, body) -> Response:
+        if self.cookies is None:
+            return await self.pool.request(method, url, headers, body)
+        # the jar matches cookies to urls the way urllib does
+        request = Request(url, method=method)
+        self.cookies.add_cookie_header(request)
+        if request.has_header("Cookie"):
+            headers = dict(headers, Cookie=request.get_header("Cookie"))
+        response = await self.pool.request(method, url, headers, body)
+        self.cookies.extract_cookies(response, request)
+        return response
+
+    async def _wait_before_retry(self, attempt, url, reason, response=None):
+        delay = self.retry_policy.delay(attempt, response)
+        LOGGER.info("Retrying %s after %s in %.1fs", url, reason, delay)
+        await asyncio.sleep(delay)
+        return delay
+
+
+class AsyncGarmin:
+    """Garmin Connect for asyncio, using the session of a Garmin client.
+
+    The Garmin logs in (or loads a saved session) and supplies the cookies,
+    rate limiter and retry policy; requests then go through pool.
+    """
+
+    def __init__(self, garmin: Garmin, pool: ConnectionPool):
+        self.garmin = garmin
+        client = garmin.modern_rest_client
+        self.modern_rest_client = AsyncApiClient(
+            pool,
+            client.baseurl,
+            headers=client.headers.copy(),
+            rate_limiter=client.rate_limiter,
+            retry_policy=client.retry_policy,
+            scheme=client.scheme,
+            cookies=garmin.session.cookies,
+            error=GarminConnectConnectionError,
+        )
+
+    @property
+    def display_name(self):
+        return self.garmin.display_name
+
+    async def login(self) -> bool:
+        """Log in on a worker thread; the SSO pages need cloudscraper."""
+        return await asyncio.to_thread(self.garmin.login)
+
+    async def _get_json(self, url, params, endpoint=None):
+        response = await self.modern_rest_client.get(
+            url, params=params, endpoint=endpoint
+        )
+        if response.status_code >= 400:
+            LOGGER.debug("Response in exception: %s", response.content)
+            if response.status_code == 429:
+                raise GarminConnectTooManyRequestsError("Too many requests")
+            if response.status_code == 401:
+                raise GarminConnectAuthenticationError("Authentication error")
+            if response.status_code == 403:
+                raise GarminConnectConnectionError(f"Forbidden url: {response.url}")
+            raise GarminConnectConnectionError(
+                f"{response.status_code} error for url: {response.url}"
+            )
+        return response.json()
+
+    async def get_heart_rates(self, cdate) -> Dict[str, Any]:
+        """Fetch available heart rates data 'cDate' format 'YYYY-mm-dd'."""
+        url = f"{self.garmin.garmin_connect_heartrates_daily_url}/{self.display_name}"
+        return await self._get_json(
+            url,
+            {"date": str(cdate)},
+            endpoint=self.garmin.garmin_connect_heartrates_daily_url,
+        )
+
+    async def get_heart_rate_day(self, cdate) -> HeartRateDay:
+        return HeartRateDay.from_json(await self.get_heart_rates(cdate))
+
+    async def get_resting_heart_rates(self, startdate, enddate) -> Dict[str, int]:
+        """Return resting heart rate by calendar date, as Garmin does."""
+        url = f"{self.garmin.garmin_connect_rhr}/{self.display_name}"
+        params = {
+            "fromDate": str(startdate),
+            "untilDate": str(enddate),
+            "metricId": RESTING_HEART_RATE_METRIC_ID,
+        }
+        data = await self._get_json(
+            url, params, endpoint=self.garmin.garmin_connect_rhr
+        )
+        # pylint: disable=protected-access
+        return Garmin._parse_resting_heart_rates(data)
+
+    async def get_body_composition(
+        self, startdate: str, enddate=None
+    ) -> List[BodyCompData]:
+        """Return body composition data for 'startdate' through enddate, default today."""
+        if enddate is None:
+            enddate = time.strftime("%Y-%m-%d")
+        params = {"startDate": str(startdate), "endDate": str(enddate)}
+        data = await self._get_json(self.garmin.garmin_connect_weight_url, params)
+        # pylint: disable=protected-access
+        return Garmin._parse_weight_list(data)
+
+    async def get_sleep_data(self, cdate: str) -> Dict[str, Any]:
+        """Return sleep data for current user."""
+        url = f"{self.garmin.garmin_connect_daily_sleep_url}/{self.display_name}"
+        params = {"date": str(cdate), "nonSleepBufferMinutes": 60}
+        return await self._get_json(
+            url, params, endpoint=self.garmin.garmin_connect_daily_sleep_url
+        )
+
+    async def get_sleep_night(self, cdate: str) -> Optional[SleepNight]:
+        return SleepNight.from_json(await self.get_sleep_data(cdate))
+
+    async def get_activities_by_date(
+        self, startdate, enddate, activitytype
+    ) -> List[dict]:
+        """Return the activities between two 'YYYY-mm-dd' dates, as Garmin does."""
+        return [
+            activity
+            async for activity in self.iter_activities_by_date(
+                startdate, enddate, activitytype
+            )
+        ]
+
+    async def iter_activities_by_date(
+        self, startdate, enddate, activitytype, start=0, max_limit=100
+    ) -> AsyncIterator[dict]:
+        """Yield activities page by page, with pages growing up to max_limit."""
+        params = {"startDate": str(startdate), "endDate": str(enddate)}
+        if activitytype:
+            params["activityType"] = str(activitytype)
+        # pylint: disable=protected-access
+        pages = Garmin._activity_pages(start, max_limit)
+        largest = 0
+        while True:
+            page_start, limit = next(pages)
+            page = await self._get_json(
+                self.garmin.garmin_connect_activities,
+                dict(params, start=str(page_start), limit=str(limit)),
+            )
+            for activity in page:
+                yield activity
+            if Garmin._is_last_page(len(page), limit, largest):
+                return
+            largest = max(largest, len(page))
+            if len(page) < limit:
+                # the server caps pages below limit; go on at pages of its size
+                pages = Garmin._activity_pages(page_start + len(page), len(page))
+
+
+class AsyncWeightGurus:
+    """Weight Gurus for asyncio, sharing the token cache of WeightGurus."""
+
+    def __init__(self, weight_gurus: WeightGurus, pool: ConnectionPool):
+        self.weight_gurus = weight_gurus
+        parts = urlsplit(weight_gurus.api_url)
+        self.client = AsyncApiClient(
+            pool,
+            parts.netloc + parts.path,
+            headers={},
+            rate_limiter=weight_gurus.rate_limiter,
+            retry_policy=weight_gurus.retry_policy,
+            scheme=parts.scheme,
+            error=WeightGurusConnectionError,
+        )
+
+    async def _token(self) -> str:
+        token_key = self.weight_gurus.token_key
+        token = cached_token(token_key)
+        if token is not None:
+            return token
+        async with _login_lock(token_key):
+            # a coroutine that held the lock may have logged in meanwhile
+            token = cached_token(token_key)
+            if token is None:
+                response = await self.client.post(
+                    "account/login", data=self.weight_gurus.login_data
+                )
+                token = cache_login_reply(token_key, response)
+        return token
+
+    async def _get_operations(self, startdate):
+        params = {"start": startdate} if startdate else None
+        response = None
+        for _ in range(2):
+            token = await self._token()
+            response = await self.client.get(
+                "operation/", {"authorization": f"Bearer {token}"}, params
+            )
+            if response.status_code != 401:
+                break
+            # the cached token was revoked early; log in once more
+            forget_token(self.weight_gurus.token_key)
+        # pylint: disable=protected-access
+        return WeightGurus._read_json(response)["operations"]
+
+    async def get_all(self, startdate: str) -> List[BodyCompData]:
+        """Return every entry since startdate, as WeightGurus.get_all does."""
+        operations = await self._get_operations(startdate)
+        # pylint: disable=protected-access
+        return WeightGurus._operations_to_records(operations)
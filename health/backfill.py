@@ -0,0 +1,58 @@
+"""Range-chunked, resumable backfills"""
+
+# standard library
+import datetime
+import logging
+from typing import Callable, List, Tuple
+
+# this package
+from health.store import HealthStore
+
+LOGGER = logging.getLogger("main")
+
+
+def plan_chunks(startdate: str, enddate=None, chunk_days=90) -> List[Tuple[str, str]]:
+    """Split startdate..enddate (default today) into inclusive chunks of chunk_days."""
+    start = datetime.date.fromisoformat(str(startdate))
+    end = (
+        datetime.date.today()
+        if enddate is None
+        else datetime.date.fromisoformat(str(enddate))
+    )
+    chunks = []
+    while start <= end:
+        chunk_end = min(end, start + datetime.timedelta(chunk_days - 1))
+        chunks.append((start.isoformat(), chunk_end.isoformat()))
+        start = chunk_end + datetime.timedelta(1)
+    return chunks
+
+
+def run_backfill(
+    store: HealthStore,
+    job: str,
+    chunks: List[Tuple[str, str]],
+    fetch_chunk: Callable[[str, str], int],
+) -> int:
+    """Run fetch_chunk(start, end) for every chunk not yet checkpointed in store.
+
+    A chunk is checkpointed once fetch_chunk returns, unless it reaches today,
+    whose data is still incomplete. An error stops the backfill; running it
+    again resumes from the first unfinished chunk. Returns the number of chunks
+    fetched.
+    """
+    done = store.completed_chunks(job)
+    today = datetime.date.today().isoformat()
+    pending = [chunk for chunk in chunks if chunk not in done]
+    LOGGER.info("Backfill %s: %d of %d chunks left", job, len(pending), len(chunks))
+    for chunk_start, chunk_end in pending:
+        written = fetch_chunk(chunk_start, chunk_end)
+        if chunk_end < today:
+            store.mark_done(job, chunk_start, chunk_end)
+        LOGGER.info(
+            "Backfill %s: %s to %s done (%d records)",
+            job,
+            chunk_start,
+            chunk_end,
+            written,
+        )
+    return len(pending)
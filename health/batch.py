@@ -0,0 +1,98 @@
+"""Batch sync of many accounts on one worker pool"""
+
+# standard library
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import logging
+import os
+import time
+from typing import Dict, List
+
+# this package
+from health.health import Health
+from health.store import HealthStore
+from health.throttle import RateLimiterChain, TokenBucket
+
+LOGGER = logging.getLogger("main")
+
+
+@dataclass
+class AccountResult:
+    """Outcome of syncing one account"""
+
+    name: str
+    errors: Dict[str, str] = field(default_factory=dict)
+    seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+
+def sync_accounts(
+    accounts: List[dict],
+    store_dir: str,
+    startdate: str,
+    max_workers: int = 4,
+    account_rate: float = 2.0,
+    global_rate: float = 10.0,
+) -> List[AccountResult]:
+    """Sync every account once and return one AccountResult per account, in order.
+
+    Each account is a user_info dict with an extra "name" key. Its data goes
+    to <store_dir>/<name>.db, so a missing name or one containing a path
+    separator fails that account. Requests to each service are limited to
+    account_rate per second for each account and to global_rate per second
+    overall.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    garmin_limiter = _bucket(global_rate)
+    weight_gurus_limiter = _bucket(global_rate)
+
+    def sync_account(account):
+        name = account.get("name")
+        result = AccountResult(name)
+        started = time.perf_counter()
+        try:
+            _check_name(name)
+            health = Health(
+                account,
+                garmin_session_file=os.path.join(
+                    store_dir, f"{name}.garmin_session.json"
+                ),
+                garmin_rate_limiter=RateLimiterChain(
+                    _bucket(account_rate), garmin_limiter
+                ),
+                weight_gurus_rate_limiter=RateLimiterChain(
+                    _bucket(account_rate), weight_gurus_limiter
+                ),
+            )
+            with HealthStore(os.path.join(store_dir, f"{name}.db")) as store:
+                errors = health.sync(store, startdate)
+            result.errors = {dataset: str(err) for dataset, err in errors.items()}
+        except Exception as err:  # pylint: disable=broad-except
+            result.errors = {"account": str(err)}
+        result.seconds = time.perf_counter() - started
+        if result.ok:
+            LOGGER.info("Synced account %s in %.1fs", name, result.seconds)
+        else:
+            LOGGER.error("Account %s failed: %s", name, result.errors)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(sync_account, accounts))
+
+
+def _bucket(rate: float) -> TokenBucket:
+    return TokenBucket(rate=rate, capacity=max(1, int(rate)))
+
+
+def _check_name(name: str):
+    # the name becomes a file name in store_dir and must not escape it
+    separators = {os.sep, os.altsep, "/"} - {None}
+    if (
+        not isinstance(name, str)
+        or name in ("", ".", "..")
+        or any(sep in name for sep in separators)
+    ):
+        raise ValueError(f"Account name {name!r} is not a plain file name")
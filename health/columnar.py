@@ -0,0 +1,258 @@
+"""Compact typed columnar exports read back through memory maps
+
+A file is MAGIC, a little-endian uint32 header length, a JSON header and then
+one block per column. Numeric columns are raw little-endian arrays and string
+columns are int64 offsets followed by UTF-8 text. With compression each block
+is compressed on its own, so reading one column only decompresses that one.
+Rows are sorted by the int64 epoch-millisecond "timestamp" column, which is
+what date ranges are looked up in.
+"""
+
+# standard library
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+import gzip
+import json
+import lzma
+import math
+import mmap
+import struct
+import sys
+from typing import Dict, Iterable, List, Union
+
+# this package
+from health.data_models import BodyCompSeries, HeartRateDay
+from health.helpers import to_end_millis, to_millis
+
+MAGIC = b"HLTHCOL1"
+HEADER_LENGTH = struct.Struct("<I")
+# column blocks start on multiples of this many bytes
+ALIGNMENT = 8
+COMPRESSORS = {"gzip": gzip, "lzma": lzma}
+STRING = "str"
+
+Column = Union[array, List[str]]
+
+# activity fields exported as columns, with their array typecodes
+ACTIVITY_COLUMNS = (
+    ("activity_id", "q", "activityId"),
+    ("distance", "d", "distance"),
+    ("duration", "d", "duration"),
+    ("average_hr", "d", "averageHR"),
+    ("calories", "d", "calories"),
+)
+
+
+def write_columns(path: str, columns: Dict[str, Column], compression=None) -> int:
+    """Write columns of equal length to path and return the number of rows.
+
+    Columns are arrays or lists of str, and must include an int64 "timestamp"
+    column in ascending order. compression is None, "gzip" or "lzma".
+    """
+    if compression is not None and compression not in COMPRESSORS:
+        raise ValueError(f"Unknown compression {compression!r}")
+    timestamps = columns["timestamp"]
+    if any(later < earlier for earlier, later in zip(timestamps, timestamps[1:])):
+        raise ValueError("timestamp column must be in ascending order")
+    rows = len(timestamps)
+    if any(len(column) != rows for column in columns.values()):
+        raise ValueError("columns must all have the same length")
+
+    entries = []
+    blocks = []
+    offset = 0
+    for name, column in columns.items():
+        block = _encode(column)
+        if compression is not None:
+            block = COMPRESSORS[compression].compress(block)
+        offset += -offset % ALIGNMENT
+        entries.append(
+            {
+                "name": name,
+                "type": STRING if isinstance(column, list) else column.typecode,
+                "offset": offset,
+                "length": len(block),
+            }
+        )
+        blocks.append((offset, block))
+        offset += len(block)
+
+    header = json.dumps(
+        {"rows": rows, "compression": compression, "columns": entries}
+    ).encode()
+    with open(path, "wb") as output:
+        output.write(MAGIC + HEADER_LENGTH.pack(len(header)) + header)
+        data_start = _aligned(output.tell())
+        for block_offset, block in blocks:
+            output.seek(data_start + block_offset)
+            output.write(block)
+    return rows
+
+
+def write_body_comp(path: str, series: BodyCompSeries, compression=None) -> int:
+    columns = {"timestamp": series.timestamps}
+    columns.update(series.columns)
+    return write_columns(path, columns, compression)
+
+
+def write_heart_rate_days(
+    path: str, days: Iterable[HeartRateDay], compression=None
+) -> int:
+    """Write the samples of date-ordered days as timestamp and bpm columns."""
+    timestamps, bpm = array("q"), array("B")
+    for day in days:
+        timestamps.extend(day.timestamps)
+        bpm.extend(day.bpm)
+    return write_columns(path, {"timestamp": timestamps, "bpm": bpm}, compression)
+
+
+def write_activities(path: str, activities: Iterable[dict], compression=None) -> int:
+    """Write activities in start time order; missing numbers become NaN."""
+    activities = sorted(activities, key=lambda activity: activity["startTimeLocal"])
+    columns = {
+        "timestamp": array(
+            "q", [to_millis(activity["startTimeLocal"]) for activity in activities]
+        ),
+        "activity_type": [
+            (activity.get("activityType") or {}).get("typeKey", "")
+            for activity in activities
+        ],
+        "name": [activity.get("activityName") or "" for activity in activities],
+    }
+    for name, typecode, key in ACTIVITY_COLUMNS:
+        missing = 0 if typecode == "q" else math.nan
+        columns[name] = array(
+            typecode,
+            [
+                missing if activity.get(key) is None else activity[key]
+                for activity in activities
+            ],
+        )
+    return write_columns(path, columns, compression)
+
+
+class ColumnarFile:
+    """Memory-mapped reader for files written by write_columns."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as source:
+            self._map = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[: len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a columnar export")
+        (header_length,) = HEADER_LENGTH.unpack_from(self._map, len(MAGIC))
+        header_start = len(MAGIC) + HEADER_LENGTH.size
+        header = json.loads(self._map[header_start : header_start + header_length])
+        self.rows = header["rows"]
+        self.compression = header["compression"]
+        self._columns = {entry["name"]: entry for entry in header["columns"]}
+        self._data_start = _aligned(header_start + header_length)
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self._columns)
+
+    def column(self, name: str, start=None, end=None) -> Column:
+        """Return one column, optionally only rows with start <= date <= end.
+
+        start and end are dates or timestamps; an end date includes that whole
+        day. Uncompressed files only read the rows asked for.
+        """
+        low, high = self.row_range(start, end)
+        return self._read(name, low, high)
+
+    def read(self, start=None, end=None, names=None) -> Dict[str, Column]:
+        """Return the named columns (default all) for the rows in a date range."""
+        low, high = self.row_range(start, end)
+        return {name: self._read(name, low, high) for name in names or self.columns}
+
+    def row_range(self, start=None, end=None):
+        """Return the [low, high) row numbers with start <= timestamp <= end."""
+        if start is None and end is None:
+            return 0, self.rows
+        with self._numbers("timestamp") as timestamps:
+            low = 0 if start is None else bisect_left(timestamps, to_millis(start))
+            high = (
+                self.rows
+                if end is None
+                else bisect_right(timestamps, to_end_millis(end))
+            )
+        return low, high
+
+    def _read(self, name: str, low: int, high: int) -> Column:
+        entry = self._columns[name]
+        if entry["type"] == STRING:
+            return self._strings(entry, low, high)
+        with self._numbers(name) as numbers:
+            return _from_little_endian(entry["type"], numbers[low:high])
+
+    @contextmanager
+    def _numbers(self, name: str):
+        # views into the map must be released before it can be closed
+        entry = self._columns[name]
+        with self._block(entry) as block, block.cast(entry["type"]) as numbers:
+            yield numbers
+
+    def _strings(self, entry: dict, low: int, high: int) -> List[str]:
+        boundary = (self.rows + 1) * 8
+        with self._block(entry) as block, block[:boundary] as head:
+            with head.cast("q") as all_offsets:
+                offsets = _from_little_endian("q", all_offsets[low : high + 1])
+            with block[boundary:] as text:
+                return [
+                    str(text[first:last], "utf-8")
+                    for first, last in zip(offsets, offsets[1:])
+                ]
+
+    def _block(self, entry: dict) -> memoryview:
+        start = self._data_start + entry["offset"]
+        with memoryview(self._map) as mapped:
+            block = mapped[start : start + entry["length"]]
+        if self.compression is None:
+            return block
+        with block:
+            return memoryview(COMPRESSORS[self.compression].decompress(block))
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.rows
+
+
+def _encode(column: Column) -> bytes:
+    if not isinstance(column, list):
+        return _to_little_endian(column).tobytes()
+    encoded = [value.encode() for value in column]
+    offsets = array("q", [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    return _to_little_endian(offsets).tobytes() + b"".join(encoded)
+
+
+def _to_little_endian(column: array) -> array:
+    if sys.byteorder == "little":
+        return column
+    swapped = array(column.typecode, column)
+    swapped.byteswap()
+    return swapped
+
+
+def _from_little_endian(typecode: str, values: memoryview) -> array:
+    column = array(typecode)
+    with values, values.cast("B") as raw:
+        column.frombytes(raw)
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column
+
+
+def _aligned(offset: int) -> int:
+    return offset + -offset % ALIGNMENT
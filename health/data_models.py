@@ -1,6 +1,13 @@
 # standard library
-from dataclasses import dataclass
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import asdict, dataclass
 import datetime
+from itertools import compress
+from typing import Iterable, Iterator, Optional
+
+# this package
+from health.helpers import format_timestamp, from_millis, to_end_millis, to_millis
 
 
 @dataclass
@@ -12,7 +19,190 @@ class BodyCompData:
     muscle_mass: float = -1
     water_percentage: float = -1
     bmi: float = -1
-    date: datetime.datetime = -1
+    date: Optional[datetime.datetime] = None
+
+    def to_dict(self) -> dict:
+        """Return a JSON-serialisable dict with the date as an ISO timestamp."""
+        data = asdict(self)
+        if self.date is not None:
+            data["date"] = format_timestamp(self.date)
+        return data
+
+
+class BodyCompSeries:
+    """Date-ordered body composition readings stored as typed columns.
+
+    Timestamps are int64 milliseconds since the epoch (UTC); the readings are
+    double columns that keep -1 for missing values, as BodyCompData does.
+    """
+
+    __slots__ = ("timestamps", "columns")
+
+    fields = ("weight", "body_fat", "muscle_mass", "water_percentage", "bmi")
+
+    def __init__(self, timestamps=None, columns=None):
+        self.timestamps = timestamps if timestamps is not None else array("q")
+        if columns is None:
+            columns = {field: array("d") for field in self.fields}
+        self.columns = columns
+
+    @classmethod
+    def from_records(cls, records: Iterable[BodyCompData]) -> "BodyCompSeries":
+        """Build a series from BodyCompData, sorting them by date if needed."""
+        series = cls()
+        records = sorted(
+            map(_check_date, records), key=lambda record: to_millis(record.date)
+        )
+        for record in records:
+            series.append(record)
+        return series
+
+    def append(self, record: BodyCompData):
+        """Add a record that is not older than the last one in the series."""
+        millis = to_millis(_check_date(record).date)
+        if self.timestamps and millis < self.timestamps[-1]:
+            raise ValueError("BodyCompSeries records must be appended in date order")
+        self.timestamps.append(millis)
+        for field in self.fields:
+            self.columns[field].append(getattr(record, field))
+
+    def merge(self, other: "BodyCompSeries") -> "BodyCompSeries":
+        """Return a new series with the readings of both, merged in linear time."""
+        merged = BodyCompSeries()
+        left, right = 0, 0
+        while left < len(self) or right < len(other):
+            if right == len(other) or (
+                left < len(self) and self.timestamps[left] <= other.timestamps[right]
+            ):
+                merged._append_row(self, left)
+                left += 1
+            else:
+                merged._append_row(other, right)
+                right += 1
+        return merged
+
+    def fuse(
+        self,
+        other: "BodyCompSeries",
+        tolerance=datetime.timedelta(hours=12),
+        other_offset=datetime.timedelta(0),
+        prefer_other=(),
+    ) -> "BodyCompSeries":
+        """Return one record per weigh-in from two series of the same readings.
+
+        A reading of self and one of other are the same weigh-in when their
+        dates, with other_offset added to other's, are within tolerance; each is
+        paired with its nearest counterpart at most once. A fused record keeps
+        self's date and self's value for every field except those named in
+        prefer_other, falling back to the other value where the preferred one
+        is -1. Both series are walked once, so this is linear in their length.
+        """
+        pairs = self._match(
+            other,
+            tolerance // datetime.timedelta(milliseconds=1),
+            other_offset // datetime.timedelta(milliseconds=1),
+        )
+        matched = set(pairs.values())
+        fused = BodyCompSeries()
+        left, right = 0, 0
+        while left < len(self) or right < len(other):
+            if right < len(other) and right in matched:
+                right += 1
+            elif right == len(other) or (
+                left < len(self) and self.timestamps[left] <= other.timestamps[right]
+            ):
+                if left in pairs:
+                    fused._append_fused_row(
+                        self, left, other, pairs[left], prefer_other
+                    )
+                else:
+                    fused._append_row(self, left)
+                left += 1
+            else:
+                fused._append_row(other, right)
+                right += 1
+        return fused
+
+    def _match(self, other: "BodyCompSeries", window: int, offset: int) -> dict:
+        """Pair indexes of self with the nearest reading of other within window."""
+        pairs = {}
+        left, right = 0, 0
+        while left < len(self) and right < len(other):
+            ours = self.timestamps[left]
+            theirs = other.timestamps[right] + offset
+            gap = abs(ours - theirs)
+            if gap > window:
+                if ours < theirs:
+                    left += 1
+                else:
+                    right += 1
+            elif right + 1 < len(other) and (
+                abs(other.timestamps[right + 1] + offset - ours) < gap
+            ):
+                # a later reading of other is closer to ours
+                right += 1
+            elif left + 1 < len(self) and abs(self.timestamps[left + 1] - theirs) < gap:
+                left += 1
+            else:
+                pairs[left] = right
+                left += 1
+                right += 1
+        return pairs
+
+    def between(self, start=None, end=None) -> "BodyCompSeries":
+        """Return the readings with start <= date <= end as a new series.
+
+        An end date without a time includes that whole day.
+        """
+        low = 0 if start is None else bisect_left(self.timestamps, to_millis(start))
+        high = (
+            len(self)
+            if end is None
+            else bisect_right(self.timestamps, to_end_millis(end))
+        )
+        return BodyCompSeries(
+            self.timestamps[low:high],
+            {field: column[low:high] for field, column in self.columns.items()},
+        )
+
+    def mask(self, field: str) -> array:
+        """Return a uint8 column, 1 where field has a reading and 0 where it is -1."""
+        return array("B", [value != -1 for value in self.columns[field]])
+
+    def _append_row(self, source: "BodyCompSeries", index: int):
+        self.timestamps.append(source.timestamps[index])
+        for field in self.fields:
+            self.columns[field].append(source.columns[field][index])
+
+    def _append_fused_row(self, first, first_index, second, second_index, prefer):
+        self.timestamps.append(first.timestamps[first_index])
+        for field in self.fields:
+            preferred, fallback = (
+                first.columns[field][first_index],
+                second.columns[field][second_index],
+            )
+            if field in prefer:
+                preferred, fallback = fallback, preferred
+            self.columns[field].append(fallback if preferred == -1 else preferred)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __getitem__(self, index: int) -> BodyCompData:
+        return BodyCompData(
+            date=from_millis(self.timestamps[index]),
+            **{field: self.columns[field][index] for field in self.fields},
+        )
+
+    def __iter__(self) -> Iterator[BodyCompData]:
+        for index in range(len(self)):
+            yield self[index]
+
+
+def _check_date(record: BodyCompData) -> BodyCompData:
+    if record.date is None:
+        raise ValueError(f"BodyCompSeries records need a date: {record}")
+    return record
 
 
 def clean_heart_rate_data(data: list):
@@ -32,3 +222,152 @@ def remove_low_heart_rate_days(data: list):
         for item in data
         if item["heartRateValues"] and len(item["heartRateValues"]) > 60
     ]
+
+
+class HeartRateDay:
+    """One day of heart-rate samples stored as typed columns.
+
+    timestamps are int64 epoch milliseconds and bpm are uint8, which takes a
+    few bytes per sample instead of a list of two boxed ints.
+    """
+
+    __slots__ = ("date", "resting_heart_rate", "timestamps", "bpm")
+
+    def __init__(self, date: str, resting_heart_rate=None, timestamps=None, bpm=None):
+        self.date = date
+        self.resting_heart_rate = resting_heart_rate
+        self.timestamps = timestamps if timestamps is not None else array("q")
+        self.bpm = bpm if bpm is not None else array("B")
+
+    @classmethod
+    def from_json(cls, data: dict) -> "HeartRateDay":
+        """Decode a dailyHeartRate payload, dropping samples without a reading."""
+        samples = [
+            sample
+            for sample in data.get("heartRateValues") or ()
+            if sample[1] is not None
+        ]
+        return cls(
+            data["calendarDate"],
+            data.get("restingHeartRate"),
+            array("q", [sample[0] for sample in samples]),
+            array("B", [min(sample[1], 255) for sample in samples]),
+        )
+
+    def between_bpm(self, low: int, high: int) -> "HeartRateDay":
+        """Return a copy keeping only samples with low <= bpm <= high."""
+        keep = [low <= value <= high for value in self.bpm]
+        return HeartRateDay(
+            self.date,
+            self.resting_heart_rate,
+            array("q", compress(self.timestamps, keep)),
+            array("B", compress(self.bpm, keep)),
+        )
+
+    def __len__(self) -> int:
+        return len(self.bpm)
+
+
+def clean_heart_rate_days(days: Iterable[HeartRateDay], max_resting=90):
+    """HeartRateDay counterpart of clean_heart_rate_data."""
+    return [
+        day
+        for day in days
+        if len(day)
+        and day.resting_heart_rate is not None
+        and day.resting_heart_rate < max_resting
+    ]
+
+
+def remove_sparse_heart_rate_days(days: Iterable[HeartRateDay], min_samples=60):
+    """HeartRateDay counterpart of remove_low_heart_rate_days."""
+    return [day for day in days if len(day) > min_samples]
+
+
+class SleepNight:
+    """Summary of one night of sleep with its stages as typed columns.
+
+    Stage intervals are int64 epoch milliseconds with a uint8 Garmin activity
+    level (0 deep, 1 light, 2 REM, 3 awake) each; the rest of the dailySleepData
+    payload is dropped.
+    """
+
+    __slots__ = (
+        "date",
+        "start",
+        "end",
+        "sleep_seconds",
+        "deep_seconds",
+        "light_seconds",
+        "rem_seconds",
+        "awake_seconds",
+        "stage_starts",
+        "stage_ends",
+        "stages",
+    )
+
+    summary_fields = (
+        "start",
+        "end",
+        "sleep_seconds",
+        "deep_seconds",
+        "light_seconds",
+        "rem_seconds",
+        "awake_seconds",
+    )
+
+    def __init__(
+        self, date: str, stage_starts=None, stage_ends=None, stages=None, **summary
+    ):
+        self.date = date
+        for field in self.summary_fields:
+            setattr(self, field, summary.get(field))
+        self.stage_starts = stage_starts if stage_starts is not None else array("q")
+        self.stage_ends = stage_ends if stage_ends is not None else array("q")
+        self.stages = stages if stages is not None else array("B")
+
+    @classmethod
+    def from_json(cls, data: dict) -> Optional["SleepNight"]:
+        """Decode a dailySleepData payload; None for a night without sleep."""
+        daily = data.get("dailySleepDTO") or {}
+        if daily.get("sleepStartTimestampGMT") is None:
+            return None
+        levels = data.get("sleepLevels") or ()
+        return cls(
+            daily["calendarDate"],
+            array("q", [to_millis(level["startGMT"]) for level in levels]),
+            array("q", [to_millis(level["endGMT"]) for level in levels]),
+            array("B", [int(level["activityLevel"]) for level in levels]),
+            start=daily["sleepStartTimestampGMT"],
+            end=daily["sleepEndTimestampGMT"],
+            sleep_seconds=daily.get("sleepTimeSeconds"),
+            deep_seconds=daily.get("deepSleepSeconds"),
+            light_seconds=daily.get("lightSleepSeconds"),
+            rem_seconds=daily.get("remSleepSeconds"),
+            awake_seconds=daily.get("awakeSleepSeconds"),
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SleepNight":
+        """Inverse of to_dict."""
+        starts, ends, stages = zip(*data["stages"]) if data["stages"] else ((), (), ())
+        return cls(
+            data["date"],
+            array("q", starts),
+            array("q", ends),
+            array("B", stages),
+            **{field: data.get(field) for field in cls.summary_fields},
+        )
+
+    def to_dict(self) -> dict:
+        """Return the night as a compact JSON-serialisable dict."""
+        data = {"date": self.date}
+        data.update((field, getattr(self, field)) for field in self.summary_fields)
+        data["stages"] = [
+            list(stage)
+            for stage in zip(self.stage_starts, self.stage_ends, self.stages)
+        ]
+        return data
+
+    def __len__(self) -> int:
+        return len(self.stages)
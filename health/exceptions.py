@@ -16,3 +16,11 @@ class GarminConnectTooManyRequestsError(HealthError):
 
 class GarminConnectAuthenticationError(HealthError):
     """Raised when authentication is failed."""
+
+
+class WeightGurusConnectionError(HealthError):
+    """Raised when communication with Weight Gurus ended in error."""
+
+
+class WeightGurusAuthenticationError(HealthError):
+    """Raised when Weight Gurus authentication is failed."""
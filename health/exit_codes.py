@@ -1 +1,2 @@
 EXIT_SUCCESS = 0
+EXIT_FAILURE = 1
@@ -0,0 +1,16 @@
+"""Bounded-concurrency fetching of per-day data"""
+
+# standard library
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List
+
+
+def fetch_by_date(fetch: Callable, dates: Iterable[str], max_workers: int = 8) -> List:
+    """Call fetch(date) for every date concurrently and return results in date order.
+
+    Rate limits are handled by the API client fetch calls into: its shared rate
+    limiter slows every worker down and its retry policy retries the request, so
+    a rate-limit error reaching this function is final.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(fetch, dates))
@@ -24,25 +24,35 @@
 # -*- coding: utf-8 -*-
 """Python 3 API wrapper for Garmin Connect to get your statistics."""
 # standard library
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import json
 import logging
+import os
 import re
-from typing import Any, Dict, List
+import time
+from typing import Any, Dict, List, Optional
 import requests
 
 # third party
 import cloudscraper
 
 # this package
-from health.data_models import BodyCompData
+from health.data_models import BodyCompData, HeartRateDay, SleepNight
 from health.exceptions import (
     GarminConnectConnectionError,
     GarminConnectTooManyRequestsError,
     GarminConnectAuthenticationError,
 )
+from health.helpers import parse_timestamp
+from health.metrics import METRICS, redact
+from health.throttle import RetryPolicy, TokenBucket
 
 LOGGER = logging.getLogger("main")
+# userstats-service metric id of WELLNESS_RESTING_HEART_RATE
+RESTING_HEART_RATE_METRIC_ID = 60
 
 
 class ApiClient:
@@ -53,10 +63,22 @@ class ApiClient:
         "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.14; rv:66.0) Gecko/20100101 Firefox/66.0"
     }
 
-    def __init__(self, session, baseurl, headers=None, aditional_headers=None):
+    def __init__(
+        self,
+        session,
+        baseurl,
+        headers=None,
+        aditional_headers=None,
+        rate_limiter=None,
+        retry_policy=None,
+        scheme="https",
+    ):
         """Return a new Client instance."""
         self.session = session
         self.baseurl = baseurl
+        self.scheme = scheme
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy(max_retries=0)
 
         if headers:
             self.headers = headers
@@ -69,57 +91,85 @@ class ApiClient:
     def url(self, addurl=None):
         """Return the url for the API endpoint."""
 
-        path = f"https://{self.baseurl}"
+        path = f"{self.scheme}://{self.baseurl}"
         if addurl is not None:
             path += f"/{addurl}"
 
         return path
 
-    def get(self, addurl, aditional_headers=None, params=None):
+    def get(self, addurl, aditional_headers=None, params=None, endpoint=None):
         """Make an API call using the GET method."""
-        total_headers = self.headers.copy()
-        if aditional_headers:
-            total_headers.update(aditional_headers)
-        url = self.url(addurl)
-
-        LOGGER.debug("URL: %s", url)
-        LOGGER.debug("Headers: %s", total_headers)
+        return self._request("GET", addurl, aditional_headers, endpoint, params=params)
 
-        try:
-            response = self.session.get(url, headers=total_headers, params=params)
-            response.raise_for_status()
-            # LOGGER.debug("Response: %s", response.content)
-            return response
-        except Exception as err:
-            LOGGER.debug("Response in exception: %s", response.content)
-            if response.status_code == 429:
-                raise GarminConnectTooManyRequestsError("Too many requests") from err
-            if response.status_code == 401:
-                raise GarminConnectAuthenticationError("Authentication error") from err
-            if response.status_code == 403:
-                raise GarminConnectConnectionError(f"Forbidden url: {url}") from err
+    def post(self, addurl, aditional_headers, params, data, endpoint=None):
+        """Make an API call using the POST method."""
+        LOGGER.debug("Data: %s", redact(data))
+        return self._request(
+            "POST", addurl, aditional_headers, endpoint, params=params, data=data
+        )
 
-            raise GarminConnectConnectionError(err) from err
+    def _request(self, method, addurl, aditional_headers, endpoint=None, **kwargs):
+        """Send a request, throttled by the rate limiter and retried per the policy.
 
-    def post(self, addurl, aditional_headers, params, data):
-        """Make an API call using the POST method."""
+        Each call is recorded in METRICS under endpoint, which defaults to the
+        url without its query; pass one for urls that embed per-user values.
+        """
         total_headers = self.headers.copy()
         if aditional_headers:
             total_headers.update(aditional_headers)
         url = self.url(addurl)
+        if endpoint is None:
+            endpoint = f"{method} {self.baseurl}/{addurl}"
+        else:
+            endpoint = f"{method} {self.baseurl}/{endpoint}"
 
         LOGGER.debug("URL: %s", url)
-        LOGGER.debug("Headers: %s", total_headers)
-        LOGGER.debug("Data: %s", data)
+        LOGGER.debug("Headers: %s", redact(total_headers))
 
+        attempt = 0
+        latency = 0.0
+        throttle_wait = 0.0
+        response = None
         try:
-            response = self.session.post(
-                url, headers=total_headers, params=params, data=data
+            while True:
+                if self.rate_limiter:
+                    throttle_wait += self.rate_limiter.acquire()
+                started = time.perf_counter()
+                try:
+                    response = self.session.request(
+                        method, url, headers=total_headers, **kwargs
+                    )
+                except requests.RequestException as err:
+                    latency += time.perf_counter() - started
+                    if not self.retry_policy.should_retry(attempt):
+                        raise GarminConnectConnectionError(err) from err
+                    throttle_wait += self._wait_before_retry(attempt, url, err)
+                    attempt += 1
+                    continue
+                latency += time.perf_counter() - started
+
+                if response.status_code == 429 and self.rate_limiter:
+                    self.rate_limiter.throttled()
+                if self.retry_policy.should_retry(attempt, response.status_code):
+                    throttle_wait += self._wait_before_retry(
+                        attempt, url, response.status_code, response
+                    )
+                    attempt += 1
+                    continue
+                break
+        finally:
+            METRICS.record(
+                endpoint,
+                latency,
+                len(response.content) if response is not None else 0,
+                response.status_code if response is not None else 0,
+                retries=attempt,
+                throttle_wait=throttle_wait,
             )
+
+        try:
             response.raise_for_status()
-            # LOGGER.debug("Response: %s", response.content)
-            return response
-        except Exception as err:
+        except requests.HTTPError as err:
             LOGGER.debug("Response in exception: %s", response.content)
             if response.status_code == 429:
                 raise GarminConnectTooManyRequestsError("Too many requests") from err
@@ -130,12 +180,29 @@ class ApiClient:
 
             raise GarminConnectConnectionError(err) from err
 
+        if self.rate_limiter:
+            self.rate_limiter.succeeded()
+        # LOGGER.debug("Response: %s", response.content)
+        return response
+
+    def _wait_before_retry(self, attempt, url, reason, response=None):
+        delay = self.retry_policy.delay(attempt, response)
+        LOGGER.info("Retrying %s after %s in %.1fs", url, reason, delay)
+        time.sleep(delay)
+        return delay
+
 
 class Garmin:
     """Class for fetching data from Garmin Connect."""
 
-    def __init__(self, email, password, is_cn=False):
-        """Create a new class instance."""
+    def __init__(
+        self, email, password, is_cn=False, rate_limiter=None, retry_policy=None
+    ):
+        """Create a new class instance.
+
+        rate_limiter and retry_policy are shared by every client on the session;
+        by default requests are limited to 5 per second and retried 5 times.
+        """
 
         self.username = email
         self.password = password
@@ -176,15 +243,21 @@ class Garmin:
         self.garmin_headers = {"NK": "NT"}
 
         self.session = cloudscraper.CloudScraper()
+        self.rate_limiter = rate_limiter or TokenBucket()
+        self.retry_policy = retry_policy or RetryPolicy()
         self.sso_rest_client = ApiClient(
             self.session,
             self.garmin_connect_sso_url,
             aditional_headers=self.garmin_headers,
+            rate_limiter=self.rate_limiter,
+            retry_policy=self.retry_policy,
         )
         self.modern_rest_client = ApiClient(
             self.session,
             self.garmin_connect_modern_url,
             aditional_headers=self.garmin_headers,
+            rate_limiter=self.rate_limiter,
+            retry_policy=self.retry_policy,
         )
 
         self.display_name = None
@@ -205,7 +278,7 @@ class Garmin:
     def login(self):
         """Login to Garmin Connect."""
 
-        LOGGER.debug("login: %s %s", self.username, self.password)
+        LOGGER.debug("login: %s", self.username)
         LOGGER.info("Logging in to Garmin Connect...")
         get_headers = {"Referer": self.garmin_connect_login_url}
         params = {
@@ -294,6 +367,59 @@ class Garmin:
 
         return True
 
+    def save_session(self, path):
+        """Persist session cookies and profile so a later run can skip login()."""
+        state = {
+            "username": self.username,
+            "cookies": [
+                {
+                    "name": cookie.name,
+                    "value": cookie.value,
+                    "domain": cookie.domain,
+                    "path": cookie.path,
+                }
+                for cookie in self.session.cookies
+            ],
+            "display_name": self.display_name,
+            "full_name": self.full_name,
+            "unit_system": self.unit_system,
+        }
+        descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, "w") as session_file:
+            json.dump(state, session_file)
+        LOGGER.debug("Saved Garmin session to %s", path)
+
+    def load_session(self, path):
+        """Restore a session saved by save_session(), returning False if unusable.
+
+        A session saved for another username is unusable too, so changing the
+        account in user_info never reuses the previous account's cookies.
+        """
+        try:
+            with open(path) as session_file:
+                state = json.load(session_file)
+        except (OSError, ValueError):
+            return False
+
+        if state.get("username") != self.username:
+            LOGGER.warning("Ignoring Garmin session %s saved for another account", path)
+            return False
+        if not state.get("display_name"):
+            return False
+
+        for cookie in state["cookies"]:
+            self.session.cookies.set(
+                cookie["name"],
+                cookie["value"],
+                domain=cookie["domain"],
+                path=cookie["path"],
+            )
+        self.display_name = state["display_name"]
+        self.full_name = state["full_name"]
+        self.unit_system = state["unit_system"]
+        LOGGER.debug("Loaded Garmin session from %s", path)
+        return True
+
     def get_heart_rates(self, cdate):  #
         """Fetch available heart rates data 'cDate' format 'YYYY-mm-dd'."""
 
@@ -302,9 +428,42 @@ class Garmin:
         params = {"date": str(cdate)}
         LOGGER.debug("Requesting heart rates")
 
-        data = self.modern_rest_client.get(url, params=params).json()
+        data = self.modern_rest_client.get(
+            url, params=params, endpoint=self.garmin_connect_heartrates_daily_url
+        ).json()
         return data
 
+    def get_resting_heart_rates(self, startdate, enddate) -> Dict[str, int]:
+        """Return resting heart rate by calendar date for 'startdate' through 'enddate', format 'YYYY-mm-dd'.
+
+        The whole range is one request; days without a value are left out.
+        """
+        url = f"{self.garmin_connect_rhr}/{self.display_name}"
+        params = {
+            "fromDate": str(startdate),
+            "untilDate": str(enddate),
+            "metricId": RESTING_HEART_RATE_METRIC_ID,
+        }
+        LOGGER.debug("Requesting resting heart rates")
+
+        data = self.modern_rest_client.get(
+            url, params=params, endpoint=self.garmin_connect_rhr
+        ).json()
+        return self._parse_resting_heart_rates(data)
+
+    @staticmethod
+    def _parse_resting_heart_rates(data) -> Dict[str, int]:
+        metrics = (data.get("allMetrics") or {}).get("metricsMap") or {}
+        return {
+            entry["calendarDate"]: int(entry["value"])
+            for entry in metrics.get("WELLNESS_RESTING_HEART_RATE") or ()
+            if entry.get("value") is not None
+        }
+
+    def get_heart_rate_day(self, cdate) -> HeartRateDay:
+        """Return heart rates for 'cDate' decoded into typed columns."""
+        return HeartRateDay.from_json(self.get_heart_rates(cdate))
+
     def get_body_composition(self, startdate: str, enddate=None) -> List[BodyCompData]:
         """Return available body composition data for 'startdate' format 'YYYY-mm-dd' through enddate 'YYYY-mm-dd'."""
         LOGGER.info("Requesting body composition data")
@@ -314,26 +473,34 @@ class Garmin:
         params = {"startDate": str(startdate), "endDate": str(enddate)}
 
         data = self.modern_rest_client.get(url, params=params).json()
+        return self._parse_weight_list(data)
+
+    @staticmethod
+    def _parse_weight_list(data) -> List[BodyCompData]:
         weight_list = data["dateWeightList"]
+        weights = Garmin._gm_nums_to_lbs_floats(
+            [entry["weight"] for entry in weight_list]
+        )
         body_history = []
-        for entry in weight_list:
-            body_data: BodyCompData = self._parse_body_comp_entry(entry)
+        for entry, weight in zip(weight_list, weights):
+            body_data = BodyCompData(
+                weight=weight, date=parse_timestamp(entry["calendarDate"])
+            )
             body_history.append(body_data)
 
         return body_history
 
-    @staticmethod
-    def _parse_body_comp_entry(entry):
-        weight = Garmin._gm_num_to_lbs_float(entry["weight"])
-        date = entry["calendarDate"]
-        return BodyCompData(weight=weight, date=date)
-
     @staticmethod
     def _gm_num_to_lbs_float(num):
         kilograms = num / 1000
         lbs = kilograms * 2.2046
         return lbs
 
+    @staticmethod
+    def _gm_nums_to_lbs_floats(nums) -> array:
+        """Convert a column of gram readings to pounds, with -1 for missing ones."""
+        return array("d", [-1 if num is None else num / 1000 * 2.2046 for num in nums])
+
     def get_sleep_data(self, cdate: str) -> Dict[str, Any]:
         """Return sleep data for current user."""
 
@@ -342,7 +509,13 @@ class Garmin:
 
         LOGGER.debug("Requesting sleep data")
 
-        return self.modern_rest_client.get(url, params=params).json()
+        return self.modern_rest_client.get(
+            url, params=params, endpoint=self.garmin_connect_daily_sleep_url
+        ).json()
+
+    def get_sleep_night(self, cdate: str) -> Optional[SleepNight]:
+        """Return sleep for 'cDate' in compact form, or None if none was recorded."""
+        return SleepNight.from_json(self.get_sleep_data(cdate))
 
     def get_activities(self, start, limit):
         """Return available activities."""
@@ -363,33 +536,98 @@ class Garmin:
                              multi_sport, fitness_equipment, hiking, walking, other]
         :return: list of JSON activities
         """
+        return list(self.iter_activities_by_date(startdate, enddate, activitytype))
+
+    def iter_activities_by_date(
+        self, startdate, enddate, activitytype, start=0, prefetch=1, max_limit=100
+    ):
+        """
+        Yield available activities between specific dates one page at a time
+        :param startdate: String in the format YYYY-MM-DD
+        :param enddate: String in the format YYYY-MM-DD
+        :param activitytype: (Optional) Type of activity you are searching
+        :param start: Number of activities to skip, e.g. to resume a listing
+        :param prefetch: Number of pages to keep in flight at once
+        :param max_limit: Largest page size to grow to
+        :return: generator of JSON activities
+        """
         LOGGER.info("Requesting activities of type %s", activitytype)
-        activities = []
-        start = 0
-        limit = 20
-        # mimicking the behavior of the web interface that fetches 20 activities at a time
-        # and automatically loads more on scroll
         url = self.garmin_connect_activities
         params = {
             "startDate": str(startdate),
             "endDate": str(enddate),
-            "start": str(start),
-            "limit": str(limit),
         }
         if activitytype:
             params["activityType"] = str(activitytype)
 
-        while True:
-            params["start"] = str(start)
-            LOGGER.debug(f"Requesting activities {start} to {start+limit}")
-            act = self.modern_rest_client.get(url, params=params).json()
-            if act:
-                activities.extend(act)
-                start = start + limit
-            else:
-                break
+        def fetch_page(page_start, limit):
+            LOGGER.debug(f"Requesting activities {page_start} to {page_start+limit}")
+            page_params = dict(params, start=str(page_start), limit=str(limit))
+            return self.modern_rest_client.get(url, params=page_params).json()
+
+        pages = self._activity_pages(start, max_limit)
+        largest = 0
+        # pages in flight grow by one with each full page, so short listings,
+        # such as a nightly sync, are fetched one page at a time
+        full_pages = 0
+        with ThreadPoolExecutor(max_workers=prefetch) as executor:
+            in_flight = deque()
+
+            def submit(count):
+                for _ in range(count):
+                    page_start, limit = next(pages)
+                    in_flight.append(
+                        (
+                            page_start,
+                            limit,
+                            executor.submit(fetch_page, page_start, limit),
+                        )
+                    )
+
+            try:
+                submit(1)
+                while True:
+                    page_start, limit, future = in_flight.popleft()
+                    act = future.result()
+                    yield from act
+                    if self._is_last_page(len(act), limit, largest):
+                        break
+                    largest = max(largest, len(act))
+                    if len(act) < limit:
+                        # either the end or a server cap below limit; the pages
+                        # in flight start too late for the latter, so probe
+                        # with one page of this size
+                        for _, _, pending in in_flight:
+                            pending.cancel()
+                        in_flight.clear()
+                        pages = self._activity_pages(page_start + len(act), len(act))
+                        submit(1)
+                    else:
+                        full_pages += 1
+                        submit(min(full_pages, prefetch) - len(in_flight))
+            finally:
+                # also when the caller closes the generator early or a page fails
+                for _, _, pending in in_flight:
+                    pending.cancel()
+
+    @staticmethod
+    def _is_last_page(size, limit, largest):
+        """Whether a page of size activities, asked for with limit, ends the listing.
 
-        return activities
+        The server may cap pages below limit, so a short page only ends the listing
+        when it is empty or smaller than largest, the biggest page returned before.
+        """
+        return size == 0 or size < min(limit, largest)
+
+    @staticmethod
+    def _activity_pages(start, max_limit):
+        """Yield (start, limit) for consecutive pages, doubling limit up to max_limit."""
+        # the first page matches the web interface, which fetches 20 activities at a time
+        limit = min(20, max_limit)
+        while True:
+            yield start, limit
+            start += limit
+            limit = min(limit * 2, max_limit)
 
     def logout(self):
         """Log user out of session."""
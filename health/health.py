@@ -2,72 +2,498 @@
 
 # standard library
 import datetime
+from functools import partial
+import importlib
 import logging
-from typing import List
-from health.data_models import BodyCompData
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional
+from health.data_models import (
+    BodyCompData,
+    BodyCompSeries,
+    HeartRateDay,
+    SleepNight,
+)
 
 # third party
 
 # this package
-from health.weight_gurus import WeightGurus
-from health.garmin import Garmin
+from health.exceptions import GarminConnectAuthenticationError
+from health.backfill import plan_chunks, run_backfill
+from health.fetcher import fetch_by_date
+from health.orchestrator import run_concurrently
+from health.rollups import (
+    ROLLUP_SOURCE,
+    Rollup,
+    daily_heart_rate,
+    day_bucket,
+    update_rollup,
+    week_bucket,
+    weekly_weight,
+)
+from health.helpers import date_range, format_timestamp
+from health.store import HealthStore
 
+if TYPE_CHECKING:
+    from health.garmin import Garmin
 
-# INIT LOGGER THAT PRINTS DEBUG MESSAGES
-logFormat = "%(asctime)s: %(levelname)s: %(message)s"
-logging.basicConfig(format=logFormat, level=logging.INFO)
 LOGGER = logging.getLogger("main")
-LOGGER.addHandler(logging.StreamHandler())
 
+GARMIN_SESSION_FILE = "garmin_session.json"
+# Garmin body composition only carries a calendarDate, so it is matched
+# against Weight Gurus readings taken within half a day of that day's noon
+GARMIN_DATE_OFFSET = datetime.timedelta(hours=12)
+BODY_COMP_TOLERANCE = datetime.timedelta(hours=12)
+# days per userstats range request for resting heart rate
+RESTING_HR_CHUNK_DAYS = 90
+# the API clients pull in requests and cloudscraper, so they are only
+# imported once a Health actually talks to that service
+SOURCE_CLIENTS = {"Garmin": "health.garmin", "WeightGurus": "health.weight_gurus"}
+
+
+def __getattr__(name):
+    if name not in SOURCE_CLIENTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    client = getattr(importlib.import_module(SOURCE_CLIENTS[name]), name)
+    globals()[name] = client
+    return client
+
+
+def _client(name):
+    # module attributes rather than bare names, so tests can patch them
+    return globals().get(name) or __getattr__(name)
 
 
 class Health:
-    def __init__(self, user_info) -> None:
+    def __init__(
+        self,
+        user_info,
+        garmin_session_file=GARMIN_SESSION_FILE,
+        garmin_rate_limiter=None,
+        weight_gurus_rate_limiter=None,
+    ) -> None:
         self.garmin_username = user_info["garmin"]["username"]
         self.garmin_password = user_info["garmin"]["password"]
         self.wg_username = user_info["weight-gurus"]["username"]
         self.wg_password = user_info["weight-gurus"]["password"]
+        self.garmin_session_file = garmin_session_file
+        self.garmin_rate_limiter = garmin_rate_limiter
+        self.weight_gurus_rate_limiter = weight_gurus_rate_limiter
+        self._garmin = None
+        self._garmin_logins = 0
+        self._garmin_lock = threading.Lock()
 
     def get_body_comp_data(self, startdate: str) -> List[BodyCompData]:
         """Return available body composition data for 'startdate' format 'YYYY-mm-dd' through enddate 'YYYY-mm-dd'."""
-        wg_comp_data = self._get_weight_gurus_body_comp_data(startdate)
-        garmin_comp_data = self._get_garmin_body_comp_data(startdate)
-        data = wg_comp_data + garmin_comp_data
-        data.sort(key=lambda body_comp: body_comp.date, reverse=False)
-        return data
+        return list(self.get_body_comp_series(startdate))
+
+    def get_body_comp_series(self, startdate: str) -> BodyCompSeries:
+        """Return body composition data from every source as one date-ordered series.
+
+        A weigh-in synced to both services appears once, with the Weight Gurus
+        readings and timestamp and Garmin's weight only where Weight Gurus has
+        none.
+        """
+        results, errors = run_concurrently(
+            {
+                "weight-gurus": lambda: BodyCompSeries.from_records(
+                    self._get_weight_gurus_body_comp_data(startdate)
+                ),
+                "garmin": lambda: BodyCompSeries.from_records(
+                    self._get_garmin_body_comp_data(startdate)
+                ),
+            }
+        )
+        if errors:
+            raise next(iter(errors.values()))
+        return self._fuse_body_comp(results["weight-gurus"], results["garmin"])
+
+    @staticmethod
+    def _fuse_body_comp(weight_gurus: BodyCompSeries, garmin: BodyCompSeries):
+        return weight_gurus.fuse(
+            garmin, tolerance=BODY_COMP_TOLERANCE, other_offset=GARMIN_DATE_OFFSET
+        )
+
+    @staticmethod
+    def query(store: HealthStore, metric: str, start=None, end=None) -> list:
+        """Return (date, value) pairs of metric in store with start <= date <= end.
+
+        metric is a BodyCompData field, "resting_heart_rate", a rollup name such
+        as "weight_weekly", or the name of a stored metric such as "cycling";
+        for the last two the stored payloads are returned as values. Lookups
+        use the store's in-memory indexes and never touch the network, so
+        no credentials are needed either.
+        """
+        if metric in BodyCompSeries.fields:
+            series = Health._fuse_body_comp(
+                Health._stored_body_comp(store, "weight-gurus", start, end),
+                Health._stored_body_comp(store, "garmin", start, end),
+            )
+            return [
+                (format_timestamp(record.date), getattr(record, metric))
+                for record in series
+                if getattr(record, metric) != -1
+            ]
+        if metric == "resting_heart_rate":
+            # read from the daily rollup, so the raw per-minute payloads are
+            # not loaded; only days changed since its last update are decoded
+            rollup = Health._rollups()[0]
+            update_rollup(store, rollup)
+            days = store.index(ROLLUP_SOURCE, rollup.name).range(start, end)
+            return [
+                (date, summary["resting_heart_rate"])
+                for date, summary in days
+                if summary.get("resting_heart_rate") is not None
+            ]
+        if metric in {rollup.name for rollup in Health._rollups()}:
+            return store.index(ROLLUP_SOURCE, metric).range(start, end)
+        # empty payloads mark days without data, such as nights without sleep
+        rows = store.index("garmin", metric).range(start, end)
+        return [(date, payload) for date, payload in rows if payload]
+
+    @staticmethod
+    def update_rollups(store: HealthStore, full=False) -> int:
+        """Bring the daily heart-rate and weekly weight rollups in store up to date.
+
+        Only buckets with data written or deleted since the last update are
+        recomputed, unless full is set. Returns the number of buckets recomputed.
+        """
+        return sum(update_rollup(store, rollup, full) for rollup in Health._rollups())
+
+    @staticmethod
+    def _rollups():
+        return (
+            Rollup(
+                "heart_rate_daily",
+                (("garmin", "heart_rate"),),
+                day_bucket,
+                Health._heart_rate_day_rollup,
+            ),
+            Rollup(
+                "weight_weekly",
+                (("weight-gurus", "body_composition"), ("garmin", "body_composition")),
+                week_bucket,
+                Health._weight_week_rollup,
+            ),
+        )
+
+    @staticmethod
+    def _heart_rate_day_rollup(store: HealthStore, first: str, last: str):
+        days = store.load("garmin", "heart_rate", first, last)
+        return daily_heart_rate(HeartRateDay.from_json(days[0])) if days else None
+
+    @staticmethod
+    def _weight_week_rollup(store: HealthStore, first: str, last: str):
+        return weekly_weight(
+            Health._fuse_body_comp(
+                Health._stored_body_comp(store, "weight-gurus", first, last),
+                Health._stored_body_comp(store, "garmin", first, last),
+            )
+        )
+
+    @staticmethod
+    def _stored_body_comp(store: HealthStore, source: str, start, end):
+        records = store.index(source, "body_composition").range(start, end)
+        return BodyCompSeries.from_records(
+            BodyCompData(**payload) for _, payload in records
+        )
 
     def get_activities(self, activity_type: str, start_date: str, end_date=None) -> list:
-        if not end_date:
-            end_date = datetime.date.today().isoformat()
-        garmin = Garmin(self.garmin_username, self.garmin_password)
-        garmin.login()
-        activities = garmin.get_activities_by_date(start_date, end_date, activity_type)
+        activities = list(self.iter_activities(activity_type, start_date, end_date))
 
         return activities
 
+    def iter_activities(
+        self, activity_type: str, start_date: str, end_date=None, prefetch=4
+    ):
+        """Yield activities as each page arrives, resuming after a re-login."""
+        if not end_date:
+            end_date = datetime.date.today().isoformat()
+        yielded = 0
+        garmin, logins = self._get_garmin()
+        try:
+            for activity in garmin.iter_activities_by_date(
+                start_date, end_date, activity_type, prefetch=prefetch
+            ):
+                yielded += 1
+                yield activity
+            return
+        except GarminConnectAuthenticationError:
+            LOGGER.info("Garmin session expired, logging in again")
+            self._login_garmin(garmin, logins)
+        yield from garmin.iter_activities_by_date(
+            start_date, end_date, activity_type, start=yielded, prefetch=prefetch
+        )
+
     def _get_garmin_body_comp_data(self, startdate, enddate=None) -> List[BodyCompData]:
-        garmin = Garmin(self.garmin_username, self.garmin_password)
-        garmin.login()
-        data = garmin.get_body_composition(startdate)
+        data = self._call_garmin("get_body_composition", startdate, enddate)
         return data
 
     def _get_weight_gurus_body_comp_data(self, startdate: str) -> List[BodyCompData]:
-        weight_gurus = WeightGurus(self.wg_username, self.wg_password)
+        weight_gurus = self._weight_gurus()
         data = weight_gurus.get_all(startdate)
         return data
 
-    def get_heart_rate_data(self, startdate: str) -> list:
-        data = self._get_garmin_hr_data(startdate)
+    def _iter_weight_gurus_body_comp_data(
+        self, startdate: str, on_late_delete=None, is_stored=None
+    ):
+        weight_gurus = self._weight_gurus()
+        return weight_gurus.iter_all(
+            startdate, on_late_delete=on_late_delete, is_stored=is_stored
+        )
+
+    def _weight_gurus(self):
+        return _client("WeightGurus")(
+            self.wg_username,
+            self.wg_password,
+            rate_limiter=self.weight_gurus_rate_limiter,
+        )
+
+    def sync(
+        self, store: HealthStore, startdate: str, activity_types=("cycling", "running")
+    ) -> dict:
+        """Download only data newer than what store already holds.
+
+        Datasets sync concurrently and the rollups are updated afterwards;
+        returns the errors of any that failed, keyed by dataset name.
+        """
+        tasks = {
+            "weight-gurus/body_composition": partial(
+                self._sync_weight_gurus_body_comp, store, startdate
+            ),
+            "garmin/body_composition": partial(
+                self._sync_body_comp,
+                store,
+                "garmin",
+                lambda since: self._get_garmin_body_comp_data(since[:10]),
+                startdate,
+            ),
+        }
+        for activity_type in activity_types:
+            tasks[f"garmin/{activity_type}"] = partial(
+                self._sync_activities, store, activity_type, startdate
+            )
+        _, errors = run_concurrently(tasks)
+        try:
+            self.update_rollups(store)
+        except Exception as err:  # pylint: disable=broad-except
+            LOGGER.error("Updating rollups failed: %s", err)
+            errors["rollups"] = err
+        return errors
+
+    def _sync_weight_gurus_body_comp(self, store: HealthStore, startdate: str):
+        late_deletes = []
+
+        def is_stored(operation):
+            return store.contains(
+                "weight-gurus",
+                "body_composition",
+                format_timestamp(operation["entryTimestamp"]),
+            )
+
+        self._sync_body_comp(
+            store,
+            "weight-gurus",
+            lambda since: self._iter_weight_gurus_body_comp_data(
+                since, on_late_delete=late_deletes.append, is_stored=is_stored
+            ),
+            startdate,
+        )
+        # put buffers a batch of creates, so a delete applied while it ran
+        # could precede the insert of the create it cancels
+        for operation in late_deletes:
+            store.delete(
+                "weight-gurus",
+                "body_composition",
+                format_timestamp(operation["entryTimestamp"]),
+            )
+
+    @staticmethod
+    def _sync_body_comp(store: HealthStore, source: str, fetch, startdate: str):
+        since = store.high_water_mark(source, "body_composition") or startdate
+        data = fetch(since)
+        written = store.put(
+            source,
+            "body_composition",
+            ((format_timestamp(item.date), "", item.to_dict()) for item in data),
+        )
+        LOGGER.info(
+            "Synced %d %s body composition entries since %s", written, source, since
+        )
+
+    def _sync_activities(self, store: HealthStore, activity_type: str, startdate: str):
+        since = store.high_water_mark("garmin", activity_type) or startdate
+        activities = self.iter_activities(activity_type, since[:10])
+        written = store.put(
+            "garmin",
+            activity_type,
+            (
+                (activity["startTimeLocal"], str(activity["activityId"]), activity)
+                for activity in activities
+            ),
+        )
+        LOGGER.info("Synced %d %s activities since %s", written, activity_type, since)
+
+    def backfill_body_comp(
+        self, store: HealthStore, startdate: str, enddate=None, chunk_days=90
+    ) -> int:
+        """Store Garmin body composition chunk by chunk, resuming from checkpoints."""
+
+        def fetch_chunk(chunk_start, chunk_end):
+            data = self._get_garmin_body_comp_data(chunk_start, chunk_end)
+            return store.put(
+                "garmin",
+                "body_composition",
+                ((format_timestamp(item.date), "", item.to_dict()) for item in data),
+            )
+
+        chunks = plan_chunks(startdate, enddate, chunk_days)
+        written = run_backfill(store, "garmin/body_composition", chunks, fetch_chunk)
+        self.update_rollups(store)
+        return written
+
+    def backfill_heart_rates(
+        self, store: HealthStore, startdate: str, enddate=None, chunk_days=30
+    ) -> int:
+        """Store daily Garmin heart rates chunk by chunk, resuming from checkpoints."""
+
+        def fetch_chunk(chunk_start, chunk_end):
+            days = self._get_garmin_hr_data(chunk_start, chunk_end)
+            return store.put(
+                "garmin",
+                "heart_rate",
+                ((day["calendarDate"], "", day) for day in days if day),
+            )
+
+        chunks = plan_chunks(startdate, enddate, chunk_days)
+        written = run_backfill(store, "garmin/heart_rate", chunks, fetch_chunk)
+        self.update_rollups(store)
+        return written
+
+    def get_heart_rate_data(self, startdate: str, enddate=None) -> list:
+        data = self._get_garmin_hr_data(startdate, enddate)
         return data
 
-    def _get_garmin_hr_data(self, startdate: str):
-        # TODO: implement using startdate
-        garmin = Garmin(self.garmin_username, self.garmin_password)
-        garmin.login()
-        data_list = []
-        for i in range(0, 1300):
-            date = (datetime.date.today() - datetime.timedelta(i)).isoformat()
-            data = garmin.get_heart_rates(date)
-            data_list.append(data)
-
-        return data_list
+    def get_heart_rate_days(self, startdate: str, enddate=None) -> List[HeartRateDay]:
+        """Return heart rates per day decoded into typed columns, in date order."""
+        return self._get_garmin_hr_data(startdate, enddate, method="get_heart_rate_day")
+
+    def get_resting_heart_rates(
+        self, startdate: str, enddate=None, chunk_days=RESTING_HR_CHUNK_DAYS
+    ) -> Dict[str, Optional[int]]:
+        """Return resting heart rate by calendar date, in date order.
+
+        The range is fetched in chunk_days range requests; only days those leave
+        out are fetched one by one from the full dailyHeartRate payload. Days
+        without any reading map to None.
+        """
+        dates = date_range(startdate, enddate)
+        resting = {}
+        chunks = plan_chunks(dates[0], dates[-1], chunk_days) if dates else []
+        for rates in fetch_by_date(
+            lambda chunk: self._call_garmin("get_resting_heart_rates", *chunk), chunks
+        ):
+            resting.update(rates)
+
+        missing = [date for date in dates if date not in resting]
+        if missing:
+            LOGGER.info("Requesting heart rates for %d missing days", len(missing))
+            days = fetch_by_date(
+                lambda date: self._call_garmin("get_heart_rates", date), missing
+            )
+            for date, day in zip(missing, days):
+                resting[date] = (day or {}).get("restingHeartRate")
+        return {date: resting[date] for date in dates}
+
+    def get_sleep_data(
+        self, startdate: str, enddate=None, store: HealthStore = None, max_workers=8
+    ) -> List[SleepNight]:
+        """Return the recorded nights from startdate through enddate, in date order.
+
+        Days are fetched concurrently under the Garmin session's rate limit.
+        With a store, days already stored there are not fetched again and new
+        ones are added to it; a past day without sleep is stored as an empty
+        payload, so it is not fetched again either.
+        """
+        dates = date_range(startdate, enddate)
+        nights = {}
+        stored_dates = set()
+        if store is not None and dates:
+            stored = store.index("garmin", "sleep").range(dates[0], dates[-1])
+            stored_dates.update(date for date, _ in stored)
+            nights.update(
+                (date, SleepNight.from_dict(payload))
+                for date, payload in stored
+                if payload
+            )
+
+        missing = [date for date in dates if date not in stored_dates]
+        LOGGER.info("Requesting sleep data for %d days", len(missing))
+        fetched = fetch_by_date(
+            lambda date: self._call_garmin("get_sleep_night", date),
+            missing,
+            max_workers=max_workers,
+        )
+        if store is not None:
+            # today's night may not have been synced to Garmin yet
+            today = datetime.date.today().isoformat()
+            store.put(
+                "garmin",
+                "sleep",
+                (
+                    (date, "", night.to_dict() if night is not None else {})
+                    for date, night in zip(missing, fetched)
+                    if night is not None or date < today
+                ),
+            )
+        nights.update((night.date, night) for night in fetched if night is not None)
+        return [nights[date] for date in sorted(nights)]
+
+    def _get_garmin_hr_data(
+        self, startdate: str, enddate=None, max_workers=8, method="get_heart_rates"
+    ):
+        dates = date_range(startdate, enddate)
+        LOGGER.info("Requesting heart rates for %d days", len(dates))
+        return fetch_by_date(
+            lambda date: self._call_garmin(method, date),
+            dates,
+            max_workers=max_workers,
+        )
+
+    def _call_garmin(self, method: str, *args):
+        """Call a Garmin method on the shared session, logging in again after a 401."""
+        garmin, logins = self._get_garmin()
+        try:
+            return getattr(garmin, method)(*args)
+        except GarminConnectAuthenticationError:
+            LOGGER.info("Garmin session expired, logging in again")
+            self._login_garmin(garmin, logins)
+            return getattr(garmin, method)(*args)
+
+    def _get_garmin(self):
+        with self._garmin_lock:
+            if self._garmin is None:
+                garmin = _client("Garmin")(
+                    self.garmin_username,
+                    self.garmin_password,
+                    rate_limiter=self.garmin_rate_limiter,
+                )
+                if not (
+                    self.garmin_session_file
+                    and garmin.load_session(self.garmin_session_file)
+                ):
+                    self._do_garmin_login(garmin)
+                self._garmin = garmin
+            return self._garmin, self._garmin_logins
+
+    def _login_garmin(self, garmin: "Garmin", stale_logins: int):
+        # several workers can hit the same expired session; only the first logs in
+        with self._garmin_lock:
+            if self._garmin_logins == stale_logins:
+                self._do_garmin_login(garmin)
+
+    def _do_garmin_login(self, garmin: "Garmin"):
+        if not garmin.login():
+            raise GarminConnectAuthenticationError("Garmin login failed")
+        self._garmin_logins += 1
+        if self.garmin_session_file:
+            garmin.save_session(self.garmin_session_file)
@@ -1,7 +1,169 @@
 # standard library
+import codecs
+from contextlib import nullcontext
+import datetime
 import json
+import sys
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+DAY_MILLIS = 24 * 60 * 60 * 1000
 
 
 def load_json(file_name):
     with open(file_name) as data:
         return json.load(data)
+
+
+def write_ndjson(file_name, records) -> int:
+    """Stream records to file_name ("-" for stdout) as newline-delimited JSON.
+
+    Returns the number of records written.
+    """
+    count = 0
+    # line buffering puts every record on disk as soon as it is written
+    with (
+        nullcontext(sys.stdout)
+        if file_name == "-"
+        else open(file_name, "w", buffering=1)
+    ) as output:
+        for record in records:
+            output.write(json.dumps(record) + "\n")
+            count += 1
+    return count
+
+
+def date_range(startdate: str, enddate=None) -> list:
+    """Return every 'YYYY-mm-dd' date from startdate through enddate (default today)."""
+    start = datetime.date.fromisoformat(str(startdate))
+    if enddate is None:
+        end = datetime.date.today()
+    else:
+        end = datetime.date.fromisoformat(str(enddate))
+    return [
+        (start + datetime.timedelta(days)).isoformat()
+        for days in range((end - start).days + 1)
+    ]
+
+
+def parse_timestamp(value) -> datetime.datetime:
+    """Return a UTC datetime for an ISO timestamp, 'YYYY-mm-dd' date or datetime."""
+    if isinstance(value, datetime.datetime):
+        timestamp = value
+    elif isinstance(value, datetime.date):
+        timestamp = datetime.datetime(value.year, value.month, value.day)
+    else:
+        timestamp = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp.astimezone(datetime.timezone.utc)
+
+
+def format_timestamp(timestamp: datetime.datetime) -> str:
+    """Return timestamp in the 'YYYY-mm-ddTHH:MM:SS.fffZ' form Weight Gurus uses."""
+    timestamp = parse_timestamp(timestamp)
+    millis = timestamp.microsecond // 1000
+    return timestamp.strftime("%Y-%m-%dT%H:%M:%S.") + f"{millis:03d}Z"
+
+
+def to_millis(value) -> int:
+    """Return milliseconds since the epoch for anything parse_timestamp accepts."""
+    return (parse_timestamp(value) - EPOCH) // datetime.timedelta(milliseconds=1)
+
+
+def to_end_millis(value) -> int:
+    """Return to_millis(value), except that a bare date means the end of that day.
+
+    This makes an end date inclusive, as HealthStore.load treats it.
+    """
+    if (isinstance(value, str) and len(value) == 10) or (
+        isinstance(value, datetime.date) and not isinstance(value, datetime.datetime)
+    ):
+        return to_millis(value) + DAY_MILLIS - 1
+    return to_millis(value)
+
+
+def from_millis(millis: int) -> datetime.datetime:
+    return EPOCH + datetime.timedelta(milliseconds=millis)
+
+
+def iter_json_array(chunks, key: str):
+    """Yield the items of the array under top-level key from a stream of JSON bytes.
+
+    Only the item being decoded is held in memory, so arbitrarily long arrays
+    can be read from a streamed response body. Keys of nested objects are
+    skipped, and key is compared with the raw text of each key, escapes and all.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+
+    def more():
+        chunk = next(chunks, None)
+        if chunk is None:
+            return text_decoder.decode(b"", final=True) or None
+        return text_decoder.decode(chunk)
+
+    # find the opening bracket of the array, tracking the nesting depth so only
+    # a key of the outermost object matches
+    depth = 0
+    in_string = escaped = False
+    string = []
+    # 1 once key was read at depth 1, 2 once its colon was
+    state = 0
+    buffer = None
+    while buffer is None:
+        text = more()
+        if text is None:
+            return
+        for index, char in enumerate(text):
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+                    state = 1 if depth == 1 and "".join(string) == key else 0
+                    continue
+                if depth == 1 and len(string) <= len(key):
+                    string.append(char)
+            elif char in " \t\r\n":
+                continue
+            elif state == 1 and char == ":":
+                state = 2
+            elif state == 2 and char == "[":
+                buffer = text[index + 1 :]
+                break
+            else:
+                state = 0
+                if char == '"':
+                    in_string = True
+                    string = []
+                elif char in "{[":
+                    depth += 1
+                elif char in "}]":
+                    depth -= 1
+
+    position = 0
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position < len(buffer) and buffer[position] == "]":
+            return
+        try:
+            if position == len(buffer):
+                raise ValueError("need more data")
+            item, end = decoder.raw_decode(buffer, position)
+            if end == len(buffer):
+                # a number cut at the chunk boundary decodes too, so an item
+                # is only complete once the delimiter after it has arrived
+                raise ValueError("need more data")
+        except ValueError as err:
+            text = more()
+            if text is None:
+                raise ValueError(f"Truncated JSON array under {key}") from err
+            buffer = buffer[position:] + text
+            position = 0
+            continue
+        position = end
+        yield item
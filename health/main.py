@@ -1,29 +1,284 @@
 # standard library
+import argparse
 import json
+import logging
+import os
+import sys
 
 # this package
-from health.health import Health
-from .commonpy import json_utils
+from health.exit_codes import EXIT_FAILURE, EXIT_SUCCESS
+from health.helpers import load_json, write_ndjson
 
+DEFAULT_START = "2019-01-01"
+USER_INFO_PATH = "user_info.json"
+STORE_PATH = "pulledData/health.db"
+BATCH_STORE_DIR = "pulledData/accounts"
+METRICS_PATH = "pulledData/metrics.json"
+LOG_FORMAT = "%(asctime)s: %(levelname)s: %(message)s"
+BACKFILL_METRICS = ("body-composition", "heart-rate")
 
-if __name__ == "__main__":
-    with open("user_info.json") as f:
-        user_info = json.load(f)
+LOGGER = logging.getLogger("main")
+
+
+# Commands import what they use themselves, so a run only loads the API
+# clients of the services it talks to.
+
+
+def export(args) -> int:
+    """Write body composition and activities to pulledData."""
+    from health.orchestrator import run_concurrently
+
+    health = _health(args)
+
+    def export_body_composition():
+        if args.format == "columnar":
+            from health.columnar import write_body_comp
+
+            series = health.get_body_comp_series(args.start)
+            write_body_comp(
+                "pulledData/body_composition.hcol", series, args.compression
+            )
+            return
+        data = health.get_body_comp_data(args.start)
+        with open("pulledData/body_composition.json", "w") as f:
+            json.dump([record.to_dict() for record in data], f, indent=4)
+
+    def export_activities(activity_type):
+        activities = health.iter_activities(activity_type, args.start)
+        if args.format == "columnar":
+            from health.columnar import write_activities
+
+            write_activities(
+                f"pulledData/{activity_type}.hcol", activities, args.compression
+            )
+            return
+        write_ndjson(f"pulledData/{activity_type}.ndjson", activities)
+
+    # every export writes its own file as soon as it finishes
+    _, errors = run_concurrently(
+        {
+            "body_composition": export_body_composition,
+            "cycling": lambda: export_activities("cycling"),
+            "running": lambda: export_activities("running"),
+        }
+    )
+    return EXIT_FAILURE if errors else EXIT_SUCCESS
+
+
+def sync(args) -> int:
+    """Download what is newer than the store holds, then update the rollups."""
+    from health.store import HealthStore
+
+    with HealthStore(args.store) as store:
+        errors = _health(args).sync(store, args.start)
+    return EXIT_FAILURE if errors else EXIT_SUCCESS
+
+
+def backfill(args) -> int:
+    """Store full histories chunk by chunk, resuming from checkpoints."""
+    from health.store import HealthStore
+
+    health = _health(args)
+    metrics = args.only or BACKFILL_METRICS
+    with HealthStore(args.store) as store:
+        if "body-composition" in metrics:
+            health.backfill_body_comp(store, args.start)
+        if "heart-rate" in metrics:
+            health.backfill_heart_rates(store, args.start)
+    return EXIT_SUCCESS
+
+
+def batch(args) -> int:
+    """Sync every account listed in an accounts file."""
+    from health.batch import sync_accounts
+
+    results = sync_accounts(load_json(args.accounts), BATCH_STORE_DIR, args.start)
+    for result in results:
+        status = "ok" if result.ok else f"failed: {result.errors}"
+        print(f"{result.name}: {status} ({result.seconds:.1f}s)")
+    return EXIT_SUCCESS if all(result.ok for result in results) else EXIT_FAILURE
+
+
+def rollups(args) -> int:
+    """Recompute the rollups from the store."""
+    from health.health import Health
+    from health.store import HealthStore
+
+    with HealthStore(args.store) as store:
+        Health.update_rollups(store, full=args.full)
+    return EXIT_SUCCESS
 
-    health = Health(user_info)
 
-    data = health.get_body_comp_data("2019-01-01")
-    with open("pulledData/body_composition.json", "w") as f:
-        json.dump(data, f, indent=4, cls=json_utils.EnhancedJSONEncoder)
+def query(args) -> int:
+    """Print stored values of a metric as JSON lines, without any network access."""
+    from health.health import Health
+    from health.store import HealthStore
 
-    cycling = health.get_activities("cycling", "2019-01-01")
-    with open("pulledData/cycling.json", "w") as f:
-        json.dump(cycling, f, indent=4, cls=json_utils.EnhancedJSONEncoder)
+    with HealthStore(args.store) as store:
+        rows = Health.query(store, args.metric, args.start, args.end)
+    write_ndjson(args.output, rows)
+    return EXIT_SUCCESS
 
-    running = health.get_activities("running", "2019-01-01")
-    with open("pulledData/running.json", "w") as f:
-        json.dump(running, f, indent=4, cls=json_utils.EnhancedJSONEncoder)
 
-    # heart_rate = health.get_heart_rate_data("2019-01-01")
-    # with open("pulledData/heartrate.json" "w") as f:
-    #     json.dump(heart_rate, f, indent=4, cls=json_utils.EnhancedJSONEncoder)
+def garmin(args) -> int:
+    """Print one Garmin Connect dataset as JSON lines, or write it as columns."""
+    health = _health(args)
+    if args.format == "columnar":
+        return _write_garmin_columns(health, args)
+    if args.metric == "body-composition":
+        # pylint: disable=protected-access
+        data = health._get_garmin_body_comp_data(args.start, args.end)
+        records = (record.to_dict() for record in data)
+    elif args.metric == "activities":
+        records = health.iter_activities(args.type, args.start, args.end)
+    elif args.metric == "heart-rate":
+        records = health.get_heart_rate_data(args.start, args.end)
+    elif args.metric == "resting-heart-rate":
+        records = (
+            {"date": date, "resting_heart_rate": value}
+            for date, value in health.get_resting_heart_rates(
+                args.start, args.end
+            ).items()
+        )
+    else:
+        records = (
+            night.to_dict() for night in health.get_sleep_data(args.start, args.end)
+        )
+    write_ndjson(args.output, records)
+    return EXIT_SUCCESS
+
+
+def _write_garmin_columns(health, args) -> int:
+    from health import columnar
+    from health.data_models import BodyCompSeries
+
+    if args.output == "-":
+        raise SystemExit("columnar output needs a file, use -o")
+    if args.metric == "body-composition":
+        # pylint: disable=protected-access
+        data = health._get_garmin_body_comp_data(args.start, args.end)
+        columnar.write_body_comp(
+            args.output, BodyCompSeries.from_records(data), args.compression
+        )
+    elif args.metric == "activities":
+        activities = health.iter_activities(args.type, args.start, args.end)
+        columnar.write_activities(args.output, activities, args.compression)
+    elif args.metric == "heart-rate":
+        days = health.get_heart_rate_days(args.start, args.end)
+        columnar.write_heart_rate_days(args.output, days, args.compression)
+    else:
+        raise SystemExit(f"{args.metric} has no columnar format")
+    return EXIT_SUCCESS
+
+
+def weight_gurus(args) -> int:
+    """Print Weight Gurus body composition as JSON lines."""
+    health = _health(args)
+    # pylint: disable=protected-access
+    records = health._iter_weight_gurus_body_comp_data(args.start)
+    write_ndjson(args.output, (record.to_dict() for record in records))
+    return EXIT_SUCCESS
+
+
+def _health(args):
+    from health.health import Health
+
+    return Health(load_json(args.user_info))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m health.main", description="Collect health data."
+    )
+    parser.add_argument("--user-info", default=USER_INFO_PATH)
+    parser.add_argument("--store", default=STORE_PATH)
+    parser.add_argument(
+        "--metrics-file", default=METRICS_PATH, help="where to write request metrics"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    # without a subcommand, export runs with the export subcommand's defaults
+    parser.set_defaults(
+        command=export, start=DEFAULT_START, format="json", compression=None
+    )
+    commands = parser.add_subparsers(title="commands")
+
+    def add_command(name, command, help_text):
+        subparser = commands.add_parser(name, help=help_text)
+        subparser.set_defaults(command=command)
+        subparser.add_argument("--start", default=DEFAULT_START, help="YYYY-mm-dd")
+        return subparser
+
+    def add_format_options(subparser):
+        subparser.add_argument("--format", choices=("json", "columnar"), default="json")
+        subparser.add_argument(
+            "--compression",
+            choices=("gzip", "lzma"),
+            help="compress columnar files column by column",
+        )
+
+    add_format_options(add_command("export", export, export.__doc__))
+    add_command("sync", sync, sync.__doc__)
+    subparser = add_command("backfill", backfill, backfill.__doc__)
+    subparser.add_argument(
+        "--only", action="append", choices=BACKFILL_METRICS, help="metric to backfill"
+    )
+    subparser = add_command("batch", batch, batch.__doc__)
+    subparser.add_argument("accounts", nargs="?", default="accounts.json")
+    subparser = add_command("rollups", rollups, rollups.__doc__)
+    subparser.add_argument("--full", action="store_true", help="rebuild every bucket")
+    subparser = add_command("query", query, query.__doc__)
+    subparser.add_argument("metric", help='e.g. "weight" or "heart_rate_daily"')
+    subparser.set_defaults(start=None)
+    subparser.add_argument("--end", help="YYYY-mm-dd, inclusive")
+    subparser.add_argument("-o", "--output", default="-")
+
+    subparser = add_command("garmin", garmin, garmin.__doc__)
+    subparser.add_argument(
+        "metric",
+        choices=(
+            "body-composition",
+            "activities",
+            "heart-rate",
+            "resting-heart-rate",
+            "sleep",
+        ),
+    )
+    subparser.add_argument("--end", help="YYYY-mm-dd, default today")
+    subparser.add_argument("--type", default="cycling", help="activity type")
+    subparser.add_argument("-o", "--output", default="-")
+    add_format_options(subparser)
+    subparser = add_command("weight-gurus", weight_gurus, weight_gurus.__doc__)
+    subparser.add_argument("metric", choices=("body-composition",))
+    subparser.add_argument("-o", "--output", default="-")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        format=LOG_FORMAT, level=logging.DEBUG if args.verbose else logging.INFO
+    )
+    try:
+        return args.command(args)
+    finally:
+        # only commands that made requests have anything to report
+        if "health.metrics" in sys.modules:
+            from health.metrics import METRICS
+
+            if METRICS.to_dict():
+                _dump_metrics(METRICS, args.metrics_file)
+
+
+def _dump_metrics(metrics, path):
+    # raising here would hide the command's own exit status or exception
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        metrics.dump(path)
+    except OSError as err:
+        LOGGER.warning("Could not write metrics to %s: %s", path, err)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
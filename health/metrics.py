@@ -0,0 +1,174 @@
+"""Per-request instrumentation aggregated into per-endpoint histograms"""
+
+# standard library
+from bisect import bisect_left
+from collections import defaultdict
+import json
+import threading
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024**2, 10 * 1024**2)
+SENSITIVE_KEYS = frozenset(("authorization", "cookie", "set-cookie", "password"))
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self):
+        """Return (upper bound, count of observations <= bound) pairs, ending at +Inf."""
+        running = 0
+        pairs = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            running += count
+            pairs.append((bound, running))
+        return pairs
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "buckets": {
+                _format_bound(bound): count for bound, count in self.cumulative()
+            },
+        }
+
+
+class EndpointStats:
+    """Everything recorded for one endpoint."""
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.response_bytes = Histogram(BYTES_BUCKETS)
+        self.statuses = defaultdict(int)
+        self.retries = 0
+        self.throttle_wait = 0.0
+
+    def to_dict(self):
+        return {
+            "latency_seconds": self.latency.to_dict(),
+            "response_bytes": self.response_bytes.to_dict(),
+            "statuses": {str(status): count for status, count in self.statuses.items()},
+            "retries": self.retries,
+            "throttle_wait_seconds": self.throttle_wait,
+        }
+
+
+class Metrics:
+    """Thread-safe registry of request metrics keyed by endpoint."""
+
+    def __init__(self):
+        self._endpoints = defaultdict(EndpointStats)
+        self._lock = threading.Lock()
+
+    def record(
+        self, endpoint, latency, response_bytes, status, retries=0, throttle_wait=0.0
+    ):
+        """Record one logical request; status is 0 when no response was received."""
+        with self._lock:
+            stats = self._endpoints[endpoint]
+            stats.latency.observe(latency)
+            stats.response_bytes.observe(response_bytes)
+            stats.statuses[status] += 1
+            stats.retries += retries
+            stats.throttle_wait += throttle_wait
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                endpoint: stats.to_dict()
+                for endpoint, stats in sorted(self._endpoints.items())
+            }
+
+    def to_prometheus(self) -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            for name, attribute, help_text in (
+                ("request_duration_seconds", "latency", "Request latency."),
+                ("response_bytes", "response_bytes", "Response body size."),
+            ):
+                metric = f"health_http_{name}"
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} histogram")
+                for endpoint, stats in endpoints:
+                    histogram = getattr(stats, attribute)
+                    for bound, count in histogram.cumulative():
+                        labels = _labels(endpoint=endpoint, le=_format_bound(bound))
+                        lines.append(f"{metric}_bucket{labels} {count}")
+                    labels = _labels(endpoint=endpoint)
+                    lines.append(f"{metric}_sum{labels} {histogram.total}")
+                    lines.append(f"{metric}_count{labels} {histogram.count}")
+
+            lines.append("# HELP health_http_requests_total Requests by final status.")
+            lines.append("# TYPE health_http_requests_total counter")
+            for endpoint, stats in endpoints:
+                for status, count in sorted(stats.statuses.items()):
+                    labels = _labels(endpoint=endpoint, status=status)
+                    lines.append(f"health_http_requests_total{labels} {count}")
+
+            for name, attribute, help_text in (
+                ("retries_total", "retries", "Retried attempts."),
+                (
+                    "throttle_wait_seconds_total",
+                    "throttle_wait",
+                    "Time spent waiting on rate limits and backoff.",
+                ),
+            ):
+                metric = f"health_http_{name}"
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} counter")
+                for endpoint, stats in endpoints:
+                    value = getattr(stats, attribute)
+                    lines.append(f"{metric}{_labels(endpoint=endpoint)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """Write the metrics to path, as Prometheus text for '.prom' files else JSON."""
+        with open(path, "w") as output:
+            if str(path).endswith(".prom"):
+                output.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), output, indent=4)
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def _labels(**labels):
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def redact(mapping) -> dict:
+    """Return headers or form data safe to log, with credentials masked."""
+    if not mapping:
+        return mapping
+    return {
+        name: "***" if name.lower() in SENSITIVE_KEYS else value
+        for name, value in mapping.items()
+    }
+
+
+# process-wide registry used by the API clients
+METRICS = Metrics()
@@ -0,0 +1,42 @@
+"""Concurrent orchestration of independent fetch tasks"""
+
+# standard library
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+from typing import Any, Callable, Dict, Tuple
+
+LOGGER = logging.getLogger("main")
+
+
+def run_concurrently(
+    tasks: Dict[str, Callable[[], Any]],
+    on_done: Callable[[str, Any], None] = None,
+    max_workers: int = None,
+) -> Tuple[Dict[str, Any], Dict[str, Exception]]:
+    """Run tasks at the same time and return (results, errors) keyed by task name.
+
+    A failing task is recorded in errors without cancelling the others.
+    on_done(name, result) is called as soon as each task succeeds; an error
+    it raises is recorded against that task.
+    """
+    results = {}
+    errors = {}
+    if not tasks:
+        return results, errors
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(tasks)) as executor:
+        futures = {executor.submit(task): name for name, task in tasks.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                result = future.result()
+                if on_done:
+                    on_done(name, result)
+            except Exception as err:  # pylint: disable=broad-except
+                LOGGER.error("Task %s failed: %s", name, err)
+                errors[name] = err
+                continue
+            LOGGER.info("Task %s finished", name)
+            results[name] = result
+
+    return results, errors
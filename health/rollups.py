@@ -0,0 +1,97 @@
+"""Daily and weekly aggregates kept up to date from the store's change log"""
+
+# standard library
+from dataclasses import dataclass
+import datetime
+from itertools import compress
+from statistics import fmean
+from typing import Callable, Optional, Tuple
+
+# this package
+from health.data_models import BodyCompSeries, HeartRateDay
+from health.store import HealthStore
+
+ROLLUP_SOURCE = "rollup"
+
+
+@dataclass
+class Rollup:
+    """An aggregate stored as one record per bucket of days.
+
+    bucket maps a stored date to the first and last day of its bucket, and
+    compute(store, first, last) returns the bucket's record, or None once the
+    bucket holds no data.
+    """
+
+    name: str
+    inputs: Tuple[Tuple[str, str], ...]
+    bucket: Callable[[str], Tuple[str, str]]
+    compute: Callable[[HealthStore, str, str], Optional[dict]]
+
+
+def day_bucket(date: str) -> Tuple[str, str]:
+    return date[:10], date[:10]
+
+
+def week_bucket(date: str) -> Tuple[str, str]:
+    """Return the Monday and Sunday of the week date falls in."""
+    day = datetime.date.fromisoformat(date[:10])
+    monday = day - datetime.timedelta(days=day.weekday())
+    return monday.isoformat(), (monday + datetime.timedelta(days=6)).isoformat()
+
+
+def update_rollup(store: HealthStore, rollup: Rollup, full=False) -> int:
+    """Recompute the buckets whose inputs changed and return how many there were.
+
+    With full, every bucket that holds stored input is recomputed instead.
+    """
+    dates = set()
+    seen = {}
+    for source, metric in rollup.inputs:
+        changes = store.changes(source, metric)
+        if changes:
+            seen[(source, metric)] = changes[-1][0]
+        dates.update(date for _, date in changes)
+        if full:
+            dates.update(store.dates(source, metric))
+
+    buckets = sorted({rollup.bucket(date) for date in dates})
+    records = []
+    for first, last in buckets:
+        record = rollup.compute(store, first, last)
+        if record is None:
+            store.delete(ROLLUP_SOURCE, rollup.name, first)
+        else:
+            records.append((first, "", record))
+    store.put(ROLLUP_SOURCE, rollup.name, records)
+
+    # clear only after the aggregates are stored, so a failed update is redone
+    for (source, metric), seq in seen.items():
+        store.clear_changes(source, metric, seq)
+    return len(buckets)
+
+
+def daily_heart_rate(day: HeartRateDay) -> dict:
+    """Summarise one day of heart-rate samples."""
+    summary = {"resting_heart_rate": day.resting_heart_rate, "samples": len(day)}
+    if len(day):
+        summary.update(
+            min_bpm=min(day.bpm),
+            max_bpm=max(day.bpm),
+            mean_bpm=fmean(day.bpm),
+        )
+    return summary
+
+
+def weekly_weight(series: BodyCompSeries) -> Optional[dict]:
+    """Summarise the weights of one week, or return None if there are none."""
+    weights = list(compress(series.columns["weight"], series.mask("weight")))
+    if not weights:
+        return None
+    return {
+        "readings": len(weights),
+        "mean_weight": fmean(weights),
+        "min_weight": min(weights),
+        "max_weight": max(weights),
+        "change": weights[-1] - weights[0],
+    }
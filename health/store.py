@@ -0,0 +1,232 @@
+"""Local on-disk store for downloaded health data"""
+
+# standard library
+from bisect import bisect_left, bisect_right
+from itertools import islice
+import json
+import sqlite3
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+PUT_BATCH_SIZE = 1000
+# metrics whose writes are logged in the changes table for the rollups
+TRACKED_METRICS = frozenset(("body_composition", "heart_rate"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    source TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    date TEXT NOT NULL,
+    key TEXT NOT NULL DEFAULT '',
+    payload TEXT NOT NULL,
+    PRIMARY KEY (source, metric, date, key)
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    job TEXT NOT NULL,
+    chunk_start TEXT NOT NULL,
+    chunk_end TEXT NOT NULL,
+    PRIMARY KEY (job, chunk_start, chunk_end)
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    date TEXT NOT NULL,
+    UNIQUE (source, metric, date)
+)
+"""
+
+
+class TimeIndex:
+    """Date-ordered records of one metric, searched by bisection."""
+
+    __slots__ = ("dates", "payloads")
+
+    def __init__(self, dates: List[str], payloads: List[dict]):
+        self.dates = dates
+        self.payloads = payloads
+
+    def range(self, start=None, end=None) -> List[Tuple[str, dict]]:
+        """Return the (date, payload) pairs with start <= date <= end.
+
+        An end date includes that whole day. Takes O(log n + k) for k results.
+        """
+        low = 0 if start is None else bisect_left(self.dates, _date_key(start))
+        high = (
+            len(self.dates)
+            if end is None
+            # anything starting with end sorts before end + U+FFFF
+            else bisect_right(self.dates, _date_key(end) + "\uffff")
+        )
+        return list(zip(self.dates[low:high], self.payloads[low:high]))
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+
+def _date_key(value) -> str:
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+class HealthStore:
+    """SQLite store of records keyed by source, metric and date."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def put(self, source: str, metric: str, records: Iterable[Tuple[str, str, dict]]):
+        """Upsert (date, key, payload) records and return how many were written.
+
+        records may be a generator; it is written in batches so it is never
+        held in memory as a whole.
+        """
+        written = 0
+        rows = (
+            (source, metric, date, key, json.dumps(payload))
+            for date, key, payload in records
+        )
+        while True:
+            batch = list(islice(rows, PUT_BATCH_SIZE))
+            if not batch:
+                return written
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)", batch
+                )
+                self._log_changes(source, metric, (row[2] for row in batch))
+                self._indexes.pop((source, metric), None)
+            written += len(batch)
+
+    def delete(self, source: str, metric: str, date: str, key: str = ""):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM records"
+                " WHERE source = ? AND metric = ? AND date = ? AND key = ?",
+                (source, metric, date, key),
+            )
+            self._log_changes(source, metric, (date,))
+            self._indexes.pop((source, metric), None)
+
+    def contains(self, source: str, metric: str, date: str, key: str = "") -> bool:
+        with self._lock:
+            return (
+                self._conn.execute(
+                    "SELECT 1 FROM records"
+                    " WHERE source = ? AND metric = ? AND date = ? AND key = ?",
+                    (source, metric, date, key),
+                ).fetchone()
+                is not None
+            )
+
+    def _log_changes(self, source: str, metric: str, dates: Iterable[str]):
+        # replacing the row gives a re-changed date a new seq, so a rollup that
+        # read the old one does not clear it
+        if metric in TRACKED_METRICS:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO changes (source, metric, date)"
+                " VALUES (?, ?, ?)",
+                ((source, metric, date) for date in dates),
+            )
+
+    def changes(self, source: str, metric: str) -> List[Tuple[int, str]]:
+        """Return (seq, date) for each uncleared write or delete of a tracked metric."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT seq, date FROM changes"
+                " WHERE source = ? AND metric = ? ORDER BY seq",
+                (source, metric),
+            ).fetchall()
+
+    def clear_changes(self, source: str, metric: str, up_to: int):
+        """Forget the changes of source and metric with seq <= up_to."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM changes WHERE source = ? AND metric = ? AND seq <= ?",
+                (source, metric, up_to),
+            )
+
+    def high_water_mark(self, source: str, metric: str) -> Optional[str]:
+        """Return the newest stored date for source and metric, or None when empty."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(date) FROM records WHERE source = ? AND metric = ?",
+                (source, metric),
+            ).fetchone()
+        return row[0]
+
+    def dates(self, source: str, metric: str) -> List[str]:
+        """Return the distinct stored dates of source and metric, in order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT date FROM records"
+                " WHERE source = ? AND metric = ? ORDER BY date",
+                (source, metric),
+            ).fetchall()
+        return [date for (date,) in rows]
+
+    def load(self, source: str, metric: str, start=None, end=None) -> List[dict]:
+        """Return stored payloads in date order, optionally limited to [start, end]."""
+        query = "SELECT payload FROM records WHERE source = ? AND metric = ?"
+        params = [source, metric]
+        if start is not None:
+            query += " AND date >= ?"
+            params.append(str(start))
+        if end is not None:
+            # compare only the prefix so an end date includes that whole day
+            query += " AND substr(date, 1, ?) <= ?"
+            params.extend([len(str(end)), str(end)])
+        query += " ORDER BY date, key"
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [json.loads(payload) for (payload,) in rows]
+
+    def index(self, source: str, metric: str) -> TimeIndex:
+        """Return an in-memory index of the stored records of source and metric.
+
+        The index is built on first use and kept until the next put or delete
+        of that source and metric.
+        """
+        with self._lock:
+            index = self._indexes.get((source, metric))
+            if index is None:
+                rows = self._conn.execute(
+                    "SELECT date, payload FROM records"
+                    " WHERE source = ? AND metric = ? ORDER BY date, key",
+                    (source, metric),
+                ).fetchall()
+                index = TimeIndex(
+                    [date for date, _ in rows],
+                    [json.loads(payload) for _, payload in rows],
+                )
+                self._indexes[(source, metric)] = index
+        return index
+
+    def mark_done(self, job: str, chunk_start: str, chunk_end: str):
+        """Record that the chunk [chunk_start, chunk_end] of job is complete."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)",
+                (job, chunk_start, chunk_end),
+            )
+
+    def completed_chunks(self, job: str) -> set:
+        """Return the (chunk_start, chunk_end) pairs recorded for job."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_start, chunk_end FROM checkpoints WHERE job = ?", (job,)
+            ).fetchall()
+        return set(rows)
@@ -0,0 +1,140 @@
+"""Request throttling and retry policies shared by API clients"""
+
+# standard library
+import datetime
+from email.utils import parsedate_to_datetime
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket that adapts its rate to rate-limit responses.
+
+    The rate halves on every throttled response and creeps back towards
+    max_rate after each success, so throughput settles just under the
+    server's limit.
+    """
+
+    def __init__(self, rate=5.0, capacity=10, min_rate=0.2, increase=0.05):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.increase = increase
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token, blocking until one is available; return seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def reserve(self) -> float:
+        """Take one token without blocking; return seconds to wait before using it.
+
+        The balance may go negative, so concurrent callers are handed successive
+        slots rather than all waking at once. asyncio code awaits the delay.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def throttled(self):
+        """Halve the rate and drop any saved burst after a rate-limit response."""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+
+class RateLimiterChain:
+    """Several rate limiters applied together, e.g. a per-account and a global one."""
+
+    def __init__(self, *limiters):
+        self.limiters = [limiter for limiter in limiters if limiter is not None]
+
+    def acquire(self) -> float:
+        return sum(limiter.acquire() for limiter in self.limiters)
+
+    def reserve(self) -> float:
+        # the reservations run down together, so the slowest one decides
+        return max((limiter.reserve() for limiter in self.limiters), default=0.0)
+
+    def throttled(self):
+        for limiter in self.limiters:
+            limiter.throttled()
+
+    def succeeded(self):
+        for limiter in self.limiters:
+            limiter.succeeded()
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter that honours Retry-After."""
+
+    def __init__(
+        self,
+        max_retries=5,
+        base_delay=1.0,
+        max_delay=60.0,
+        retry_statuses=(429, 500, 502, 503, 504),
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = frozenset(retry_statuses)
+
+    def should_retry(self, attempt: int, status_code=None) -> bool:
+        """Return whether to retry; status_code is None for connection errors."""
+        if attempt >= self.max_retries:
+            return False
+        return status_code is None or status_code in self.retry_statuses
+
+    def delay(self, attempt: int, response=None) -> float:
+        """Return how long to sleep before retry number attempt + 1."""
+        retry_after = self._retry_after(response)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    @staticmethod
+    def _retry_after(response):
+        if response is None:
+            return None
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return max(0.0, (retry_at - now).total_seconds())
@@ -1,56 +1,408 @@
 # standard library
-from datetime import datetime
-from typing import List
+from array import array
+import base64
+from collections import Counter, defaultdict, deque
+from contextlib import closing
+from datetime import datetime, timedelta
+import json
+import logging
+import threading
+import time
+from typing import Iterator, List, Optional
+from urllib.parse import urlsplit
 
 # third party
 import requests
+from requests.adapters import HTTPAdapter
 
 # this package
-from health.data_models import BodyCompData
-from health.exceptions import UnknownBehavior
+from health.data_models import BodyCompData, BodyCompSeries
+from health.exceptions import (
+    UnknownBehavior,
+    WeightGurusAuthenticationError,
+    WeightGurusConnectionError,
+)
+from health.helpers import iter_json_array, parse_timestamp, to_millis
+from health.metrics import METRICS
+from health.throttle import RetryPolicy
+
+SESSION_POOL_SIZE = 10
+# (connect, read) timeouts in seconds
+REQUEST_TIMEOUT = (5, 30)
+# assumed token lifetime when the login response does not say
+DEFAULT_TOKEN_LIFETIME = 3600
+# refresh tokens this many seconds before they expire
+TOKEN_EXPIRY_MARGIN = 60
+# how far back a streamed delete is matched against earlier creates
+RECONCILE_WINDOW = timedelta(days=30)
+STREAM_CHUNK_SIZE = 64 * 1024
+# only rate-limited replies are retried by default
+RETRY_STATUSES = (429,)
+# BodyCompData field for each raw Weight Gurus reading
+READING_FIELDS = (
+    ("weight", "weight"),
+    ("body_fat", "bodyFat"),
+    ("muscle_mass", "muscleMass"),
+    ("water_percentage", "water"),
+    ("bmi", "bmi"),
+)
+
+LOGGER = logging.getLogger("main")
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+_TOKENS = {}
+_TOKENS_LOCK = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Return the keep-alive session shared by every Weight Gurus call."""
+    global _SESSION  # pylint: disable=global-statement
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            _SESSION = _make_session(SESSION_POOL_SIZE)
+        return _SESSION
+
+
+def configure_session(pool_size=SESSION_POOL_SIZE, timeout=REQUEST_TIMEOUT):
+    """Replace the shared session with one using pool_size connections."""
+    global _SESSION, REQUEST_TIMEOUT  # pylint: disable=global-statement
+    with _SESSION_LOCK:
+        if _SESSION is not None:
+            _SESSION.close()
+        _SESSION = _make_session(pool_size)
+        REQUEST_TIMEOUT = timeout
+
+
+def _make_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def cached_token(token_key) -> Optional[str]:
+    """Return the cached bearer token for token_key, unless it is about to expire."""
+    with _TOKENS_LOCK:
+        token, expires_at = _TOKENS.get(token_key, (None, 0))
+    if token is None or time.time() >= expires_at - TOKEN_EXPIRY_MARGIN:
+        return None
+    return token
+
+
+def cache_login_reply(token_key, reply) -> str:
+    """Cache the bearer token of a login reply until it expires, and return it.
+
+    reply is a requests or health.aio response.
+    """
+    if reply.status_code in (400, 401, 403):
+        raise WeightGurusAuthenticationError(
+            f"Weight Gurus login failed ({reply.status_code})"
+        )
+    # pylint: disable=protected-access
+    json_data = WeightGurus._read_json(reply)
+    try:
+        token = json_data["accessToken"]
+    except (KeyError, TypeError) as err:
+        raise WeightGurusAuthenticationError("No access token in reply") from err
+    expires_at = WeightGurus._token_expiry(json_data)
+    with _TOKENS_LOCK:
+        _TOKENS[token_key] = (token, expires_at)
+    return token
+
+
+def forget_token(token_key):
+    """Drop a token the server revoked before it expired."""
+    with _TOKENS_LOCK:
+        _TOKENS.pop(token_key, None)
 
 
 class WeightGurus:
-    def __init__(self, username, password):
+    api_url = "https://api.weightgurus.com/v3"
+
+    def __init__(self, username, password, rate_limiter=None, retry_policy=None):
         self.login_data = {"email": username, "password": password, "web": True}
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy(retry_statuses=RETRY_STATUSES)
         self.headers = None
         self.start_date = "start=1970-01-01T01:00:00.504Z"
 
+    @property
+    def token_key(self):
+        """Key of this account's bearer token in the shared token cache."""
+        return (self.api_url, self.login_data["email"])
+
     def _do_login(self):
-        req = requests.post(
-            "https://api.weightgurus.com/v3/account/login", data=self.login_data
-        )
+        """Set the bearer token, reusing a cached one until it expires."""
+        token = cached_token(self.token_key)
+        if token is None:
+            req = self._request("POST", "account/login", data=self.login_data)
+            token = cache_login_reply(self.token_key, req)
+        self.headers = {"authorization": f"Bearer {token}"}
+
+    @staticmethod
+    def _token_expiry(json_data):
+        """Return the epoch second the token expires, from the reply or the JWT."""
+        if json_data.get("expiresAt"):
+            try:
+                return parse_timestamp(json_data["expiresAt"]).timestamp()
+            except ValueError:
+                pass
         try:
-            json_data = req.json()
-            self.headers = {"authorization": f"Bearer {json_data['accessToken']}"}
-        except Exception as e:
-            print(f"Caught Exception reading JSON: {e}")
+            payload = json_data["accessToken"].split(".")[1]
+            claims = json.loads(
+                base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+            )
+            return float(claims["exp"])
+        except (IndexError, KeyError, TypeError, ValueError):
+            return time.time() + DEFAULT_TOKEN_LIFETIME
 
     def _get_weight_history(self, start_date=None):
+        return self._read_json(self._request_weight_history(start_date))
+
+    def _request_weight_history(self, start_date=None, stream=False):
         if start_date:
             self.start_date = f"start={start_date}"
-        req = requests.get(
-            f"https://api.weightgurus.com/v3/operation/?{self.start_date}",
-            headers=self.headers,
+        req = self._request(
+            "GET", f"operation/?{self.start_date}", headers=self.headers, stream=stream
         )
+        if req.status_code == 401:
+            # the cached token was revoked early; log in once more
+            req.close()
+            forget_token(self.token_key)
+            self._do_login()
+            req = self._request(
+                "GET",
+                f"operation/?{self.start_date}",
+                headers=self.headers,
+                stream=stream,
+            )
+        return req
+
+    @staticmethod
+    def _read_json(req):
+        """Return the JSON of a reply from either client, raising on bad replies."""
+        if req.status_code >= 400:
+            raise WeightGurusConnectionError(
+                f"Bad reply from {req.url} ({req.status_code})"
+            )
         try:
-            json_data = req.json()
-        except Exception as e:
-            print(f"Caught Exception reading JSON: {e}")
-            json_data = None
-        return json_data
+            return req.json()
+        except ValueError as err:
+            raise WeightGurusConnectionError(
+                f"Bad reply from {req.url} ({req.status_code}): {err}"
+            ) from err
+
+    def _request(self, method, path, **kwargs):
+        """Send a request on the shared session, recording it in METRICS.
+
+        Replies with a status in the retry policy are retried after its delay.
+        """
+        url = f"{self.api_url}/{path}"
+        parts = urlsplit(url)
+        endpoint = f"{method} {parts.netloc}{parts.path}"
+        response = None
+        attempt = 0
+        latency = 0.0
+        throttle_wait = 0.0
+        try:
+            while True:
+                response = None
+                if self.rate_limiter:
+                    throttle_wait += self.rate_limiter.acquire()
+                started = time.perf_counter()
+                try:
+                    response = get_session().request(
+                        method, url, timeout=REQUEST_TIMEOUT, **kwargs
+                    )
+                except requests.RequestException as err:
+                    raise WeightGurusConnectionError(err) from err
+                finally:
+                    latency += time.perf_counter() - started
+
+                if response.status_code == 429 and self.rate_limiter:
+                    self.rate_limiter.throttled()
+                if not self.retry_policy.should_retry(attempt, response.status_code):
+                    return response
+                delay = self.retry_policy.delay(attempt, response)
+                LOGGER.info(
+                    "Retrying %s after %s in %.1fs", url, response.status_code, delay
+                )
+                response.close()
+                time.sleep(delay)
+                throttle_wait += delay
+                attempt += 1
+        finally:
+            METRICS.record(
+                endpoint,
+                latency,
+                self._response_size(response, kwargs.get("stream")),
+                response.status_code if response is not None else 0,
+                retries=attempt,
+                throttle_wait=throttle_wait,
+            )
+
+    @staticmethod
+    def _response_size(response, stream):
+        if response is None:
+            return 0
+        if stream:
+            # reading content here would consume the stream
+            return int(response.headers.get("Content-Length") or 0)
+        return len(response.content)
 
     def get_all(self, startdate: str) -> List[BodyCompData]:
         self._do_login()
-        data = []
         operations = self._get_weight_history(startdate)["operations"]
-        operations = self._clean_operations(operations)
-        for operation in operations:
-            body_data: BodyCompData = self._parse_operation(operation)
+        return self._operations_to_records(operations)
+
+    @staticmethod
+    def _operations_to_records(operations: list) -> List[BodyCompData]:
+        data = []
+        operations = WeightGurus._clean_operations(operations)
+        columns = WeightGurus._decode_readings(operations)
+        for index, operation in enumerate(operations):
+            body_data = BodyCompData(
+                *(columns[field][index] for field, _ in READING_FIELDS),
+                date=parse_timestamp(operation["entryTimestamp"]),
+            )
             data.append(body_data)
 
         return data
 
+    @staticmethod
+    def operations_to_series(operations: list) -> BodyCompSeries:
+        """Decode already reconciled operations into a BodyCompSeries.
+
+        Readings are decoded a column at a time; unparseable ones are -1, which
+        BodyCompSeries.mask turns into a validity mask.
+        """
+        millis = [to_millis(operation["entryTimestamp"]) for operation in operations]
+        order = sorted(range(len(operations)), key=millis.__getitem__)
+        operations = [operations[index] for index in order]
+        return BodyCompSeries(
+            array("q", [millis[index] for index in order]),
+            WeightGurus._decode_readings(operations),
+        )
+
+    @staticmethod
+    def _decode_readings(operations) -> dict:
+        return {
+            field: WeightGurus._wg_nums_to_floats(
+                [operation[key] for operation in operations]
+            )
+            for field, key in READING_FIELDS
+        }
+
+    def iter_all(
+        self,
+        startdate: str,
+        window=RECONCILE_WINDOW,
+        on_late_delete=None,
+        is_stored=None,
+    ) -> Iterator[BodyCompData]:
+        """Yield entries while the operation history streams in.
+
+        Deletes are reconciled online against the creates of the last window of
+        serverTimestamps, so only those creates are held in memory. A delete
+        whose create was already yielded is passed to on_late_delete, or logged
+        when no callback is given. is_stored(delete) tells whether an earlier
+        run stored the create it cancels; see _reconcile_operations.
+        """
+        self._do_login()
+        req = self._request_weight_history(startdate, stream=True)
+        with closing(req):
+            if req.status_code >= 400:
+                raise WeightGurusConnectionError(
+                    f"Bad reply from {req.url} ({req.status_code})"
+                )
+            operations = iter_json_array(
+                req.iter_content(STREAM_CHUNK_SIZE), "operations"
+            )
+            for operation in self._reconcile_operations(
+                operations, window, on_late_delete, is_stored
+            ):
+                yield self._parse_operation(operation)
+
+    @staticmethod
+    def _reconcile_operations(operations, window, on_late_delete=None, is_stored=None):
+        """Yield creates not cancelled by a delete within window, in arrival order.
+
+        A delete cancels the pending create with the same weight and
+        entryTimestamp. Failing that, it is late if a create with its entry was
+        yielded within the last window or, per is_stored, stored by an earlier
+        run; only otherwise does it fall back to the latest pending create of
+        that weight.
+        """
+        pending = deque()
+        live = {}
+        by_entry = defaultdict(list)
+        by_weight = defaultdict(list)
+        # (weight, entryTimestamp) of the creates yielded within the last window,
+        # so memory stays bounded by the window rather than the history
+        yielded = Counter()
+        yielded_at = deque()
+
+        def release(op_id):
+            operation = live.pop(op_id)
+            weight = operation["weight"]
+            for index, key in (
+                (by_entry, (weight, operation.get("entryTimestamp"))),
+                (by_weight, weight),
+            ):
+                index[key].remove(op_id)
+                if not index[key]:
+                    del index[key]
+            return operation
+
+        def emit(op_id, timestamp):
+            operation = release(op_id)
+            entry = (operation["weight"], operation.get("entryTimestamp"))
+            yielded[entry] += 1
+            yielded_at.append((timestamp, entry))
+            return operation
+
+        for op_id, operation in enumerate(operations):
+            timestamp = WeightGurus._parse_timestamp(operation["serverTimestamp"])
+            while yielded_at and yielded_at[0][0] < timestamp - window:
+                _, entry = yielded_at.popleft()
+                yielded[entry] -= 1
+                if not yielded[entry]:
+                    del yielded[entry]
+            while pending and pending[0][0] < timestamp - window:
+                _, old_id = pending.popleft()
+                if old_id in live:
+                    yield emit(old_id, timestamp)
+
+            weight = operation["weight"]
+            entry = (weight, operation.get("entryTimestamp"))
+            if operation["operationType"] != "delete":
+                live[op_id] = operation
+                pending.append((timestamp, op_id))
+                by_entry[entry].append(op_id)
+                by_weight[weight].append(op_id)
+                continue
+
+            candidates = by_entry.get(entry)
+            if not candidates and not (
+                entry in yielded or (is_stored is not None and is_stored(operation))
+            ):
+                candidates = by_weight.get(weight)
+            if candidates:
+                release(candidates[-1])
+            elif on_late_delete:
+                on_late_delete(operation)
+            else:
+                LOGGER.warning(
+                    "Delete of %s arrived after its entry was yielded",
+                    operation.get("entryTimestamp"),
+                )
+
+        for _, op_id in pending:
+            if op_id in live:
+                yield release(op_id)
+
     @staticmethod
     def _parse_operation(operation):
         weight = WeightGurus._wg_num_to_float(operation["weight"])
@@ -58,7 +410,7 @@ class WeightGurus:
         muscle_mass = WeightGurus._wg_num_to_float(operation["muscleMass"])
         water_percentage = WeightGurus._wg_num_to_float(operation["water"])
         bmi = WeightGurus._wg_num_to_float(operation["bmi"])
-        date = operation["entryTimestamp"]
+        date = parse_timestamp(operation["entryTimestamp"])
         return BodyCompData(weight, body_fat, muscle_mass, water_percentage, bmi, date)
 
     @staticmethod
@@ -68,42 +420,53 @@ class WeightGurus:
 
     @staticmethod
     def _remove_deleted_operations(operations):
-        for index, operation in enumerate(operations):
-            if operation["operationType"] == "delete":
-                deleted_operation = operations.pop(index)
-                operations = WeightGurus._remove_operation_deleted(
-                    operations, deleted_operation
-                )
+        """Drop delete operations together with the earlier create each one cancels.
 
-        return operations
+        Operations are replayed in serverTimestamp order. A delete cancels the
+        pending create with the same weight and entryTimestamp, or else the most
+        recent pending create with the same weight.
+        """
+        timestamps = [
+            WeightGurus._parse_timestamp(operation["serverTimestamp"])
+            for operation in operations
+        ]
+        by_entry = defaultdict(list)
+        by_weight = defaultdict(list)
+        removed = set()
+        for index in sorted(range(len(operations)), key=timestamps.__getitem__):
+            operation = operations[index]
+            weight = operation["weight"]
+            entry = (weight, operation.get("entryTimestamp"))
+            if operation["operationType"] != "delete":
+                by_entry[entry].append(index)
+                by_weight[weight].append(index)
+                continue
 
-    @staticmethod
-    def _remove_operation_deleted(operations, deleted_operation):
-        for index, current_operation in enumerate(operations):
-            if WeightGurus._is_deleted_operation(current_operation, deleted_operation):
-                operations.pop(index)
+            removed.add(index)
+            match = WeightGurus._pop_pending(by_entry[entry], removed)
+            if match is None:
+                match = WeightGurus._pop_pending(by_weight[weight], removed)
+            if match is not None:
+                removed.add(match)
 
-        return operations
+        return [
+            operation
+            for index, operation in enumerate(operations)
+            if index not in removed
+        ]
 
     @staticmethod
-    def _is_deleted_operation(current_operation, deleted_operation):
-        if (
-            WeightGurus._is_operation_earlier(current_operation, deleted_operation)
-            and current_operation["weight"] == deleted_operation["weight"]
-        ):
-            return True
-
-        return False
+    def _pop_pending(candidates, removed):
+        # candidates may hold creates already cancelled through the other index
+        while candidates:
+            index = candidates.pop()
+            if index not in removed:
+                return index
+        return None
 
     @staticmethod
-    def _is_operation_earlier(current_operation, deleted_operation):
-        current_date = datetime.fromisoformat(
-            current_operation["serverTimestamp"].replace("Z", "+00:00")
-        )
-        deleted_date = datetime.fromisoformat(
-            deleted_operation["serverTimestamp"].replace("Z", "+00:00")
-        )
-        return current_date < deleted_date
+    def _parse_timestamp(timestamp):
+        return datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
 
     @staticmethod
     def _wg_num_to_float(number):
@@ -124,3 +487,29 @@ class WeightGurus:
             return -1
 
         return whole_number + decimal_point
+
+    @staticmethod
+    def _wg_nums_to_floats(numbers) -> array:
+        """Decode a column of readings at once, as _wg_num_to_float does for one.
+
+        Integers, which is what the API sends, are split with divmod instead of
+        going through str; anything else takes the _wg_num_to_float path. A
+        reading _wg_num_to_float cannot decode, including one from 0 to 9,
+        becomes -1 rather than failing the whole column.
+        """
+        column = array("d")
+        append = column.append
+        for number in numbers:
+            # bool is an int subclass, so check the exact type
+            if type(number) is int and number >= 10:
+                whole_number, tenths = divmod(number, 10)
+                append(whole_number + _TENTHS[tenths])
+                continue
+            try:
+                append(WeightGurus._wg_num_to_float(number))
+            except UnknownBehavior:
+                append(-1)
+        return column
+
+
+_TENTHS = tuple(digit / 10 for digit in range(10))
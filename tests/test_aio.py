@@ -0,0 +1,185 @@
+# standard library
+import asyncio
+import datetime
+from unittest.mock import patch
+
+# third party
+import pytest
+
+# this package
+from health import aio
+from health import exceptions
+from health import weight_gurus
+from health.throttle import RateLimiterChain, TokenBucket
+from benchmarks.replay_server import ReplayServer, SyntheticAccount
+
+DAYS = [datetime.date(2021, 12, day).isoformat() for day in range(1, 11)]
+
+
+@pytest.fixture(scope="module")
+def server():
+    account = SyntheticAccount(years=1, end_date=datetime.date(2021, 12, 31))
+    with ReplayServer(account, throttle_rate=0.1) as replay:
+        yield replay
+
+
+@pytest.fixture
+def garmin(server):
+    garmin = server.garmin(rate_limiter=TokenBucket(rate=1000, capacity=1000))
+    assert garmin.login()
+    return garmin
+
+
+def run(client_factory, fetch, limit_per_host=aio.LIMIT_PER_HOST):
+    """Run fetch(client) on a fresh pool and event loop."""
+
+    async def main():
+        async with aio.ConnectionPool(limit_per_host) as pool:
+            return await fetch(client_factory(pool))
+
+    return asyncio.run(main())
+
+
+class TestAio:
+    """Test cases against the replay server."""
+
+    def test_heart_rates_match_threaded_client(self, garmin):
+        async def fetch(client):
+            return await asyncio.gather(*(client.get_heart_rates(day) for day in DAYS))
+
+        days = run(lambda pool: aio.AsyncGarmin(garmin, pool), fetch)
+        assert days == [garmin.get_heart_rates(day) for day in DAYS]
+
+    def test_garmin_datasets(self, garmin, server):
+        async def fetch(client):
+            return await asyncio.gather(
+                client.get_body_composition("2021-06-01", "2021-06-30"),
+                client.get_activities_by_date("2021-01-01", "2021-12-31", "cycling"),
+                client.get_resting_heart_rates("2021-12-01", "2021-12-10"),
+                client.get_sleep_night("2021-12-05"),
+            )
+
+        body_comp, activities, resting, night = run(
+            lambda pool: aio.AsyncGarmin(garmin, pool), fetch
+        )
+        assert [record.to_dict() for record in body_comp] == [
+            record.to_dict()
+            for record in garmin.get_body_composition("2021-06-01", "2021-06-30")
+        ]
+        assert activities == server.account.activity_list(
+            {
+                "startDate": "2021-01-01",
+                "endDate": "2021-12-31",
+                "activityType": "cycling",
+                "limit": 10**6,
+            }
+        )
+        assert resting == garmin.get_resting_heart_rates("2021-12-01", "2021-12-10")
+        assert night.to_dict() == garmin.get_sleep_night("2021-12-05").to_dict()
+
+    def test_weight_gurus_get_all(self, server):
+        with patch.object(
+            weight_gurus.WeightGurus, "api_url", server.weight_gurus_url
+        ), patch.dict(weight_gurus._TOKENS, clear=True):
+            client = weight_gurus.WeightGurus("user", "password")
+            data = run(
+                lambda pool: aio.AsyncWeightGurus(client, pool),
+                lambda client: client.get_all("2021-11-01T00:00:00.000Z"),
+            )
+            expected = client.get_all("2021-11-01T00:00:00.000Z")
+        assert len(data) > 25
+        assert [record.to_dict() for record in data] == [
+            record.to_dict() for record in expected
+        ]
+
+    def test_weight_gurus_retries_throttled_replies(self):
+        account = SyntheticAccount(years=1, end_date=datetime.date(2021, 12, 31))
+        with ReplayServer(account, throttle_rate=0.5) as server, patch.object(
+            weight_gurus.WeightGurus, "api_url", server.weight_gurus_url
+        ), patch.dict(weight_gurus._TOKENS, clear=True):
+            client = weight_gurus.WeightGurus("user", "password")
+            data = run(
+                lambda pool: aio.AsyncWeightGurus(client, pool),
+                lambda client: asyncio.gather(
+                    *(client.get_all("2021-12-01T00:00:00.000Z") for _ in range(5))
+                ),
+            )
+            assert server.throttled > 0
+        assert all(len(entries) == len(data[0]) > 25 for entries in data)
+
+    def test_concurrent_weight_gurus_calls_log_in_once(self, server):
+        post = aio.AsyncApiClient.post
+        logins = []
+
+        async def counting_post(client, url, *args, **kwargs):
+            logins.append(url)
+            return await post(client, url, *args, **kwargs)
+
+        with patch.object(
+            weight_gurus.WeightGurus, "api_url", server.weight_gurus_url
+        ), patch.dict(weight_gurus._TOKENS, clear=True), patch.object(
+            aio.AsyncApiClient, "post", counting_post
+        ):
+            client = weight_gurus.WeightGurus("user", "password")
+            run(
+                lambda pool: aio.AsyncWeightGurus(client, pool),
+                lambda client: asyncio.gather(
+                    *(client.get_all("2021-12-01T00:00:00.000Z") for _ in range(20))
+                ),
+            )
+        assert logins == ["account/login"]
+
+    def test_accounts_share_host_connections(self, server):
+        garmins = [server.garmin(f"user{number}") for number in range(4)]
+        global_limiter = TokenBucket(rate=1000, capacity=1000)
+        for garmin in garmins:
+            garmin.display_name = "replay-user"
+            garmin.modern_rest_client.rate_limiter = RateLimiterChain(
+                TokenBucket(rate=1000, capacity=1000), global_limiter
+            )
+        opened = []
+        open_connection = asyncio.open_connection
+
+        async def counting_open_connection(*args, **kwargs):
+            opened.append(args)
+            return await open_connection(*args, **kwargs)
+
+        async def fetch(clients):
+            return await asyncio.gather(
+                *(client.get_heart_rates(day) for client in clients for day in DAYS)
+            )
+
+        with patch.object(asyncio, "open_connection", counting_open_connection):
+            days = run(
+                lambda pool: [aio.AsyncGarmin(garmin, pool) for garmin in garmins],
+                fetch,
+                limit_per_host=3,
+            )
+        assert len(days) == 40
+        # every account went through the same three keep-alive connections
+        assert len(opened) <= 3
+
+    def test_error_status_raises(self, garmin):
+        async def fetch(client):
+            return await client.get_heart_rates("2021-12-01")
+
+        with patch.object(
+            garmin, "garmin_connect_heartrates_daily_url", "proxy/missing"
+        ), pytest.raises(exceptions.GarminConnectConnectionError):
+            run(lambda pool: aio.AsyncGarmin(garmin, pool), fetch)
+
+    def test_unreachable_host_raises_connection_error(self):
+        async def fetch(client):
+            return await client.get("path")
+
+        # nothing listens on port 9 of the loopback address
+        with pytest.raises(exceptions.WeightGurusConnectionError):
+            run(
+                lambda pool: aio.AsyncApiClient(
+                    pool,
+                    "127.0.0.1:9",
+                    scheme="http",
+                    error=exceptions.WeightGurusConnectionError,
+                ),
+                fetch,
+            )
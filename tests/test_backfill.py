@@ -0,0 +1,49 @@
+# third party
+import pytest
+
+# this package
+from health import backfill
+from health.store import HealthStore
+
+
+@pytest.fixture
+def store():
+    with HealthStore(":memory:") as db:
+        yield db
+
+
+class TestBackfill:
+    """Basic test cases."""
+
+    def test_plan_chunks(self):
+        assert backfill.plan_chunks("2021-01-01", "2021-01-25", chunk_days=10) == [
+            ("2021-01-01", "2021-01-10"),
+            ("2021-01-11", "2021-01-20"),
+            ("2021-01-21", "2021-01-25"),
+        ]
+
+    def test_resumes_after_failure(self, store):
+        chunks = backfill.plan_chunks("2021-01-01", "2021-01-30", chunk_days=10)
+        fetched = []
+
+        def failing_fetch(chunk_start, chunk_end):
+            if chunk_start == "2021-01-21":
+                raise RuntimeError("rate limited")
+            fetched.append(chunk_start)
+            return 0
+
+        with pytest.raises(RuntimeError):
+            backfill.run_backfill(store, "job", chunks, failing_fetch)
+
+        def fetch(chunk_start, chunk_end):
+            fetched.append(chunk_start)
+            return 0
+
+        assert backfill.run_backfill(store, "job", chunks, fetch) == 1
+        assert fetched == ["2021-01-01", "2021-01-11", "2021-01-21"]
+        assert backfill.run_backfill(store, "job", chunks, fetch) == 0
+
+    def test_chunk_reaching_today_is_not_checkpointed(self, store):
+        chunks = backfill.plan_chunks("2021-01-01", chunk_days=100000)
+        backfill.run_backfill(store, "job", chunks, lambda start, end: 0)
+        assert store.completed_chunks("job") == set()
@@ -0,0 +1,73 @@
+# standard library
+import datetime
+from unittest.mock import patch
+
+# third party
+import pytest
+
+# this package
+from health import batch
+from health.store import HealthStore
+from health.weight_gurus import WeightGurus
+from benchmarks.replay_server import ReplayServer, SyntheticAccount
+
+
+@pytest.fixture(scope="module")
+def server():
+    account = SyntheticAccount(years=1, end_date=datetime.date(2021, 12, 31))
+    with ReplayServer(account) as replay:
+        yield replay
+
+
+def make_account(name):
+    return {
+        "name": name,
+        "garmin": {"username": name, "password": "password"},
+        "weight-gurus": {"username": name, "password": "password"},
+    }
+
+
+class TestBatch:
+    """Basic test cases."""
+
+    def test_sync_accounts(self, server, tmp_path):
+        def replay_garmin(email, password, **kwargs):
+            return server.garmin(email, password, **kwargs)
+
+        accounts = [make_account("alice"), make_account("bob"), {"name": "broken"}]
+        with patch("health.health.Garmin", side_effect=replay_garmin), patch.object(
+            WeightGurus, "api_url", server.weight_gurus_url
+        ):
+            results = batch.sync_accounts(
+                accounts, tmp_path, "2021-12-01", global_rate=100, account_rate=50
+            )
+
+        assert [result.name for result in results] == ["alice", "bob", "broken"]
+        assert [result.ok for result in results] == [True, True, False]
+        with HealthStore(tmp_path / "bob.db") as store:
+            assert store.high_water_mark("garmin", "body_composition") >= "2021-12-31"
+
+    def test_names_with_path_separators_fail(self, tmp_path):
+        with patch("health.batch.Health") as health_class:
+            results = batch.sync_accounts(
+                [make_account("../escape"), make_account(".."), {}],
+                tmp_path / "stores",
+                "2021-12-01",
+            )
+        assert [result.ok for result in results] == [False, False, False]
+        assert "plain file name" in results[0].errors["account"]
+        health_class.assert_not_called()
+        assert not (tmp_path / "escape.db").exists()
+
+    def test_accounts_have_their_own_rate_limits(self, tmp_path):
+        with patch("health.batch.Health") as health_class:
+            batch.sync_accounts(
+                [make_account("alice"), make_account("bob")], tmp_path, "2021-12-01"
+            )
+        for service in ("garmin", "weight_gurus"):
+            alice, bob = (
+                call.kwargs[f"{service}_rate_limiter"].limiters
+                for call in health_class.call_args_list
+            )
+            # a bucket of its own per account, then the one shared by all
+            assert alice[0] is not bob[0] and alice[1] is bob[1]
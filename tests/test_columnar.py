@@ -0,0 +1,93 @@
+# standard library
+from array import array
+import datetime
+import math
+
+# third party
+import pytest
+
+# this package
+from health import columnar
+from health.data_models import BodyCompData, BodyCompSeries, HeartRateDay
+
+ACTIVITIES = [
+    {
+        "activityId": 2,
+        "activityName": "Évening Run",
+        "startTimeLocal": "2021-01-02 18:00:00",
+        "activityType": {"typeKey": "running"},
+        "distance": 5000.0,
+    },
+    {
+        "activityId": 1,
+        "activityName": "Morning Ride",
+        "startTimeLocal": "2021-01-01 07:00:00",
+        "activityType": {"typeKey": "cycling"},
+        "distance": 30000.0,
+        "averageHR": 140,
+    },
+]
+
+
+@pytest.fixture
+def series():
+    start = datetime.datetime(2021, 1, 1, 7, tzinfo=datetime.timezone.utc)
+    return BodyCompSeries.from_records(
+        BodyCompData(180 + day / 10, date=start + datetime.timedelta(days=day))
+        for day in range(60)
+    )
+
+
+class TestColumnar:
+    """Basic test cases."""
+
+    @pytest.mark.parametrize("compression", [None, "gzip", "lzma"])
+    def test_body_comp_round_trip(self, tmp_path, series, compression):
+        path = str(tmp_path / "body_composition.hcol")
+        assert columnar.write_body_comp(path, series, compression) == 60
+        with columnar.ColumnarFile(path) as export:
+            assert len(export) == 60
+            assert export.column("weight") == series.columns["weight"]
+            assert list(export.column("weight", "2021-01-03", "2021-01-04")) == [
+                180.2,
+                180.3,
+            ]
+            assert export.column("timestamp", "2022-01-01") == array("q")
+
+    def test_activities_keep_strings_and_missing_numbers(self, tmp_path):
+        path = str(tmp_path / "activities.hcol")
+        columnar.write_activities(path, ACTIVITIES, "gzip")
+        with columnar.ColumnarFile(path) as export:
+            columns = export.read(names=["name", "activity_id", "average_hr"])
+            assert columns["name"] == ["Morning Ride", "Évening Run"]
+            assert list(columns["activity_id"]) == [1, 2]
+            assert columns["average_hr"][0] == 140
+            assert math.isnan(columns["average_hr"][1])
+            assert export.column("activity_type", "2021-01-02") == ["running"]
+
+    def test_heart_rate_samples(self, tmp_path):
+        days = [
+            HeartRateDay(
+                "2021-01-01", 50, array("q", [0, 60000]), array("B", [60, 61])
+            ),
+            HeartRateDay("2021-01-02", 51, array("q", [86400000]), array("B", [62])),
+        ]
+        path = str(tmp_path / "heart_rate.hcol")
+        columnar.write_heart_rate_days(path, days)
+        with columnar.ColumnarFile(path) as export:
+            assert list(export.column("bpm", end=datetime.date(1970, 1, 1))) == [
+                60,
+                61,
+            ]
+
+    def test_rejects_unsorted_timestamps(self, tmp_path):
+        with pytest.raises(ValueError):
+            columnar.write_columns(
+                str(tmp_path / "bad.hcol"), {"timestamp": array("q", [2, 1])}
+            )
+
+    def test_rejects_other_files(self, tmp_path):
+        path = tmp_path / "other.hcol"
+        path.write_bytes(b"not a columnar export")
+        with pytest.raises(ValueError):
+            columnar.ColumnarFile(str(path))
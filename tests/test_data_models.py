@@ -0,0 +1,135 @@
+# standard library
+import datetime
+
+# third party
+import pytest
+
+# this package
+from health import data_models
+
+
+@pytest.fixture
+def garmin_series():
+    return data_models.BodyCompSeries.from_records(
+        [
+            data_models.BodyCompData(weight=181.0, date="2021-01-03"),
+            data_models.BodyCompData(weight=180.0, date="2021-01-01"),
+        ]
+    )
+
+
+@pytest.fixture
+def wg_series():
+    return data_models.BodyCompSeries.from_records(
+        [
+            data_models.BodyCompData(weight=180.5, date="2021-01-02T08:00:00.000Z"),
+            data_models.BodyCompData(weight=181.5, date="2021-01-04T08:00:00.123Z"),
+        ]
+    )
+
+
+class TestBodyCompSeries:
+    """Basic test cases."""
+
+    def test_from_records_sorts(self, garmin_series):
+        assert [record.weight for record in garmin_series] == [180.0, 181.0]
+
+    def test_merge_keeps_date_order(self, garmin_series, wg_series):
+        merged = wg_series.merge(garmin_series)
+        assert [record.weight for record in merged] == [180.0, 180.5, 181.0, 181.5]
+
+    def test_records_have_typed_dates(self, wg_series):
+        assert wg_series[-1].date == datetime.datetime(
+            2021, 1, 4, 8, 0, 0, 123000, tzinfo=datetime.timezone.utc
+        )
+
+    def test_fuse_one_record_per_weigh_in(self, garmin_series):
+        scale = data_models.BodyCompSeries.from_records(
+            [
+                data_models.BodyCompData(180.4, 20.1, date="2021-01-01T07:00:00Z"),
+                data_models.BodyCompData(-1, 20.5, date="2021-01-03T07:00:00Z"),
+                data_models.BodyCompData(182.0, 20.2, date="2021-01-05T07:00:00Z"),
+            ]
+        )
+        fused = scale.fuse(garmin_series, other_offset=datetime.timedelta(hours=12))
+        assert [(record.weight, record.body_fat) for record in fused] == [
+            (180.4, 20.1),
+            (181.0, 20.5),
+            (182.0, 20.2),
+        ]
+        assert fused[1].date.hour == 7
+
+    def test_fuse_prefers_nearest_and_keeps_order(self, garmin_series, wg_series):
+        fused = garmin_series.fuse(
+            wg_series, tolerance=datetime.timedelta(days=2), prefer_other=("weight",)
+        )
+        # 2021-01-02 pairs with the closer 2021-01-03 reading, not 2021-01-01
+        assert [record.weight for record in fused] == [180.0, 180.5, 181.5]
+        fused = garmin_series.fuse(wg_series, tolerance=datetime.timedelta(hours=1))
+        assert len(fused) == 4
+        assert [record.date for record in fused] == sorted(
+            record.date for record in fused
+        )
+
+    def test_between(self, garmin_series, wg_series):
+        merged = wg_series.merge(garmin_series)
+        window = merged.between("2021-01-02", "2021-01-03")
+        assert [record.weight for record in window] == [180.5, 181.0]
+
+    def test_between_includes_the_whole_end_day(self, garmin_series, wg_series):
+        merged = wg_series.merge(garmin_series)
+        window = merged.between("2021-01-01", "2021-01-02")
+        assert [record.weight for record in window] == [180.0, 180.5]
+        assert len(merged.between(end="2021-01-02T07:59:59Z")) == 1
+
+    def test_record_without_date_raises(self):
+        with pytest.raises(ValueError, match="need a date"):
+            data_models.BodyCompSeries.from_records([data_models.BodyCompData(180.0)])
+
+    def test_append_out_of_order_raises(self, garmin_series):
+        with pytest.raises(ValueError):
+            garmin_series.append(data_models.BodyCompData(date="2020-01-01"))
+
+    def test_to_dict_formats_date(self, wg_series):
+        assert wg_series[0].to_dict()["date"] == "2021-01-02T08:00:00.000Z"
+
+
+@pytest.fixture
+def heart_rate_json():
+    return {
+        "calendarDate": "2021-01-01",
+        "restingHeartRate": 52,
+        "heartRateValues": [
+            [1609459200000, 55],
+            [1609459320000, None],
+            [1609459440000, 140],
+            [1609459560000, 20],
+        ],
+    }
+
+
+class TestHeartRateDay:
+    """Basic test cases."""
+
+    def test_from_json_drops_missing_samples(self, heart_rate_json):
+        day = data_models.HeartRateDay.from_json(heart_rate_json)
+        assert list(day.bpm) == [55, 140, 20]
+        assert day.timestamps.typecode == "q"
+        assert day.bpm.typecode == "B"
+
+    def test_between_bpm(self, heart_rate_json):
+        day = data_models.HeartRateDay.from_json(heart_rate_json).between_bpm(30, 220)
+        assert list(day.timestamps) == [1609459200000, 1609459440000]
+
+    def test_clean_heart_rate_days(self, heart_rate_json):
+        empty = dict(heart_rate_json, heartRateValues=None)
+        high_resting = dict(heart_rate_json, restingHeartRate=95)
+        days = [
+            data_models.HeartRateDay.from_json(item)
+            for item in (heart_rate_json, empty, high_resting)
+        ]
+        assert data_models.clean_heart_rate_days(days) == days[:1]
+        assert data_models.remove_sparse_heart_rate_days(days, min_samples=2) == [
+            days[0],
+            days[2],
+        ]
@@ -0,0 +1,33 @@
+# third party
+import pytest
+
+# this package
+from health import fetcher
+from health import exceptions
+from health.helpers import date_range
+
+
+class TestFetcher:
+    """Basic test cases."""
+
+    def test_fetch_by_date_keeps_date_order(self):
+        dates = date_range("2020-02-27", "2020-03-02")
+        result = fetcher.fetch_by_date(lambda date: date, dates)
+        assert result == [
+            "2020-02-27",
+            "2020-02-28",
+            "2020-02-29",
+            "2020-03-01",
+            "2020-03-02",
+        ]
+
+    def test_fetch_by_date_leaves_retries_to_the_client(self):
+        calls = []
+
+        def fetch(date):
+            calls.append(date)
+            raise exceptions.GarminConnectTooManyRequestsError("Too many requests")
+
+        with pytest.raises(exceptions.GarminConnectTooManyRequestsError):
+            fetcher.fetch_by_date(fetch, ["2020-01-01"])
+        assert calls == ["2020-01-01"]
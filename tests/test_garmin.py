@@ -0,0 +1,143 @@
+# standard library
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+import json
+from unittest.mock import MagicMock, patch
+
+# third party
+import pytest
+
+# this package
+from health import garmin as garmin_module
+from health.helpers import write_ndjson
+
+
+def activity_list(total, cap=None):
+    """Return a fake activity-list client serving total activities.
+
+    cap is the largest page the server returns, whatever limit is asked for.
+    """
+    activities = [{"activityId": activity_id} for activity_id in range(total)]
+
+    def get(url, params=None):
+        start, limit = int(params["start"]), int(params["limit"])
+        limit = min(limit, cap or limit)
+        response = MagicMock()
+        response.json.return_value = activities[start : start + limit]
+        return response
+
+    client = MagicMock()
+    client.get.side_effect = get
+    return client
+
+
+@pytest.fixture
+def garmin():
+    return garmin_module.Garmin("username", "password")
+
+
+class TestGarmin:
+    """Basic test cases."""
+
+    def test_session_round_trip(self, garmin, tmp_path):
+        session_file = tmp_path / "session.json"
+        garmin.session.cookies.set("SESSIONID", "abc", domain="connect.garmin.com")
+        garmin.display_name = "display"
+        garmin.full_name = "Full Name"
+        garmin.unit_system = "statute_us"
+        garmin.save_session(session_file)
+
+        restored = garmin_module.Garmin("username", "password")
+        assert restored.load_session(session_file)
+        assert restored.display_name == "display"
+        assert restored.session.cookies.get("SESSIONID") == "abc"
+
+    def test_session_of_another_account_is_rejected(self, garmin, tmp_path):
+        session_file = tmp_path / "session.json"
+        garmin.session.cookies.set("SESSIONID", "abc", domain="connect.garmin.com")
+        garmin.display_name = "display"
+        garmin.save_session(session_file)
+
+        other = garmin_module.Garmin("other", "password")
+        assert not other.load_session(session_file)
+        assert other.display_name is None
+        assert other.session.cookies.get("SESSIONID") is None
+
+    def test_gm_nums_to_lbs_floats(self, garmin):
+        assert list(garmin._gm_nums_to_lbs_floats([81000, None])) == [
+            garmin._gm_num_to_lbs_float(81000),
+            -1,
+        ]
+
+    def test_load_missing_session(self, garmin, tmp_path):
+        assert not garmin.load_session(tmp_path / "missing.json")
+
+    def test_iter_activities_by_date_pages(self, garmin):
+        garmin.modern_rest_client = activity_list(65)
+        activities = garmin.iter_activities_by_date("2021-01-01", "2021-12-31", None)
+        assert next(activities) == {"activityId": 0}
+        assert garmin.modern_rest_client.get.call_count == 1
+        assert len(list(activities)) == 64
+        # pages of 20, 40 and a short final page; no empty page is requested
+        assert garmin.modern_rest_client.get.call_count == 3
+
+    def test_iter_activities_by_date_prefetch(self, garmin):
+        garmin.modern_rest_client = activity_list(500)
+        activities = garmin.iter_activities_by_date(
+            "2021-01-01", "2021-12-31", "cycling", prefetch=4, max_limit=50
+        )
+        assert [activity["activityId"] for activity in activities] == list(range(500))
+
+    @pytest.mark.parametrize("prefetch", [1, 3])
+    def test_iter_activities_by_date_capped_pages(self, garmin, prefetch):
+        garmin.modern_rest_client = activity_list(500, cap=30)
+        activities = garmin.iter_activities_by_date(
+            "2021-01-01", "2021-12-31", None, prefetch=prefetch
+        )
+        assert [activity["activityId"] for activity in activities] == list(range(500))
+
+    @pytest.mark.parametrize("total, requests", [(0, 1), (3, 2), (20, 2)])
+    def test_short_listings_are_not_prefetched(self, garmin, total, requests):
+        garmin.modern_rest_client = activity_list(total)
+        activities = garmin.iter_activities_by_date(
+            "2021-01-01", "2021-12-31", None, prefetch=4
+        )
+        assert len(list(activities)) == total
+        assert garmin.modern_rest_client.get.call_count == requests
+
+    def test_iter_activities_by_date_close_cancels_prefetch(self, garmin):
+        garmin.modern_rest_client = activity_list(500)
+        futures = []
+        submit = ThreadPoolExecutor.submit
+
+        def recording_submit(executor, *args):
+            futures.append(submit(executor, *args))
+            return futures[-1]
+
+        with patch.object(ThreadPoolExecutor, "submit", recording_submit), patch.object(
+            Future, "cancel", autospec=True
+        ) as cancel:
+            activities = garmin.iter_activities_by_date(
+                "2021-01-01", "2021-12-31", None, prefetch=3
+            )
+            # the first activity of the third page, with the fourth in flight
+            assert next(islice(activities, 60, None)) == {"activityId": 60}
+            activities.close()
+        assert len(futures) == 4
+        assert [call.args[0] for call in cancel.call_args_list] == futures[3:]
+
+    def test_iter_activities_by_date_resumes(self, garmin):
+        garmin.modern_rest_client = activity_list(30)
+        activities = garmin.iter_activities_by_date(
+            "2021-01-01", "2021-12-31", None, start=25
+        )
+        ids = [activity["activityId"] for activity in activities]
+        assert ids == list(range(25, 30))
+
+    def test_write_ndjson_streams(self, garmin, tmp_path):
+        garmin.modern_rest_client = activity_list(23)
+        output = tmp_path / "cycling.ndjson"
+        activities = garmin.iter_activities_by_date("2021-01-01", "2021-12-31", None)
+        assert write_ndjson(output, activities) == 23
+        lines = output.read_text().splitlines()
+        assert json.loads(lines[-1]) == {"activityId": 22}
@@ -1,5 +1,19 @@
 # standard library
+from datetime import timedelta
 import unittest
+from unittest.mock import patch
+
+# this package
+from health import health
+from health import exceptions
+from health.store import HealthStore
+from health.weight_gurus import WeightGurus
+
+USER_INFO = {
+    "garmin": {"username": "garmin-user", "password": "garmin-pass"},
+    "weight-gurus": {"username": "wg-user", "password": "wg-pass"},
+}
+
 
 class TestHealth(unittest.TestCase):
     """Basic test cases."""
@@ -7,6 +21,151 @@ class TestHealth(unittest.TestCase):
     def test_absolute_truth_and_meaning(self):
         assert True
 
+    @patch("health.health.Garmin")
+    def test_garmin_session_is_shared(self, garmin_class):
+        garmin_class.return_value.load_session.return_value = False
+        user_health = health.Health(USER_INFO, garmin_session_file=None)
+        user_health.get_activities("cycling", "2021-01-01", "2021-01-31")
+        user_health._get_garmin_body_comp_data("2021-01-01")
+        garmin_class.assert_called_once()
+        garmin_class.return_value.login.assert_called_once()
+
+    @patch("health.health.Garmin")
+    def test_garmin_logs_in_again_after_401(self, garmin_class):
+        garmin = garmin_class.return_value
+        garmin.load_session.return_value = True
+        garmin.get_body_composition.side_effect = [
+            exceptions.GarminConnectAuthenticationError("Authentication error"),
+            [],
+        ]
+        user_health = health.Health(USER_INFO, garmin_session_file="session.json")
+        with patch.object(garmin, "save_session"):
+            assert user_health._get_garmin_body_comp_data("2021-01-01") == []
+        garmin.login.assert_called_once()
+
+    @patch("health.health.Garmin")
+    def test_query_reads_the_store(self, garmin_class):
+        user_health = health.Health(USER_INFO, garmin_session_file=None)
+        with HealthStore(":memory:") as store:
+            store.put(
+                "weight-gurus",
+                "body_composition",
+                [
+                    (
+                        "2021-03-02T07:00:00.000Z",
+                        "",
+                        {"weight": 180.4, "date": "2021-03-02T07:00:00.000Z"},
+                    )
+                ],
+            )
+            store.put(
+                "garmin",
+                "body_composition",
+                [
+                    (day, "", {"weight": weight, "date": day})
+                    for day, weight in (
+                        ("2021-02-27T00:00:00.000Z", 181.0),
+                        ("2021-03-02T00:00:00.000Z", 180.3),
+                        ("2021-03-04T00:00:00.000Z", 179.9),
+                    )
+                ],
+            )
+            store.put(
+                "garmin",
+                "heart_rate",
+                [
+                    (
+                        "2021-03-03",
+                        "",
+                        {"calendarDate": "2021-03-03", "restingHeartRate": 52},
+                    )
+                ],
+            )
+            assert user_health.query(store, "weight", "2021-03-01", "2021-03-04") == [
+                ("2021-03-02T07:00:00.000Z", 180.4),
+                ("2021-03-04T00:00:00.000Z", 179.9),
+            ]
+            assert user_health.query(store, "resting_heart_rate", "2021-03-01") == [
+                ("2021-03-03", 52)
+            ]
+            # later queries read the rollup, not the raw heart-rate payloads
+            with patch.object(store, "load", side_effect=AssertionError), patch.object(
+                store, "index", wraps=store.index
+            ) as index:
+                assert user_health.query(store, "resting_heart_rate") == [
+                    ("2021-03-03", 52)
+                ]
+            assert all(call.args[0] == "rollup" for call in index.call_args_list)
+        garmin_class.assert_not_called()
+
+    @patch("health.health.Garmin")
+    def test_weekly_weight_rollup(self, garmin_class):
+        user_health = health.Health(USER_INFO, garmin_session_file=None)
+        with HealthStore(":memory:") as store:
+            store.put(
+                "weight-gurus",
+                "body_composition",
+                [
+                    (day, "", {"weight": weight, "date": day})
+                    for day, weight in (
+                        ("2021-03-01T07:00:00.000Z", 181.0),
+                        ("2021-03-05T07:00:00.000Z", 180.0),
+                        ("2021-03-08T07:00:00.000Z", 179.0),
+                    )
+                ],
+            )
+            assert user_health.update_rollups(store) == 2
+            weeks = user_health.query(store, "weight_weekly")
+            assert [week for week, _ in weeks] == ["2021-03-01", "2021-03-08"]
+            assert weeks[0][1]["mean_weight"] == 180.5
+            assert weeks[0][1]["change"] == -1.0
+
+            store.delete("weight-gurus", "body_composition", "2021-03-08T07:00:00.000Z")
+            assert user_health.update_rollups(store) == 1
+            assert len(user_health.query(store, "weight_weekly")) == 1
+
+    @patch("health.store.PUT_BATCH_SIZE", 2)
+    @patch("health.health.WeightGurus")
+    @patch("health.health.Garmin")
+    def test_sync_applies_late_deletes_after_put(self, garmin_class, wg_class):
+        garmin_class.return_value.get_body_composition.return_value = []
+        garmin_class.return_value.iter_activities_by_date.return_value = iter(())
+
+        def operation(operation_type, weight, day, entry_day=None):
+            return {
+                "operationType": operation_type,
+                "weight": weight,
+                "bodyFat": 200,
+                "muscleMass": 400,
+                "water": 550,
+                "bmi": 250,
+                "serverTimestamp": f"2021-03-{day:02d}T07:00:00.000Z",
+                "entryTimestamp": f"2021-03-{entry_day or day:02d}T07:00:00.000Z",
+            }
+
+        operations = [operation("create", 1800, 1)]
+        operations += [operation("create", 1810 + day, day) for day in range(2, 9)]
+        # a reading of the same weight is still pending when the delete arrives
+        operations.append(operation("create", 1800, 9))
+        operations.append(operation("delete", 1800, 10, entry_day=1))
+
+        def iter_all(startdate, on_late_delete=None, is_stored=None):
+            reconciled = WeightGurus._reconcile_operations(
+                iter(operations), timedelta(days=2), on_late_delete, is_stored
+            )
+            return (WeightGurus._parse_operation(op) for op in reconciled)
+
+        wg_class.return_value.iter_all.side_effect = iter_all
+        user_health = health.Health(USER_INFO, garmin_session_file=None)
+        with HealthStore(":memory:") as store:
+            errors = user_health.sync(store, "2021-03-01", activity_types=())
+            assert errors == {}
+            dates = store.dates("weight-gurus", "body_composition")
+        # the first reading was yielded several put batches before its delete
+        assert dates[0] == "2021-03-02T07:00:00.000Z"
+        assert dates[-1] == "2021-03-09T07:00:00.000Z"
+        assert len(dates) == 8
+
 
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
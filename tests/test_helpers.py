@@ -0,0 +1,56 @@
+# standard library
+import json
+
+# third party
+import pytest
+
+# this package
+from health import helpers
+
+
+class TestHelpers:
+    """Basic test cases."""
+
+    @pytest.mark.parametrize("chunk_size", [1, 5, 64, 10**6])
+    def test_iter_json_array(self, chunk_size):
+        payload = {
+            "meta": {"count": 3},
+            "operations": [{"weight": 1800 + i, "note": "é" * i} for i in range(3)],
+        }
+        raw = json.dumps(payload, ensure_ascii=False).encode()
+        chunks = [raw[i : i + chunk_size] for i in range(0, len(raw), chunk_size)]
+        assert (
+            list(helpers.iter_json_array(chunks, "operations")) == payload["operations"]
+        )
+
+    def test_iter_json_array_truncated(self):
+        with pytest.raises(ValueError):
+            list(
+                helpers.iter_json_array(
+                    [b'{"operations": [{"a": 1}, {"b"'], "operations"
+                )
+            )
+
+    def test_iter_json_array_number_split_across_chunks(self):
+        chunks = [b'{"operations": [12', b"34, 5]}"]
+        assert list(helpers.iter_json_array(chunks, "operations")) == [1234, 5]
+
+    @pytest.mark.parametrize("chunk_size", [1, 4, 1024])
+    def test_iter_json_array_skips_nested_keys(self, chunk_size):
+        raw = b'{"x": {"operations": []}, "y": "operations", "operations": [1, 2]}'
+        chunks = [raw[i : i + chunk_size] for i in range(0, len(raw), chunk_size)]
+        assert list(helpers.iter_json_array(chunks, "operations")) == [1, 2]
+
+    def test_date_range(self):
+        assert helpers.date_range("2020-12-31", "2021-01-02") == [
+            "2020-12-31",
+            "2021-01-01",
+            "2021-01-02",
+        ]
+
+    def test_millis_round_trip(self):
+        assert helpers.to_millis("1970-01-02") == 86400000
+        millis = helpers.to_millis("2021-03-02T07:00:00.250Z")
+        assert helpers.format_timestamp(helpers.from_millis(millis)) == (
+            "2021-03-02T07:00:00.250Z"
+        )
@@ -0,0 +1,126 @@
+# standard library
+import datetime
+import json
+import subprocess
+import sys
+from unittest.mock import patch
+
+# this package
+from health import main
+from health.store import HealthStore
+from health.weight_gurus import WeightGurus
+from benchmarks.replay_server import ReplayServer, SyntheticAccount
+
+USER_INFO = {
+    "garmin": {"username": "user", "password": "password"},
+    "weight-gurus": {"username": "user", "password": "password"},
+}
+
+
+class TestMain:
+    """Basic test cases."""
+
+    def test_importing_health_skips_api_clients(self):
+        code = (
+            "import sys, health.main, health.health; "
+            "print(sorted({'requests', 'cloudscraper'} & set(sys.modules)))"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        ).stdout
+        assert output.strip() == "[]"
+
+    def test_backfill_defaults_to_every_metric(self):
+        args = main.build_parser().parse_args(["backfill"])
+        assert args.command is main.backfill and args.only is None
+
+    def test_query_reads_only_the_store(self, tmp_path, capsys):
+        # a dashboard host has a store but no credentials
+        user_info = tmp_path / "missing_user_info.json"
+        store_path = str(tmp_path / "health.db")
+        with HealthStore(store_path) as store:
+            store.put(
+                "garmin",
+                "heart_rate",
+                [
+                    (
+                        "2021-01-01",
+                        "",
+                        {"calendarDate": "2021-01-01", "restingHeartRate": 50},
+                    ),
+                    (
+                        "2021-01-02",
+                        "",
+                        {"calendarDate": "2021-01-02", "restingHeartRate": 52},
+                    ),
+                ],
+            )
+        status = main.main(
+            [
+                "--user-info",
+                str(user_info),
+                "--store",
+                store_path,
+                "--metrics-file",
+                str(tmp_path / "metrics.json"),
+                "query",
+                "resting_heart_rate",
+                "--start",
+                "2021-01-02",
+            ]
+        )
+        assert status == main.EXIT_SUCCESS
+        assert capsys.readouterr().out == '["2021-01-02", 52]\n'
+
+    def test_rollups_need_no_credentials(self, tmp_path):
+        status = main.main(
+            [
+                "--user-info",
+                str(tmp_path / "missing_user_info.json"),
+                "--store",
+                str(tmp_path / "health.db"),
+                "--metrics-file",
+                str(tmp_path / "metrics.json"),
+                "rollups",
+            ]
+        )
+        assert status == main.EXIT_SUCCESS
+
+    def test_no_subcommand_exports_json(self):
+        args = main.build_parser().parse_args([])
+        assert args.command is main.export
+        assert (args.format, args.compression) == ("json", None)
+
+    def test_default_export_writes_every_file(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "pulledData").mkdir()
+        (tmp_path / "user_info.json").write_text(json.dumps(USER_INFO))
+        account = SyntheticAccount(years=1, end_date=datetime.date(2019, 6, 30))
+        with ReplayServer(account) as server, patch(
+            "health.health.Garmin", side_effect=server.garmin
+        ), patch.object(WeightGurus, "api_url", server.weight_gurus_url):
+            status = main.main([])
+        assert status == main.EXIT_SUCCESS
+        body_composition = json.loads(
+            (tmp_path / "pulledData" / "body_composition.json").read_text()
+        )
+        assert len(body_composition) == 181
+        for activity_type in ("cycling", "running"):
+            lines = (tmp_path / "pulledData" / f"{activity_type}.ndjson").read_text()
+            assert len(lines.splitlines()) > 30
+        assert (tmp_path / "pulledData" / "metrics.json").exists()
+
+    def test_metrics_do_not_need_pulled_data(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "user_info.json").write_text(json.dumps(USER_INFO))
+        account = SyntheticAccount(years=1, end_date=datetime.date(2019, 6, 30))
+        sleep = ["garmin", "sleep", "--start", "2019-06-25", "--end", "2019-06-30"]
+        with ReplayServer(account) as server, patch(
+            "health.health.Garmin", side_effect=server.garmin
+        ):
+            status = main.main(sleep + ["-o", "sleep.ndjson"])
+            assert status == main.EXIT_SUCCESS
+            assert (tmp_path / "pulledData" / "metrics.json").exists()
+            # a metrics file that cannot be written only logs a warning
+            status = main.main(["--metrics-file", str(tmp_path)] + sleep)
+        assert status == main.EXIT_SUCCESS
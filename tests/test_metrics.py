@@ -0,0 +1,73 @@
+# standard library
+import json
+from unittest.mock import MagicMock, patch
+
+# third party
+import pytest
+import requests
+
+# this package
+from health import metrics
+from health import throttle
+from health.garmin import ApiClient
+
+
+@pytest.fixture
+def registry():
+    return metrics.Metrics()
+
+
+def make_response(status_code, content=b"{}"):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    return response
+
+
+class TestMetrics:
+    """Basic test cases."""
+
+    def test_histogram_is_cumulative(self):
+        histogram = metrics.Histogram((1, 10))
+        for value in (0.5, 5, 50):
+            histogram.observe(value)
+        assert histogram.cumulative() == [(1, 1), (10, 2), (float("inf"), 3)]
+
+    def test_dump_json(self, registry, tmp_path):
+        registry.record("GET example.com/a", 0.2, 2048, 200, retries=1)
+        registry.dump(tmp_path / "metrics.json")
+        dumped = json.loads((tmp_path / "metrics.json").read_text())
+        assert dumped["GET example.com/a"]["statuses"] == {"200": 1}
+        assert dumped["GET example.com/a"]["retries"] == 1
+
+    def test_prometheus_text(self, registry):
+        registry.record("GET example.com/a", 0.2, 2048, 200)
+        text = registry.to_prometheus()
+        assert (
+            'health_http_request_duration_seconds_bucket{endpoint="GET example.com/a",'
+            'le="0.25"} 1' in text
+        )
+        assert (
+            'health_http_requests_total{endpoint="GET example.com/a",status="200"} 1'
+            in text
+        )
+
+    def test_redact(self):
+        redacted = metrics.redact(
+            {"Authorization": "Bearer x", "password": "y", "a": 1}
+        )
+        assert redacted == {"Authorization": "***", "password": "***", "a": 1}
+
+    @patch("health.garmin.time.sleep")
+    def test_api_client_records_retries(self, sleep, registry):
+        session = MagicMock()
+        session.request.side_effect = [make_response(503), make_response(200, b"abc")]
+        client = ApiClient(
+            session, "example.com", retry_policy=throttle.RetryPolicy(max_retries=1)
+        )
+        with patch("health.garmin.METRICS", registry):
+            client.get("users/someone", endpoint="users")
+        stats = registry.to_dict()["GET example.com/users"]
+        assert stats["retries"] == 1
+        assert stats["statuses"] == {"200": 1}
+        assert stats["response_bytes"]["sum"] == 3
@@ -0,0 +1,29 @@
+# standard library
+import threading
+
+# this package
+from health import orchestrator
+
+
+class TestOrchestrator:
+    """Basic test cases."""
+
+    def test_tasks_run_concurrently(self):
+        barrier = threading.Barrier(3, timeout=5)
+        tasks = {name: barrier.wait for name in ("body", "cycling", "running")}
+        results, errors = orchestrator.run_concurrently(tasks)
+        assert set(results) == {"body", "cycling", "running"}
+        assert errors == {}
+
+    def test_errors_do_not_cancel_other_tasks(self):
+        def fail():
+            raise ValueError("boom")
+
+        finished = []
+        results, errors = orchestrator.run_concurrently(
+            {"fails": fail, "works": lambda: 42},
+            on_done=lambda name, result: finished.append(name),
+        )
+        assert results == {"works": 42}
+        assert isinstance(errors["fails"], ValueError)
+        assert finished == ["works"]
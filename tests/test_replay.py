@@ -0,0 +1,107 @@
+# standard library
+import datetime
+from unittest.mock import patch
+
+# third party
+import pytest
+
+# this package
+from health.health import Health
+from health.store import HealthStore
+from health import weight_gurus
+from health.weight_gurus import WeightGurus
+from benchmarks.replay_server import ReplayServer, SyntheticAccount
+
+USER_INFO = {
+    "garmin": {"username": "user", "password": "password"},
+    "weight-gurus": {"username": "user", "password": "password"},
+}
+
+
+@pytest.fixture(scope="module")
+def server():
+    account = SyntheticAccount(years=1, end_date=datetime.date(2021, 12, 31))
+    with ReplayServer(account, throttle_rate=0.1) as replay:
+        yield replay
+
+
+@pytest.fixture
+def throttled_server():
+    account = SyntheticAccount(years=1, end_date=datetime.date(2021, 12, 31))
+    with ReplayServer(account, throttle_rate=0.5) as replay:
+        yield replay
+
+
+@pytest.fixture
+def health(server):
+    with patch("health.health.Garmin", side_effect=server.garmin), patch.object(
+        WeightGurus, "api_url", server.weight_gurus_url
+    ):
+        yield Health(USER_INFO, garmin_session_file=None)
+
+
+class TestReplay:
+    """End-to-end test cases against the replay server."""
+
+    def test_body_comp_data(self, health, server):
+        data = health.get_body_comp_data("2021-06-01")
+        dates = [record.date for record in data]
+        assert dates == sorted(dates)
+        # one fused record per day although both services report each weigh-in
+        days = (server.account.end_date - datetime.date(2021, 6, 1)).days + 1
+        assert len(data) == len({record.date.date() for record in data}) == days
+        assert sum(record.body_fat != -1 for record in data) > 0.9 * len(data)
+
+    def test_activities(self, health, server):
+        activities = health.get_activities("cycling", "2021-01-01", "2021-12-31")
+        expected = server.account.activity_list(
+            {
+                "startDate": "2021-01-01",
+                "endDate": "2021-12-31",
+                "activityType": "cycling",
+                "limit": 10**6,
+            }
+        )
+        assert activities == expected
+
+    def test_heart_rate_backfill(self, health):
+        days = health.get_heart_rate_days("2021-12-01", "2021-12-10")
+        assert [day.date for day in days][:2] == ["2021-12-01", "2021-12-02"]
+        assert len(days) == 10
+
+    def test_sleep_data_skips_stored_nights(self, health, server):
+        with HealthStore(":memory:") as store:
+            nights = health.get_sleep_data("2021-12-06", "2021-12-13", store=store)
+            server.reset_counters()
+            again = health.get_sleep_data("2021-12-06", "2021-12-13", store=store)
+            # nights without a recording are stored as such, so nothing is
+            # asked for again
+            assert len(nights) < 8 and server.requests == 0
+        assert [night.to_dict() for night in again] == [
+            night.to_dict() for night in nights
+        ]
+        dates = [night.date for night in nights]
+        assert dates == sorted(dates) and len(dates) > 3
+        night = nights[0]
+        assert night.stage_starts[0] == night.start
+        assert night.stage_ends[-1] == night.end
+
+    def test_resting_heart_rates(self, health, server):
+        server.reset_counters()
+        resting = health.get_resting_heart_rates("2021-03-01", "2021-05-31")
+        assert len(resting) == 92
+        assert resting == {
+            date: server.account.resting_heart_rate(date) for date in resting
+        }
+        # two range requests plus one per day the range left out, not 92
+        assert server.requests < 20
+
+    def test_weight_gurus_retries_throttled_replies(self, throttled_server):
+        with patch.object(
+            WeightGurus, "api_url", throttled_server.weight_gurus_url
+        ), patch.dict(weight_gurus._TOKENS, clear=True):
+            client = WeightGurus("user", "password")
+            data = client.get_all("2021-12-01T00:00:00.000Z")
+            streamed = list(client.iter_all("2021-12-01T00:00:00.000Z"))
+        assert throttled_server.throttled > 0
+        assert len(data) == len(streamed) > 25
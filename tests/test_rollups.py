@@ -0,0 +1,85 @@
+# third party
+import pytest
+
+# this package
+from health import rollups
+from health.data_models import HeartRateDay
+from health.store import HealthStore
+
+
+def heart_rate_day(date, resting, values):
+    return {
+        "calendarDate": date,
+        "restingHeartRate": resting,
+        "heartRateValues": [
+            [index * 60000, value] for index, value in enumerate(values)
+        ],
+    }
+
+
+def first_day(store, first, last):
+    days = store.load("garmin", "heart_rate", first, last)
+    return {"samples": len(days[0]["heartRateValues"])} if days else None
+
+
+ROLLUP = rollups.Rollup(
+    "heart_rate_test", (("garmin", "heart_rate"),), rollups.day_bucket, first_day
+)
+
+
+@pytest.fixture
+def store():
+    with HealthStore(":memory:") as db:
+        yield db
+
+
+class TestRollups:
+    """Basic test cases."""
+
+    def test_week_bucket(self):
+        assert rollups.week_bucket("2021-03-03T07:00:00.000Z") == (
+            "2021-03-01",
+            "2021-03-07",
+        )
+        assert rollups.week_bucket("2021-03-07") == ("2021-03-01", "2021-03-07")
+
+    def test_only_changed_buckets_are_recomputed(self, store):
+        store.put(
+            "garmin",
+            "heart_rate",
+            [
+                (
+                    f"2021-03-0{day}",
+                    "",
+                    heart_rate_day(f"2021-03-0{day}", 50, [60] * day),
+                )
+                for day in (1, 2, 3)
+            ],
+        )
+        assert rollups.update_rollup(store, ROLLUP) == 3
+        assert rollups.update_rollup(store, ROLLUP) == 0
+
+        store.put(
+            "garmin",
+            "heart_rate",
+            [("2021-03-02", "", heart_rate_day("2021-03-02", 50, [60]))],
+        )
+        store.delete("garmin", "heart_rate", "2021-03-03")
+        assert rollups.update_rollup(store, ROLLUP) == 2
+        assert store.load("rollup", "heart_rate_test") == [
+            {"samples": 1},
+            {"samples": 1},
+        ]
+        assert rollups.update_rollup(store, ROLLUP, full=True) == 2
+
+    def test_daily_heart_rate(self):
+        day = HeartRateDay.from_json(
+            heart_rate_day("2021-03-01", 48, [60, 90, None, 120])
+        )
+        assert rollups.daily_heart_rate(day) == {
+            "resting_heart_rate": 48,
+            "samples": 3,
+            "min_bpm": 60,
+            "max_bpm": 120,
+            "mean_bpm": 90,
+        }
@@ -0,0 +1,64 @@
+# third party
+import pytest
+
+# this package
+from health import store as health_store
+
+
+@pytest.fixture
+def store():
+    with health_store.HealthStore(":memory:") as db:
+        yield db
+
+
+class TestHealthStore:
+    """Basic test cases."""
+
+    def test_high_water_mark_empty(self, store):
+        assert store.high_water_mark("garmin", "cycling") is None
+
+    def test_put_is_idempotent(self, store):
+        records = [("2021-01-02", "", {"weight": 180.0})]
+        store.put("garmin", "body_composition", records)
+        store.put("garmin", "body_composition", records)
+        assert store.load("garmin", "body_composition") == [{"weight": 180.0}]
+
+    def test_high_water_mark_and_range(self, store):
+        store.put(
+            "weight-gurus",
+            "body_composition",
+            [
+                ("2021-01-01T08:00:00.000Z", "", {"weight": 181.0}),
+                ("2021-03-05T08:00:00.000Z", "", {"weight": 179.5}),
+                ("2021-02-10T08:00:00.000Z", "", {"weight": 180.2}),
+            ],
+        )
+        assert (
+            store.high_water_mark("weight-gurus", "body_composition")
+            == "2021-03-05T08:00:00.000Z"
+        )
+        loaded = store.load(
+            "weight-gurus", "body_composition", "2021-02-01", "2021-03-05"
+        )
+        assert loaded == [{"weight": 180.2}, {"weight": 179.5}]
+
+    def test_index_range(self, store):
+        store.put(
+            "garmin",
+            "heart_rate",
+            [(f"2021-01-{day:02d}", "", {"day": day}) for day in range(1, 11)],
+        )
+        index = store.index("garmin", "heart_rate")
+        days = index.range("2021-01-03", "2021-01-05")
+        assert [payload["day"] for _, payload in days] == [3, 4, 5]
+        assert store.index("garmin", "heart_rate") is index
+
+    def test_index_is_rebuilt_after_writes(self, store):
+        store.put("garmin", "heart_rate", [("2021-01-01", "", {"day": 1})])
+        assert len(store.index("garmin", "heart_rate")) == 1
+        store.put("garmin", "heart_rate", [("2021-01-02", "", {"day": 2})])
+        assert len(store.index("garmin", "heart_rate")) == 2
+        store.delete("garmin", "heart_rate", "2021-01-01")
+        assert store.index("garmin", "heart_rate").range() == [
+            ("2021-01-02", {"day": 2})
+        ]
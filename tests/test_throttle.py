@@ -0,0 +1,73 @@
+# standard library
+from unittest.mock import MagicMock, patch
+
+# third party
+import pytest
+import requests
+
+# this package
+from health import exceptions
+from health import throttle
+from health.garmin import ApiClient
+
+
+def make_response(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response._content = b"{}"
+    return response
+
+
+@pytest.fixture
+def session():
+    return MagicMock()
+
+
+class TestThrottle:
+    """Basic test cases."""
+
+    def test_retry_after_seconds(self):
+        policy = throttle.RetryPolicy(max_delay=30)
+        response = make_response(429, {"Retry-After": "7"})
+        assert policy.delay(0, response) == 7
+
+    def test_backoff_is_capped(self):
+        policy = throttle.RetryPolicy(base_delay=1, max_delay=4)
+        assert all(0 <= policy.delay(10) <= 4 for _ in range(50))
+
+    def test_token_bucket_halves_rate_when_throttled(self):
+        bucket = throttle.TokenBucket(rate=8, capacity=1)
+        bucket.throttled()
+        assert bucket.rate == 4
+        bucket.succeeded()
+        assert bucket.rate > 4
+
+    @patch("health.garmin.time.sleep")
+    def test_api_client_retries_429(self, sleep, session):
+        session.request.side_effect = [
+            make_response(429, {"Retry-After": "2"}),
+            make_response(200),
+        ]
+        client = ApiClient(
+            session, "example.com", retry_policy=throttle.RetryPolicy(max_retries=3)
+        )
+        assert client.get("path").status_code == 200
+        sleep.assert_called_once_with(2)
+
+    @patch("health.garmin.time.sleep")
+    def test_api_client_gives_up(self, sleep, session):
+        session.request.return_value = make_response(429)
+        client = ApiClient(
+            session, "example.com", retry_policy=throttle.RetryPolicy(max_retries=2)
+        )
+        with pytest.raises(exceptions.GarminConnectTooManyRequestsError):
+            client.get("path")
+        assert session.request.call_count == 3
+
+    def test_token_bucket_reserve_hands_out_successive_slots(self):
+        bucket = throttle.TokenBucket(rate=10, capacity=1)
+        delays = [bucket.reserve() for _ in range(3)]
+        assert delays[0] == 0
+        assert delays[1] == pytest.approx(0.1, abs=0.01)
+        assert delays[2] == pytest.approx(0.2, abs=0.01)
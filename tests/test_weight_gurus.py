@@ -1,5 +1,9 @@
 # standard library
-from unittest.mock import patch
+from datetime import datetime, timedelta
+from itertools import islice
+import json
+import time
+from unittest.mock import MagicMock, patch
 
 # third party
 import pytest
@@ -14,6 +18,26 @@ def weight_guru():
     return weight_gurus.WeightGurus("username", "password")
 
 
+@pytest.fixture
+def session():
+    """Patch the shared session with a mock and clear the token cache."""
+    mock_session = MagicMock()
+    with patch.object(weight_gurus, "_SESSION", mock_session), patch.dict(
+        weight_gurus._TOKENS, clear=True
+    ):
+        yield mock_session
+
+
+def _reply(status_code, payload):
+    response = MagicMock()
+    response.status_code = status_code
+    response.json.return_value = payload
+    response.content = b"{}"
+    if status_code >= 400:
+        response.raise_for_status.side_effect = weight_gurus.requests.HTTPError()
+    return response
+
+
 
 class TestWeightGuru():
     """Basic test cases."""
@@ -24,3 +48,166 @@ class TestWeightGuru():
     def test_wg_num_to_float_raises(self, weight_guru):
         with pytest.raises(exceptions.UnknownBehavior):
             weight_guru._wg_num_to_float("1") 
+
+    def test_wg_nums_to_floats_matches_scalar(self, weight_guru):
+        numbers = [2141, "2141", 10, 999, "12a", None, 1805]
+        assert list(weight_guru._wg_nums_to_floats(numbers)) == [
+            weight_guru._wg_num_to_float(number) for number in numbers
+        ]
+
+    def test_wg_nums_to_floats_masks_small_readings(self, weight_guru):
+        assert list(weight_guru._wg_nums_to_floats([0, 5, "7", 1805])) == [
+            -1,
+            -1,
+            -1,
+            180.5,
+        ]
+
+    def test_operations_to_series(self, weight_guru):
+        readings = {"bodyFat": 200, "muscleMass": 400, "water": 550}
+        operations = [
+            dict(
+                readings, weight=1812, bmi="2x", entryTimestamp="2021-01-02T08:00:00Z"
+            ),
+            dict(readings, weight=1805, bmi=245, entryTimestamp="2021-01-01T08:00:00Z"),
+        ]
+        series = weight_guru.operations_to_series(operations)
+        assert list(series.columns["weight"]) == [180.5, 181.2]
+        assert list(series.mask("bmi")) == [1, 0]
+
+    def test_remove_deleted_operations(self, weight_guru):
+        operations = [
+            _operation("create", 1800, "2021-01-01T08:00:00Z"),
+            _operation("create", 1795, "2021-01-02T08:00:00Z"),
+            _operation("delete", 1800, "2021-01-03T08:00:00Z"),
+            _operation("delete", 1795, "2021-01-04T08:00:00Z"),
+            _operation("create", 1790, "2021-01-05T08:00:00Z"),
+        ]
+        result = weight_guru._remove_deleted_operations(operations)
+        assert [operation["weight"] for operation in result] == [1790]
+
+    def test_delete_only_cancels_earlier_create(self, weight_guru):
+        operations = [
+            _operation("delete", 1800, "2021-01-01T08:00:00Z"),
+            _operation("create", 1800, "2021-01-02T08:00:00Z"),
+        ]
+        result = weight_guru._remove_deleted_operations(operations)
+        assert result == [operations[1]]
+
+    def test_delete_prefers_matching_entry(self, weight_guru):
+        first = _operation("create", 1800, "2021-01-01T08:00:00Z")
+        second = _operation("create", 1800, "2021-01-02T08:00:00Z")
+        deleted = _operation("delete", 1800, "2021-01-03T08:00:00Z")
+        deleted["entryTimestamp"] = first["entryTimestamp"]
+        result = weight_guru._remove_deleted_operations([first, second, deleted])
+        assert result == [second]
+
+    def test_token_is_cached_across_instances(self, session):
+        expires = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + 3600))
+        session.request.return_value = _reply(
+            200, {"accessToken": "token", "expiresAt": expires}
+        )
+        weight_gurus.WeightGurus("username", "password")._do_login()
+        other = weight_gurus.WeightGurus("username", "password")
+        other._do_login()
+        assert session.request.call_count == 1
+        assert other.headers == {"authorization": "Bearer token"}
+
+    def test_expired_token_logs_in_again(self, session):
+        session.request.return_value = _reply(
+            200, {"accessToken": "token", "expiresAt": "2000-01-01T00:00:00Z"}
+        )
+        weight_gurus.WeightGurus("username", "password")._do_login()
+        weight_gurus.WeightGurus("username", "password")._do_login()
+        assert session.request.call_count == 2
+
+    def test_bad_login_raises(self, weight_guru, session):
+        session.request.return_value = _reply(401, {})
+        with pytest.raises(exceptions.WeightGurusAuthenticationError):
+            weight_guru._do_login()
+
+    def test_bad_reply_raises(self, weight_guru, session):
+        session.request.return_value = _reply(500, {})
+        with pytest.raises(exceptions.WeightGurusConnectionError):
+            weight_guru._get_weight_history("2021-01-01")
+
+    def test_reconcile_operations_online(self, weight_guru):
+        operations = [
+            _operation("create", 1800, "2021-01-01T08:00:00Z"),
+            _operation("create", 1795, "2021-03-01T08:00:00Z"),
+            _operation("delete", 1795, "2021-03-01T09:00:00Z"),
+            _operation("delete", 1800, "2021-04-01T08:00:00Z"),
+            _operation("create", 1790, "2021-04-02T08:00:00Z"),
+        ]
+        late = []
+        result = weight_guru._reconcile_operations(
+            iter(operations), timedelta(days=30), on_late_delete=late.append
+        )
+        assert [operation["weight"] for operation in result] == [1800, 1790]
+        assert late == [operations[3]]
+
+    def test_reconcile_delete_of_stored_entry_is_late(self, weight_guru):
+        operations = [
+            _operation("create", 1800, "2021-04-01T08:00:00Z"),
+            dict(
+                _operation("delete", 1800, "2021-04-01T09:00:00Z"),
+                entryTimestamp="2021-01-01T08:00:00Z",
+            ),
+        ]
+        late = []
+        result = weight_guru._reconcile_operations(
+            iter(operations),
+            timedelta(days=30),
+            on_late_delete=late.append,
+            is_stored=lambda operation: True,
+        )
+        assert list(result) == [operations[0]]
+        assert late == [operations[1]]
+
+    def test_reconcile_remembers_only_the_window(self, weight_guru):
+        start = datetime(2021, 1, 1, 8)
+        operations = (
+            _operation("create", 1800, f"{start + timedelta(days=day):%Y-%m-%dT%H:%MZ}")
+            for day in range(400)
+        )
+        result = weight_guru._reconcile_operations(operations, timedelta(days=30))
+        assert len(list(islice(result, 300))) == 300
+        # entries yielded more than a window ago are left to is_stored
+        assert sum(result.gi_frame.f_locals["yielded"].values()) <= 31
+
+    def test_iter_all_streams(self, weight_guru, session):
+        history = _reply(200, None)
+        history.headers = {}
+        body = json.dumps(
+            {
+                "operations": [
+                    dict(
+                        _operation(
+                            "create", 1800 + day, f"2021-01-{day:02d}T08:00:00Z"
+                        ),
+                        bodyFat=200,
+                        muscleMass=400,
+                        water=550,
+                        bmi=250,
+                    )
+                    for day in range(1, 29)
+                ]
+            }
+        ).encode()
+        history.iter_content.return_value = [
+            body[start : start + 100] for start in range(0, len(body), 100)
+        ]
+        session.request.side_effect = [_reply(200, {"accessToken": "token"}), history]
+        entries = list(weight_guru.iter_all("2021-01-01"))
+        assert len(entries) == 28
+        assert entries[-1].weight == 182.8
+        assert session.request.call_args.kwargs["stream"]
+
+
+def _operation(operation_type, weight, server_timestamp):
+    return {
+        "operationType": operation_type,
+        "weight": weight,
+        "serverTimestamp": server_timestamp,
+        "entryTimestamp": server_timestamp,
+    }